@@ -0,0 +1,50 @@
+#-*- coding: utf-8 -*-
+"""
+The signature helpers as they were before ShaSigner and the payment form as
+it was built before get_form_class(), kept as the baselines of the
+signature and checkout benchmarks.
+"""
+import hashlib
+
+from django import forms
+from django.forms.forms import DeclarativeFieldsMetaclass
+
+from shop_postfinance.forms import ValueHiddenInput
+
+
+def security_check(data, secret_key):
+    cap_data = {}
+    string_list = []
+    for key, val in data.items():
+        cap_data[key.upper()] = val
+    for key in sorted(cap_data.keys()):
+        if key != 'SHASIGN':
+            string_list.append("%s=%s" % (key, cap_data[key]))
+    hash_string = secret_key.join(string_list)
+    hash_string = "%s%s" % (hash_string, secret_key)
+    s = hashlib.sha1()
+    s.update(hash_string.encode('utf8'))
+    return s.hexdigest().upper() == data['SHASIGN']
+
+
+def compute_security_checksum(secret_key, **data):
+    contents = dict([(key.upper(), value) for key, value in data.items()])
+    hash_string = ""
+    for key, value in sorted(contents.items()):
+        hash_string += "%s=%s%s" % (key, value, secret_key)
+    return hashlib.sha1(hash_string.encode('utf8')).hexdigest().upper()
+
+
+def get_form(backend, request, order, prefix=None, **fields):
+    """
+    OffsitePostfinanceBackend.get_form(), building a new form class on every
+    call.
+    """
+    initial = backend.get_form_initial(request, order, **fields)
+
+    fields = {}
+    for key in initial:
+        fields[key] = forms.CharField(widget=ValueHiddenInput())
+
+    form_class = DeclarativeFieldsMetaclass('PostfinanceForm', (forms.Form,), fields)
+    return form_class(initial=initial, prefix=prefix)
@@ -0,0 +1,516 @@
+#-*- coding: utf-8 -*-
+"""
+Benchmarks of the checkout and notification paths of shop_postfinance.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --ledger-rows 1000000 --compare results.json
+
+Every benchmark runs against benchmarks.settings (SQLite, or PostgreSQL with
+BENCH_DB_ENGINE=postgresql) and the in-memory shop in benchmarks.shop. The
+results are written as JSON; --compare prints the change against an earlier
+run and exits with status 1 if anything got slower than --tolerance allows.
+
+On Django >= 3.1 the sync views are compared with the async ones; set
+BENCH_SHOP_LATENCY (e.g. 0.05) to see how both cope with a slow shop.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from optparse import OptionParser
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
+
+try:
+    from urllib.parse import urlencode
+except ImportError:  # Python 2
+    from urllib import urlencode
+
+from benchmarks import legacy
+from benchmarks.urls import backend
+from shop_postfinance.models import get_ledger_model
+from shop_postfinance.paymentlinks import PaymentLinkBuilder, generate_links
+from shop_postfinance.utils import compute_security_checksum, get_signer, security_check
+
+IPN_URL = '/pay/instantpaymentnotification/'
+SUCCESS_URL = '/pay/success/'
+# What postfinance sends. The async test client can't send multipart bodies on
+# every Django version, so the concurrency benchmarks post this for both views.
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+def create_schema():
+    call_command('migrate', run_syncdb=True, interactive=False, verbosity=0)
+
+
+def measure(func, iterations):
+    """
+    Calls ``func`` ``iterations`` times, returns throughput and latency
+    percentiles.
+    """
+    durations = []
+    started = default_timer()
+    for i in range(iterations):
+        start = default_timer()
+        func(i)
+        durations.append(default_timer() - start)
+    total = default_timer() - started
+    durations.sort()
+
+    def percentile(p):
+        return durations[min(len(durations) - 1, int(len(durations) * p))] * 1000
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total,
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def ipn_payload(order_id, status='9', pay_id=None):
+    data = {
+        'orderID': order_id, 'currency': 'CHF', 'amount': '54',
+        'PM': 'CreditCard', 'ACCEPTANCE': 'test123', 'STATUS': status,
+        'CARDNO': 'XXXXXXXXXXXX3333', 'ED': '0317', 'CN': 'Testauzore Testos',
+        'TRXDATE': '11/08/10', 'PAYID': pay_id or '8628366', 'NCERROR': '0',
+        'BRAND': 'VISA', 'IPCTY': 'CH', 'CCCTY': 'US', 'ECI': '7',
+        'CVCCheck': 'NO', 'AAVCheck': 'NO', 'VC': 'NO', 'IP': '84.226.127.220',
+    }
+    data['SHASIGN'] = get_signer(settings.POSTFINANCE_SHAOUT_KEY).sign(data)
+    return data
+
+
+def bench_checkout(iterations):
+    request = RequestFactory().get('/pay/')
+    order = backend.shop.get_order(request)
+    results = {}
+    results['get_form_initial'] = measure(
+        lambda i: backend.get_form_initial(request, order), iterations)
+    results['legacy_get_form'] = measure(
+        lambda i: legacy.get_form(backend, request, order), iterations)
+    results['get_form'] = measure(
+        lambda i: backend.get_form(request, order), iterations)
+    results['legacy_get_form_rendered'] = measure(
+        lambda i: render_to_string('shop_postfinance/payment.html',
+                                   {'form': legacy.get_form(backend, request, order)}),
+        iterations)
+    results['get_form_rendered'] = measure(
+        lambda i: render_to_string('shop_postfinance/payment.html',
+                                   {'form': backend.get_form(request, order)}),
+        iterations)
+    results['get_form_html'] = measure(
+        lambda i: backend.get_form_html(request, order), iterations)
+    return results
+
+
+IMPORT_SCRIPT = '''
+import os, sys
+from timeit import default_timer
+os.environ['DJANGO_SETTINGS_MODULE'] = %r
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+modules = len(sys.modules)
+start = default_timer()
+from shop_postfinance.offsite_postfinance import get_backend
+imported = default_timer()
+get_backend()
+print('%%r %%r %%r' %% (imported - start, default_timer() - imported, len(sys.modules) - modules))
+'''
+
+
+def bench_startup(iterations, processes=10):
+    """
+    What a fresh process (management command, queue worker) pays to import
+    the backend module and build its first backend, and what every later
+    instantiation costs.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+    script = IMPORT_SCRIPT % os.environ['DJANGO_SETTINGS_MODULE']
+    runs = []
+    for i in range(processes):
+        output = subprocess.check_output([sys.executable, '-c', script], env=env)
+        runs.append([float(value) for value in output.split()])
+    runs.sort()
+    import_time, first_backend, modules = runs[len(runs) // 2]
+    from shop_postfinance.offsite_postfinance import OffsitePostfinanceBackend
+    return {
+        'import_backend_module': {'processes': processes, 'ms': import_time * 1000,
+                                  'ops_per_sec': 1 / import_time,
+                                  'modules_loaded': int(modules)},
+        'first_backend': {'processes': processes, 'ms': first_backend * 1000,
+                          'ops_per_sec': 1 / first_backend},
+        'backend_init': measure(
+            lambda i: OffsitePostfinanceBackend(shop=backend.shop), iterations),
+    }
+
+
+def bench_payment_links(count, processes):
+    from benchmarks.shop import BenchmarkOrder
+    builder = PaymentLinkBuilder.from_settings(base_url='https://shop.example.com')
+    results = {}
+    for workers in sorted(set((1, processes))):
+        orders = (BenchmarkOrder('link-%s' % i) for i in range(count))
+        started = default_timer()
+        for link in generate_links(orders, backend.shop, builder, processes=workers):
+            pass
+        total = default_timer() - started
+        results['processes_%s' % workers] = {
+            'links': count, 'ops_per_sec': count / total, 'total_s': total}
+    return results
+
+
+def bench_signatures(iterations):
+    results = {}
+    secret_key = settings.POSTFINANCE_SHAOUT_KEY
+    for size in (5, 20, 100):
+        data = dict(('PARAM%03d' % n, 'value %s' % n) for n in range(size))
+        data['SHASIGN'] = get_signer(secret_key).sign(data)
+        results['security_check_%s' % size] = measure(
+            lambda i: security_check(data, secret_key), iterations)
+        results['legacy_security_check_%s' % size] = measure(
+            lambda i: legacy.security_check(data, secret_key), iterations)
+        del data['SHASIGN']
+        results['compute_security_checksum_%s' % size] = measure(
+            lambda i: compute_security_checksum(**data), iterations)
+        results['legacy_compute_security_checksum_%s' % size] = measure(
+            lambda i: legacy.compute_security_checksum(
+                settings.POSTFINANCE_SECRET_KEY, **data), iterations)
+    return results
+
+
+def bench_ipn(iterations, prefix):
+    client = Client()
+    results = {}
+    results['fresh'] = measure(
+        lambda i: client.post(IPN_URL, ipn_payload('%s-fresh-%s' % (prefix, i))),
+        iterations)
+    duplicate = ipn_payload('%s-duplicate' % prefix)
+    client.post(IPN_URL, duplicate)
+    results['duplicate'] = measure(
+        lambda i: client.post(IPN_URL, duplicate), iterations)
+    invalid = dict(ipn_payload('%s-invalid' % prefix), SHASIGN='0' * 40)
+    results['invalid_signature'] = measure(
+        lambda i: client.post(IPN_URL, invalid), iterations)
+    return results
+
+
+def bench_ipn_flood(iterations, flood_threads=2):
+    """
+    Genuine notifications sent while ``flood_threads`` threads send forged
+    ones (bad signatures, replays of an accepted notification) from other
+    addresses, without and with the filters of shop_postfinance.ipn_filter.
+    """
+    replayed = ipn_payload('flood-replayed')
+    Client().post(IPN_URL, replayed)
+    forged = dict(ipn_payload('flood-forged'), SHASIGN='0' * 40)
+    scenarios = (
+        ('unfiltered', {'POSTFINANCE_IPN_REPLAY_CACHE_SIZE': 0}),
+        ('filtered', {'POSTFINANCE_IPN_ALLOWED_IPS': ['192.0.2.0/24'],
+                      'POSTFINANCE_IPN_RATE_LIMIT': (50, 100)}),
+    )
+    results = {}
+    for name, overrides in scenarios:
+        with override_settings(**overrides):
+            stop = threading.Event()
+            flooded = []
+
+            def flood(n):
+                client = Client(REMOTE_ADDR='203.0.113.%s' % n)
+                count = 0
+                try:
+                    while not stop.is_set():
+                        client.post(IPN_URL, replayed if count % 2 else forged)
+                        count += 1
+                finally:
+                    flooded.append(count)
+                    connection.close()
+            threads = [threading.Thread(target=flood, args=(n,)) for n in range(flood_threads)]
+            for thread in threads:
+                thread.start()
+            client = Client(REMOTE_ADDR='192.0.2.10')
+            try:
+                results[name] = measure(
+                    lambda i: client.post(IPN_URL, ipn_payload('flood-%s-%s' % (name, i))),
+                    iterations)
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            results[name]['flood_requests'] = sum(flooded)
+    return results
+
+
+def bench_success_return(iterations):
+    """
+    The customer's return to the success page followed by PostFinance's
+    notification of the same payment, with the success view recording the
+    payment and with it only checking the signature.
+    """
+    client = Client()
+    results = {}
+    for records in (True, False):
+        name = 'records' if records else 'verify_only'
+        backend.success_view_records = records
+        try:
+            payloads = [ipn_payload('return-%s-%s' % (name, i)) for i in range(iterations)]
+            results['success_%s' % name] = measure(
+                lambda i: client.get(SUCCESS_URL, payloads[i]), iterations)
+            results['ipn_after_success_%s' % name] = measure(
+                lambda i: client.post(IPN_URL, payloads[i]), iterations)
+        finally:
+            backend.success_view_records = True
+    return results
+
+
+def bench_outbox(requests, batch_size=100):
+    """
+    A burst of ``requests`` notifications confirming payments with a shop
+    that writes to the database, confirmed inline and through the outbox
+    (the IPNs, then the dispatcher draining it).
+    """
+    from shop_postfinance.outbox import ConfirmationDispatcher
+
+    client = Client()
+    results = {}
+    backend.shop.persist = True
+    try:
+        backend.confirmation_outbox = False
+        results['inline'] = measure(
+            lambda i: client.post(IPN_URL, ipn_payload('outbox-inline-%s' % i)),
+            requests)
+        backend.confirmation_outbox = True
+        results['outbox_ipn'] = measure(
+            lambda i: client.post(IPN_URL, ipn_payload('outbox-queued-%s' % i)),
+            requests)
+        dispatcher = ConfirmationDispatcher(backend, batch_size=batch_size)
+        started = default_timer()
+        dispatcher.run()
+        total = default_timer() - started
+        results['outbox_dispatch'] = {
+            'requests': dispatcher.stats['done'],
+            'batch_size': batch_size,
+            'ops_per_sec': dispatcher.stats['done'] / total,
+            'errors': dispatcher.stats['retried'] + dispatcher.stats['dead'],
+        }
+    finally:
+        backend.confirmation_outbox = False
+        backend.shop.persist = False
+    return results
+
+
+def prefill_ledger(rows, chunk_size=10000):
+    ledger = get_ledger_model()
+    existing = ledger.objects.count()
+    for start in range(existing, rows, chunk_size):
+        ledger.objects.bulk_create([
+            ledger.from_data(dict(ipn_payload('prefill-%s' % n), PAYID=str(n)))
+            for n in range(start, min(rows, start + chunk_size))
+        ])
+
+
+def bench_concurrent_duplicates(threads, requests_per_thread):
+    backend.shop.reset()
+    data = ipn_payload('concurrent', pay_id='424242')
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Event()
+
+    def worker():
+        client = Client()
+        barrier.wait()
+        try:
+            for i in range(requests_per_thread):
+                status = client.post(IPN_URL, data).status_code
+                with lock:
+                    statuses.append(status)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    started = default_timer()
+    barrier.set()
+    for thread in workers:
+        thread.join()
+    total = default_timer() - started
+    confirmations = [c for c in backend.shop.confirmations if c[0] == 'concurrent']
+    return {
+        'threads': threads,
+        'requests': len(statuses),
+        'ops_per_sec': len(statuses) / total,
+        'errors': len([s for s in statuses if s != 200]),
+        'confirmations': len(confirmations),
+        'ledger_rows': get_ledger_model().objects.filter(orderID='concurrent').count(),
+    }
+
+
+def bench_sync_concurrency(concurrency, requests):
+    """
+    ``requests`` fresh notifications sent to the synchronous views by
+    ``concurrency`` threads, like a WSGI server with that many threads.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def post(i):
+        try:
+            return Client().post(IPN_URL, urlencode(ipn_payload('sync-%s' % i)),
+                                 content_type=FORM_CONTENT_TYPE).status_code
+        finally:
+            connection.close()
+    pool = ThreadPool(concurrency)
+    started = default_timer()
+    statuses = pool.map(post, range(requests))
+    total = default_timer() - started
+    pool.close()
+    return {'concurrency': concurrency, 'requests': requests,
+            'ops_per_sec': requests / total,
+            'errors': len([s for s in statuses if s != 200])}
+
+
+def bench_async_concurrency(concurrency, requests):
+    """
+    ``requests`` fresh notifications sent to the async views, ``concurrency``
+    of them in flight at any time, on a single event loop.
+    """
+    import asyncio
+    from asgiref.sync import ThreadSensitiveContext
+    from django.test import AsyncClient
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(i):
+            async with semaphore:
+                # What the ASGI handler does for every request.
+                async with ThreadSensitiveContext():
+                    response = await AsyncClient().post(
+                        '/pay-async/instantpaymentnotification/',
+                        urlencode(ipn_payload('async-%s' % i)),
+                        content_type=FORM_CONTENT_TYPE)
+                return response.status_code
+        return await asyncio.gather(*[post(i) for i in range(requests)])
+    started = default_timer()
+    statuses = asyncio.run(run())
+    total = default_timer() - started
+    return {'concurrency': concurrency, 'requests': requests,
+            'ops_per_sec': requests / total,
+            'errors': len([s for s in statuses if s != 200])}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the throughput change of every benchmark present in both runs and
+    returns the names of those that got slower than ``tolerance`` allows.
+    """
+    regressions = []
+    for group, benchmarks in sorted(results['results'].items()):
+        for name, result in sorted(benchmarks.items()):
+            old = baseline.get('results', {}).get(group, {}).get(name)
+            if not (old and 'ops_per_sec' in old and 'ops_per_sec' in result):
+                continue
+            change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+            flag = ''
+            if change < -tolerance:
+                flag = '  REGRESSION'
+                regressions.append('%s.%s' % (group, name))
+            print('%-45s %+7.1f%%%s' % ('%s.%s' % (group, name), change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--iterations', type='int', default=2000,
+                      help='Iterations of the in-process benchmarks.')
+    parser.add_option('--ipn-iterations', type='int', default=500,
+                      help='Requests per IPN benchmark.')
+    parser.add_option('--ledger-rows', type='int', default=100000,
+                      help='Size of the pre-filled ledger (e.g. 1000000).')
+    parser.add_option('--threads', type='int', default=16,
+                      help='Threads of the concurrent duplicate benchmark.')
+    parser.add_option('--sync-threads', type='int', default=4,
+                      help='Threads serving the sync views (default 4).')
+    parser.add_option('--async-concurrency', type='int', default=100,
+                      help='Notifications in flight on the async views.')
+    parser.add_option('--links', type='int', default=100000,
+                      help='Payment links generated by the batch benchmark.')
+    parser.add_option('--link-processes', type='int', default=4,
+                      help='Processes signing payment links (default 4).')
+    parser.add_option('--output', default=None,
+                      help='Write the results to this JSON file.')
+    parser.add_option('--compare', default=None,
+                      help='Compare the results with an earlier JSON file.')
+    parser.add_option('--tolerance', type='float', default=0.1,
+                      help='Accepted slowdown when comparing (default 0.1).')
+    options, args = parser.parse_args(argv)
+
+    create_schema()
+    results = {}
+    results['startup'] = bench_startup(options.iterations)
+    results['checkout'] = bench_checkout(options.iterations)
+    results['signatures'] = bench_signatures(options.iterations)
+    results['payment_links'] = bench_payment_links(options.links, options.link_processes)
+    results['ipn_empty_ledger'] = bench_ipn(options.ipn_iterations, 'empty')
+    results['success_return'] = bench_success_return(options.ipn_iterations)
+    results['ipn_flood'] = bench_ipn_flood(options.ipn_iterations)
+    results['outbox'] = bench_outbox(options.ipn_iterations)
+    prefill_ledger(options.ledger_rows)
+    results['ipn_full_ledger'] = bench_ipn(options.ipn_iterations, 'full')
+    results['concurrency'] = {
+        'duplicate_ipn': bench_concurrent_duplicates(options.threads, 10),
+        'sync_views': bench_sync_concurrency(options.sync_threads, options.ipn_iterations),
+    }
+    if django.VERSION >= (3, 1):
+        results['concurrency']['async_views'] = bench_async_concurrency(
+            options.async_concurrency, options.ipn_iterations)
+
+    output = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'ledger_rows': get_ledger_model().objects.count(),
+            'options': vars(options),
+        },
+        'results': results,
+    }
+    serialized = json.dumps(output, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(serialized)
+    else:
+        print(serialized)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if compare(output, baseline, options.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
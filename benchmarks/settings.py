@@ -0,0 +1,67 @@
+#-*- coding: utf-8 -*-
+"""
+Settings of the benchmark project. SQLite is used unless BENCH_DB_ENGINE is
+set to 'postgresql' (connection parameters are then read from the usual PG*
+environment variables), BENCH_COMPACT_LEDGER=1 records notifications in the
+compact ledger.
+"""
+import os
+import tempfile
+
+SECRET_KEY = 'benchmark'
+DEBUG = False
+ALLOWED_HOSTS = ['testserver']
+USE_TZ = True
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'django.contrib.sessions',
+    'shop_postfinance',
+)
+
+if os.environ.get('BENCH_DB_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('PGDATABASE', 'shop_postfinance_bench'),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+        }
+    }
+else:
+    # A file, not :memory:, so that the threads of the concurrency benchmark
+    # share the database.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.mkdtemp(), 'bench.sqlite3'),
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+
+# Large enough that the state and duplicate caches aren't culled mid-run.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    }
+}
+
+ROOT_URLCONF = 'benchmarks.urls'
+TEMPLATE_DIRS = ()
+TEMPLATES = [{
+    'BACKEND': 'django.template.backends.django.DjangoTemplates',
+    'APP_DIRS': True,
+}]
+MIDDLEWARE_CLASSES = ()
+MIDDLEWARE = ()
+
+POSTFINANCE_SHOP_INTERFACE = 'benchmarks.shop.BenchmarkShop'
+POSTFINANCE_PSP_ID = 'benchmarkPSPID'
+POSTFINANCE_SECRET_KEY = 'sha-in-secret-key'
+POSTFINANCE_SHAOUT_KEY = 'sha-out-secret-key'
+POSTFINANCE_CURRENCY = 'CHF'
+POSTFINANCE_COMPACT_LEDGER = os.environ.get('BENCH_COMPACT_LEDGER') == '1'
@@ -0,0 +1,61 @@
+#-*- coding: utf-8 -*-
+"""
+A minimal in-memory implementation of django-SHOP's shop interface.
+BENCH_SHOP_LATENCY (in seconds) makes order lookups that slow, like a shop
+with a busy database. With ``persist`` set, every confirmation also writes a
+row (a session, standing in for the shop's order update).
+"""
+import os
+import threading
+import time
+from decimal import Decimal
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.timezone import now
+
+
+class BenchmarkOrder(object):
+
+    def __init__(self, order_id, total=Decimal('54.00')):
+        self.id = order_id
+        self.total = total
+
+
+class BenchmarkShop(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.confirmations = []
+        self.latency = float(os.environ.get('BENCH_SHOP_LATENCY', 0))
+        self.persist = False
+
+    def get_order(self, request):
+        return BenchmarkOrder('checkout')
+
+    def get_order_for_id(self, order_id):
+        if self.latency:
+            time.sleep(self.latency)
+        if order_id.startswith('unknown'):
+            raise ObjectDoesNotExist(order_id)
+        return BenchmarkOrder(order_id)
+
+    def get_order_unique_id(self, order):
+        return order.id
+
+    def get_order_total(self, order):
+        return order.total
+
+    def confirm_payment(self, order, amount, transaction_id, backend_name):
+        if self.persist:
+            from django.contrib.sessions.models import Session
+            Session.objects.create(session_key='order-%s' % order.id,
+                                   session_data=transaction_id, expire_date=now())
+        with self.lock:
+            self.confirmations.append((order.id, amount, transaction_id))
+
+    def get_finished_url(self):
+        return '/finished/'
+
+    def reset(self):
+        with self.lock:
+            self.confirmations = []
@@ -0,0 +1,26 @@
+#-*- coding: utf-8 -*-
+import django
+try:
+    from django.urls import include, re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import include, url
+from django.http import HttpResponse
+
+from shop_postfinance.offsite_postfinance import get_backend
+
+backend = get_backend()
+
+
+def cart_delete(request):
+    return HttpResponse('')
+
+
+urlpatterns = [
+    url(r'^pay/', include(backend.get_urls())),
+    url(r'^cart/delete/$', cart_delete, name='cart_delete'),
+]
+
+if django.VERSION >= (3, 1):
+    # Namespaced, so that reverse('postfinance_success') keeps finding /pay/.
+    urlpatterns.append(url(r'^pay-async/', include(
+        (backend.get_async_urls(), 'postfinance_async'))))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""
+Runs the test suite of shop_postfinance: python runtests.py [test labels]
+"""
+import sys
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        SECRET_KEY='tests',
+        INSTALLED_APPS=(
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'django.contrib.sessions',
+            'django.contrib.messages',
+            'django.contrib.admin',
+            'shop_postfinance',
+        ),
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3'}},
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+        ROOT_URLCONF='shop_postfinance.tests.urls',
+        MIDDLEWARE=(
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'django.contrib.messages.middleware.MessageMiddleware',
+        ),
+        TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+            'OPTIONS': {'context_processors': (
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            )},
+        }],
+        POSTFINANCE_SHOP_INTERFACE='shop_postfinance.tests.shop.TestShop',
+        POSTFINANCE_PSP_ID='testPSPID',
+        POSTFINANCE_SECRET_KEY='sha-in-secret-key',
+        POSTFINANCE_SHAOUT_KEY='sha-out-secret-key',
+        POSTFINANCE_CURRENCY='CHF',
+    )
+
+
+def main(labels):
+    django.setup()
+    from django.test.utils import get_runner
+    runner = get_runner(settings)()
+    return runner.run_tests(labels or ['shop_postfinance'])
+
+
+if __name__ == '__main__':
+    sys.exit(bool(main(sys.argv[1:])))
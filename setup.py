@@ -16,8 +16,11 @@ setup(
     platforms=['OS Independent'],
     classifiers=CLASSIFIERS,
     install_requires=[
-        'Django>=1.2',
+        'Django>=1.8',
     ],
-    packages=find_packages(exclude=["example", "example.*"]),
+    extras_require={
+        'directlink': ['requests'],
+    },
+    packages=find_packages(exclude=["example", "example.*", "benchmarks", "benchmarks.*"]),
     zip_safe = False
 )
@@ -1 +1,4 @@
-__version__ = '0.3.1'
\ No newline at end of file
+__version__ = '0.3.1'
+
+# Django >= 1.7
+default_app_config = 'shop_postfinance.apps.ShopPostfinanceConfig'
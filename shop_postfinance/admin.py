@@ -1,7 +1,22 @@
 #-*- coding: utf-8 -*-
+import csv
+from decimal import Decimal
 
+from django.conf import settings
 from django.contrib import admin
-from shop_postfinance.models import PostfinanceIPN
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+from shop_postfinance import reporting, tenants
+from shop_postfinance.models import (CompactPostfinanceIPN, IPN_FIELDS,
+    PAYMENT_STATUS, PostfinanceConfirmation, PostfinanceDailyTotal,
+    PostfinanceIPN, PostfinanceOrderState, PostfinanceStatusTransition,
+    QueuedIPN)
 
 
 class PostFinanceIPNAdmin(admin.ModelAdmin):
@@ -10,4 +25,261 @@ class PostFinanceIPNAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     readonly_fields = 'orderID', 'currency', 'amount', 'PM', 'ACCEPTANCE', 'STATUS', 'CARDNO', 'CN', 'TRXDATE', 'PAYID', 'NCERROR', 'BRAND', 'IPCTY', 'CCCTY', 'ECI', 'CVCCheck', 'AAVCheck', 'VC', 'IP', 'SHASIGN', 'updated_at', 'created_at'
     search_fields = 'orderID', 'CN'
-admin.site.register(PostfinanceIPN, PostFinanceIPNAdmin)
+
+
+class CompactPostFinanceIPNAdmin(admin.ModelAdmin):
+    list_display = 'orderID', 'amount', 'currency', 'PM', 'STATUS', 'created_at'
+    list_filter = 'currency', 'STATUS', 'PM'
+    readonly_fields = 'orderID', 'currency', 'amount', 'PM', 'STATUS', 'TRXDATE', 'PAYID', 'BRAND', 'extra', 'updated_at', 'created_at'
+    search_fields = 'orderID',
+
+
+#===============================================================================
+# Large ledgers (POSTFINANCE_LARGE_LEDGER_ADMIN = True)
+#===============================================================================
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the row count estimated by the database for unfiltered changelists
+    of large tables (PostgreSQL and MySQL), instead of a COUNT(*) that reads
+    the whole table.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = self.estimate(queryset)
+            if estimate is not None and estimate >= self.exact_count_below:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def estimate(self, queryset):
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+        elif connection.vendor == 'mysql':
+            sql = ('SELECT table_rows FROM information_schema.tables '
+                   'WHERE table_schema = DATABASE() AND table_name = %s')
+        else:
+            return None
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return int(row[0]) if row and row[0] is not None else None
+
+
+class FixedChoicesFilter(admin.SimpleListFilter):
+    """
+    A filter offering a fixed list of values, where the default filter of a
+    field without choices runs a DISTINCT over the whole table.
+    """
+    field_name = None
+
+    def lookups(self, request, model_admin):
+        return self.get_choices()
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(**{self.field_name: self.value()})
+        return queryset
+
+
+class StatusFilter(FixedChoicesFilter):
+    title = _('status')
+    parameter_name = field_name = 'STATUS'
+
+    def get_choices(self):
+        return PAYMENT_STATUS
+
+
+class CurrencyFilter(FixedChoicesFilter):
+    title = _('currency')
+    parameter_name = field_name = 'currency'
+
+    def get_choices(self):
+        # The currencies of every configured PostFinance account.
+        currencies = set()
+        for config in tenants.get_registry().configs.values():
+            currencies.update(config.currencies)
+        return [(currency, currency) for currency in sorted(currencies)]
+
+
+class PaymentMethodFilter(FixedChoicesFilter):
+    title = _('Payment method')
+    parameter_name = field_name = 'PM'
+
+    def get_choices(self):
+        methods = getattr(settings, 'POSTFINANCE_ADMIN_PAYMENT_METHODS', (
+            'CreditCard', 'PostFinance Card', 'PostFinance e-finance',
+            'TWINT', 'PAYPAL'))
+        return [(method, method) for method in methods]
+
+
+def _export_rows(queryset, batch_size=2000):
+    """
+    The CSV lines of ``queryset``, read in primary key order a batch at a
+    time so that the table is never loaded into memory.
+    """
+    fields = [field for field in IPN_FIELDS if field != 'SHASIGN']
+
+    class Line(object):
+        def write(self, value):
+            return value
+    writer = csv.writer(Line())
+    yield writer.writerow(['created_at'] + fields)
+    queryset = queryset.defer(None).order_by('pk')
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        for ipn in batch:
+            data = ipn.to_data()
+            yield writer.writerow([ipn.created_at.isoformat()] +
+                                  [data.get(field, '') for field in fields])
+
+
+class LargeLedgerChangeList(ChangeList):
+    """
+    Only reads the displayed columns (the change form still loads them all).
+    """
+
+    def get_queryset(self, request):
+        queryset = super(LargeLedgerChangeList, self).get_queryset(request)
+        names = set(field.name for field in self.model._meta.fields)
+        return queryset.only(*[name for name in self.list_display if name in names])
+
+
+class LargeLedgerAdminMixin(object):
+    """
+    Changelist settings for ledgers of millions of rows: search by orderID
+    prefix or exact PAYID (both indexed), fixed-choice filters, no date
+    hierarchy, estimated page counts and list queries reading only the
+    displayed columns.
+    """
+    list_filter = 'created_at', StatusFilter, CurrencyFilter, PaymentMethodFilter
+    date_hierarchy = None
+    search_fields = 'orderID', 'PAYID'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = 'export_csv',
+
+    def get_changelist(self, request, **kwargs):
+        return LargeLedgerChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        query = Q(orderID__startswith=search_term)
+        pay_id_field = self.model._meta.get_field('PAYID')
+        if search_term.isdigit() or pay_id_field.get_internal_type() == 'CharField':
+            query |= Q(PAYID=search_term)
+        return queryset.filter(query), False
+
+    def export_csv(self, request, queryset):
+        response = StreamingHttpResponse(_export_rows(queryset), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="%s.csv"' % (
+            self.model._meta.model_name)
+        return response
+    export_csv.short_description = _('Export selected notifications as CSV')
+
+
+class LargePostFinanceIPNAdmin(LargeLedgerAdminMixin, PostFinanceIPNAdmin):
+    pass
+
+
+class LargeCompactPostFinanceIPNAdmin(LargeLedgerAdminMixin, CompactPostFinanceIPNAdmin):
+    pass
+
+
+if getattr(settings, 'POSTFINANCE_LARGE_LEDGER_ADMIN', False):
+    admin.site.register(PostfinanceIPN, LargePostFinanceIPNAdmin)
+    admin.site.register(CompactPostfinanceIPN, LargeCompactPostFinanceIPNAdmin)
+else:
+    admin.site.register(PostfinanceIPN, PostFinanceIPNAdmin)
+    admin.site.register(CompactPostfinanceIPN, CompactPostFinanceIPNAdmin)
+
+
+class PostfinanceOrderStateAdmin(admin.ModelAdmin):
+    list_display = 'orderID', 'PAYID', 'STATUS', 'updated_at'
+    list_filter = 'STATUS',
+    readonly_fields = 'orderID', 'PAYID', 'STATUS', 'updated_at', 'created_at'
+    search_fields = 'orderID',
+admin.site.register(PostfinanceOrderState, PostfinanceOrderStateAdmin)
+
+
+class PostfinanceStatusTransitionAdmin(admin.ModelAdmin):
+    list_display = 'orderID', 'PAYID', 'from_status', 'to_status', 'created_at'
+    readonly_fields = 'orderID', 'PAYID', 'from_status', 'to_status', 'created_at'
+    search_fields = 'orderID',
+admin.site.register(PostfinanceStatusTransition, PostfinanceStatusTransitionAdmin)
+
+
+class PostfinanceDailyTotalAdmin(admin.ModelAdmin):
+    """
+    The changelist also shows the totals per currency of the rows it selects
+    (on every page), summed up by reporting.sum_totals().
+    """
+    list_display = 'date', 'currency', 'PM', 'BRAND', 'STATUS', 'count', 'get_amount'
+    list_filter = 'date', 'currency', 'STATUS', 'PM', 'BRAND'
+    date_hierarchy = 'date'
+    readonly_fields = 'date', 'currency', 'PM', 'BRAND', 'STATUS', 'count', 'amount'
+
+    def get_amount(self, obj):
+        return obj.get_amount()
+    get_amount.short_description = _('Amount')
+    get_amount.admin_order_field = 'amount'
+
+    def changelist_view(self, request, extra_context=None):
+        response = super(PostfinanceDailyTotalAdmin, self).changelist_view(
+            request, extra_context=extra_context)
+        # Not rendered yet: the totals are those of the changelist's own
+        # filtered queryset. Redirects (bad lookups) have no context.
+        context = getattr(response, 'context_data', None) or {}
+        if 'cl' in context:
+            context['totals'] = [
+                dict(row, amount=Decimal(row['amount'] or 0) / 100)
+                for row in reporting.sum_totals(context['cl'].queryset)]
+        return response
+
+    def has_add_permission(self, request):
+        return False
+admin.site.register(PostfinanceDailyTotal, PostfinanceDailyTotalAdmin)
+
+
+class QueuedIPNAdmin(admin.ModelAdmin):
+    list_display = 'pk', 'state', 'attempts', 'available_at', 'created_at'
+    list_filter = 'state',
+    readonly_fields = 'payload', 'state', 'attempts', 'last_error', 'claimed_by', 'available_at', 'updated_at', 'created_at'
+    actions = 'requeue',
+
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(state=QueuedIPN.PROCESSING).update(
+            state=QueuedIPN.PENDING, attempts=0, claimed_by='')
+        self.message_user(request, _('%s entries requeued.') % updated)
+    requeue.short_description = _('Requeue selected entries')
+admin.site.register(QueuedIPN, QueuedIPNAdmin)
+
+
+class PostfinanceConfirmationAdmin(admin.ModelAdmin):
+    list_display = 'orderID', 'PAYID', 'amount', 'state', 'attempts', 'available_at', 'created_at'
+    list_filter = 'state',
+    search_fields = 'orderID',
+    readonly_fields = 'orderID', 'PAYID', 'amount', 'STATUS', 'state', 'attempts', 'last_error', 'available_at', 'updated_at', 'created_at'
+    actions = 'retry',
+
+    def retry(self, request, queryset):
+        updated = queryset.exclude(state=PostfinanceConfirmation.DONE).update(
+            state=PostfinanceConfirmation.PENDING, attempts=0, available_at=now())
+        self.message_user(request, _('%s confirmations will be retried.') % updated)
+    retry.short_description = _('Retry selected confirmations')
+admin.site.register(PostfinanceConfirmation, PostfinanceConfirmationAdmin)
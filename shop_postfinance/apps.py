@@ -0,0 +1,11 @@
+#-*- coding: utf-8 -*-
+from django.apps import AppConfig
+from django.core import checks
+
+
+class ShopPostfinanceConfig(AppConfig):
+    name = 'shop_postfinance'
+
+    def ready(self):
+        from shop_postfinance.checks import check_settings
+        checks.register(check_settings)
@@ -0,0 +1,74 @@
+#-*- coding: utf-8 -*-
+"""
+Coroutine versions of the backend's views, for ASGI deployments (Django >=
+3.1). Enable them with POSTFINANCE_ASYNC_VIEWS = True, or mount
+backend.get_async_urls() yourself.
+
+Every backend call runs through sync_to_async: besides the database and
+the shop interface, the signature check sends signals and metrics to
+synchronous receivers, and the notification filter may reach the cache
+(POSTFINANCE_IPN_RATE_LIMIT_STORE = 'cache'). The coroutines only wait,
+which lets a single process keep many notifications and success redirects
+in flight at once.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect
+from django.urls import re_path
+
+from shop_postfinance import ipn_filter
+from shop_postfinance.offsite_postfinance import get_request_data
+
+
+def get_async_urls(backend):
+
+    async def view_that_asks_for_money(request):
+        # Shop lookups, signing and template rendering are all synchronous.
+        return await sync_to_async(backend.view_that_asks_for_money)(request)
+
+    async def handle_ipn(request, data=None):
+        if data is None:
+            data = get_request_data(request)
+        try:
+            if await sync_to_async(backend.verify_payment_data)(data):
+                response = await sync_to_async(backend.handle_verified_ipn_data)(data)
+            else:  # Checksum failed
+                response = HttpResponseBadRequest()
+        except Http404:
+            await sync_to_async(backend._count_response)(404)
+            raise
+        await sync_to_async(backend._count_response)(response.status_code)
+        return response
+
+    async def postfinance_return_successful_view(request):
+        if request.GET:
+            if backend.success_view_records:
+                await handle_ipn(request)
+            else:
+                await sync_to_async(backend.verify_payment_data)(get_request_data(request))
+        finished_url = await sync_to_async(backend.shop.get_finished_url)()
+        return HttpResponseRedirect(finished_url)
+
+    async def postfinance_ipn(request, deprecated=False):
+        if deprecated:
+            import warnings
+            warnings.warn('usage of this URL is deprecated. Please use the URL without the "somethinghardtoguess" part.', DeprecationWarning)
+        data = get_request_data(request)
+        # Token bucket and replay lookups may be cache round trips.
+        response = await sync_to_async(backend.filter_ipn)(request, data)
+        if response is not None:
+            return response
+        response = await handle_ipn(request, data)
+        if response.status_code == 200:
+            await sync_to_async(ipn_filter.get_filter().remember)(data)
+        return response
+    # csrf_exempt() can't wrap coroutines before Django 5.0.
+    postfinance_ipn.csrf_exempt = True
+
+    urlpatterns = [
+        re_path(r'^$', view_that_asks_for_money, name='postfinance'),
+        re_path(r'^success/$', postfinance_return_successful_view, name='postfinance_success'),
+        re_path(r'^instantpaymentnotification/$', postfinance_ipn, name='postfinance_ipn'),
+    ]
+    if backend.deprecated_ipn_url:
+        urlpatterns.append(re_path(r'^somethinghardtoguess/instantpaymentnotification/$', postfinance_ipn, kwargs={'deprecated': True}))
+    return urlpatterns
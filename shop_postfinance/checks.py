@@ -0,0 +1,21 @@
+#-*- coding: utf-8 -*-
+"""
+System checks of the PostFinance settings, run by Django at startup
+(runserver, migrate, check...) instead of at every backend instantiation.
+"""
+from django.conf import settings
+from django.core import checks
+
+from shop_postfinance import tenants
+from shop_postfinance.utils import HASH_ALGORITHMS
+
+
+def check_settings(app_configs=None, **kwargs):
+    errors = [checks.Error(message, id=id) for id, message in tenants.get_errors()]
+    algorithm = getattr(settings, 'POSTFINANCE_HASH_ALGORITHM', 'sha1')
+    if algorithm.lower() not in HASH_ALGORITHMS:
+        errors.append(checks.Error(
+            'Unsupported postfinance hash algorithm %r, use one of %s.' % (
+                algorithm, ', '.join(sorted(HASH_ALGORITHMS))),
+            id='shop_postfinance.E005'))
+    return errors
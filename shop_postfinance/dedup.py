@@ -0,0 +1,41 @@
+#-*- coding: utf-8 -*-
+"""
+A short-lived record of the notifications already handled, in Django's cache.
+
+The same (orderID, PAYID, STATUS) usually reaches us twice within seconds:
+once through the customer's return to the success page, once through
+PostFinance's server-to-server notification, plus PostFinance's own
+retries. Both entry points check here once the signature is verified, and
+skip the order lookup and the ledger write if the notification was already
+recorded. Entries expire after POSTFINANCE_DEDUP_TIMEOUT seconds (600 by
+default); later duplicates are still caught by the ledger's unique key.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Runs the function at once outside of transactions, and before Django 1.9.
+_on_commit = getattr(transaction, 'on_commit', lambda func: func())
+
+
+def _cache_key(data):
+    return 'shop_postfinance:ipn:%s:%s:%s' % (
+        data['orderID'], data.get('PAYID', ''), data.get('STATUS', ''))
+
+
+def is_recorded(data):
+    """
+    Whether the notification ``data`` was recorded recently.
+    """
+    return cache.get(_cache_key(data)) is not None
+
+
+def mark_recorded(data):
+    """
+    Remembers that the notification ``data`` is in the ledger. Only call
+    this once it is, a lost notification is worse than a duplicate: inside a
+    transaction, the cache is only written when it commits.
+    """
+    key = _cache_key(data)
+    timeout = getattr(settings, 'POSTFINANCE_DEDUP_TIMEOUT', 600)
+    _on_commit(lambda: cache.set(key, 1, timeout))
@@ -0,0 +1,207 @@
+#-*- coding: utf-8 -*-
+"""
+Server-to-server access to PostFinance (DirectLink): payment status queries,
+captures and refunds, without going through the back office.
+
+    from shop_postfinance.directlink import DirectLinkClient
+
+    client = DirectLinkClient()
+    response = client.query_status(order_id='1234')
+    if response.ok and response.STATUS == '5':
+        client.capture(response.PAYID)
+
+The client uses the same PSPID and SHA-IN key as OffsitePostfinanceBackend
+plus an API user (POSTFINANCE_DIRECTLINK_USER_ID and
+POSTFINANCE_DIRECTLINK_PASSWORD). Its endpoints live next to
+POSTFINANCE_ENTRY_URL unless POSTFINANCE_DIRECTLINK_URL says otherwise.
+
+Requests go through one pooled keep-alive session. Connections that could
+not be made are retried with an exponential backoff; status queries, which
+are safe to repeat, are also retried on any other network error, server
+errors and timeouts. Captures and refunds are never sent twice. The requests library
+is needed (pip install django-shop-postfinance[directlink]).
+"""
+import time
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+from xml.etree.ElementTree import fromstring
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from shop_postfinance.utils import get_signer
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    try:
+        from urllib3.exceptions import NewConnectionError
+    except ImportError:  # requests < 2.16
+        from requests.packages.urllib3.exceptions import NewConnectionError
+except ImportError:
+    requests = None
+
+DEFAULT_ENTRY_URL = 'https://e-payment.postfinance.ch/ncol/test/orderstandard_utf8.asp'
+
+# Maintenance operations
+CAPTURE_PARTIAL = 'SAL'
+CAPTURE_FINAL = 'SAS'
+REFUND_PARTIAL = 'RFD'
+REFUND_FINAL = 'RFS'
+
+
+class DirectLinkError(Exception):
+    """
+    PostFinance could not be reached or answered with garbage.
+    """
+
+
+def _not_sent(error):
+    """
+    Whether ``error`` happened before a connection to PostFinance was made,
+    i.e. the request can't have reached it.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # A connection that was refused or never resolved, as opposed to one
+        # that was dropped once the request was sent.
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+class DirectLinkResponse(object):
+    """
+    The attributes of PostFinance's <ncresponse> element, available as
+    attributes of the response (``response.STATUS``, ``response.PAYID``...).
+    """
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['attributes'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def ok(self):
+        return self.attributes.get('NCERROR', '0') == '0'
+
+    def __repr__(self):
+        return '<DirectLinkResponse %r>' % self.attributes
+
+
+class DirectLinkClient(object):
+
+    def __init__(self, psp_id=None, user_id=None, password=None,
+                 secret_key=None, base_url=None, timeout=None, retries=None,
+                 backoff=None, pool_size=None):
+        if requests is None:
+            raise ImproperlyConfigured(
+                'The PostFinance DirectLink client needs the requests library.')
+        self.psp_id = psp_id or settings.POSTFINANCE_PSP_ID
+        self.user_id = user_id or getattr(settings, 'POSTFINANCE_DIRECTLINK_USER_ID', None)
+        self.password = password or getattr(settings, 'POSTFINANCE_DIRECTLINK_PASSWORD', None)
+        if not (self.user_id and self.password):
+            raise ImproperlyConfigured(
+                'Please define the POSTFINANCE_DIRECTLINK_USER_ID and '
+                'POSTFINANCE_DIRECTLINK_PASSWORD settings to use DirectLink.')
+        self.signer = get_signer(secret_key or settings.POSTFINANCE_SECRET_KEY)
+        if base_url is None:
+            base_url = getattr(settings, 'POSTFINANCE_DIRECTLINK_URL', None)
+        if base_url is None:
+            entry_url = getattr(settings, 'POSTFINANCE_ENTRY_URL', DEFAULT_ENTRY_URL)
+            base_url = entry_url.rsplit('/', 1)[0]
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout or getattr(settings, 'POSTFINANCE_DIRECTLINK_TIMEOUT', 10)
+        self.retries = retries if retries is not None else getattr(
+            settings, 'POSTFINANCE_DIRECTLINK_RETRIES', 3)
+        self.backoff = backoff if backoff is not None else getattr(
+            settings, 'POSTFINANCE_DIRECTLINK_BACKOFF', 0.5)
+        self.pool_size = pool_size or getattr(settings, 'POSTFINANCE_DIRECTLINK_POOL_SIZE', 10)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, page, params, idempotent):
+        params = dict((key, value) for key, value in params.items()
+                      if value is not None)
+        params.update(PSPID=self.psp_id, USERID=self.user_id, PSWD=self.password)
+        params['SHASIGN'] = self.signer.sign(params)
+        url = '%s/%s' % (self.base_url, page)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, data=params, timeout=self.timeout)
+                if idempotent and response.status_code >= 500:
+                    response.raise_for_status()
+            except requests.RequestException as e:
+                # Only a connection that was never made can't have reached
+                # PostFinance; a dropped one or a read timeout may have been
+                # processed, so only repeat what is safe to repeat.
+                retry = idempotent or _not_sent(e)
+                if not retry or attempt >= self.retries:
+                    raise DirectLinkError('%s failed: %s' % (page, e))
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+                continue
+            if response.status_code != 200:
+                raise DirectLinkError('%s answered HTTP %s' % (page, response.status_code))
+            try:
+                return DirectLinkResponse(dict(fromstring(response.content).attrib))
+            except SyntaxError as e:
+                raise DirectLinkError('%s sent an invalid response: %s' % (page, e))
+
+    def query_status(self, order_id=None, pay_id=None):
+        """
+        Returns the current status of a payment, identified by our order ID
+        or by PostFinance's PAYID.
+        """
+        return self._post('querydirect.asp', {'ORDERID': order_id, 'PAYID': pay_id},
+                          idempotent=True)
+
+    def query_many(self, order_ids, workers=None):
+        """
+        Queries the status of many orders in parallel, yielding
+        (order_id, response) pairs as they come back. A query that failed
+        yields its DirectLinkError instead of a response. ``workers``
+        defaults to the size of the connection pool, more threads would
+        only open connections the pool can't keep.
+        """
+        def query(order_id):
+            try:
+                return order_id, self.query_status(order_id=order_id)
+            except DirectLinkError as e:
+                return order_id, e
+        pool = ThreadPool(workers or self.pool_size)
+        try:
+            for result in pool.imap_unordered(query, order_ids):
+                yield result
+        finally:
+            pool.terminate()
+
+    def maintain(self, pay_id, operation, amount=None):
+        if amount is not None:
+            amount = str(int(Decimal(amount) * 100))
+        return self._post('maintenancedirect.asp',
+                          {'PAYID': pay_id, 'OPERATION': operation, 'AMOUNT': amount},
+                          idempotent=False)
+
+    def capture(self, pay_id, amount=None, final=True):
+        """
+        Captures an authorised payment, all of it unless an ``amount`` (in
+        the order currency, like the shop's order totals) is given.
+        """
+        return self.maintain(pay_id, CAPTURE_FINAL if final else CAPTURE_PARTIAL, amount)
+
+    def refund(self, pay_id, amount=None, final=False):
+        """
+        Refunds a captured payment, pass ``final=True`` with the last refund.
+        """
+        return self.maintain(pay_id, REFUND_FINAL if final else REFUND_PARTIAL, amount)
@@ -7,6 +7,9 @@ to spit out this pesky boilerplate ever again.
 
 """
 from django import forms
+from django.forms.forms import DeclarativeFieldsMetaclass
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 
 class ValueHiddenInput(forms.HiddenInput):
@@ -20,11 +23,11 @@ class ValueHiddenInput(forms.HiddenInput):
     https://github.com/johnboxall/django-paypal/blob/master/standard/widgets.py
     
     """
-    def render(self, name, value, attrs=None):
+    def render(self, name, value, attrs=None, **kwargs):
         if value is None:
             return u''
         else:
-            return super(ValueHiddenInput, self).render(name, value, attrs)
+            return super(ValueHiddenInput, self).render(name, value, attrs, **kwargs)
 
 
 class PostfinanceForm(forms.Form):
@@ -48,3 +51,42 @@ class PostfinanceForm(forms.Form):
     currency = forms.CharField(widget=ValueHiddenInput())
     language = forms.CharField(widget=ValueHiddenInput())
     SHASign = forms.CharField(widget=ValueHiddenInput())
+
+
+_form_classes = {}
+
+
+def get_form_class(field_names):
+    """
+    Returns a form class with one hidden field per name in ``field_names``.
+
+    The set of parameters sent to Postfinance hardly ever changes, so the
+    classes are built once per set of names and cached for the lifetime of
+    the process instead of being rebuilt on every checkout page.
+    """
+    key = frozenset(field_names)
+    form_class = _form_classes.get(key)
+    if form_class is None:
+        fields = dict((name, forms.CharField(widget=ValueHiddenInput()))
+                      for name in sorted(key))
+        form_class = DeclarativeFieldsMetaclass('PostfinanceForm', (forms.Form,), fields)
+        _form_classes[key] = form_class
+    return form_class
+
+
+def render_hidden_inputs(data, prefix=None):
+    """
+    Renders the (already signed) parameters in ``data`` as hidden inputs,
+    skipping empty values the same way ValueHiddenInput does, without going
+    through forms and templates at all.
+    """
+    html = []
+    for name in sorted(data):
+        value = data[name]
+        if value is None:
+            continue
+        if prefix:
+            name = '%s-%s' % (prefix, name)
+        html.append(u'<input type="hidden" name="%s" value="%s" />' % (
+            escape(name), escape(value)))
+    return mark_safe(u'\n'.join(html))
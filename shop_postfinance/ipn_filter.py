@@ -0,0 +1,220 @@
+#-*- coding: utf-8 -*-
+"""
+Cheap checks run on every request to the notification URL before any
+signature is computed or any order looked up, so that a flood of forged
+notifications can't eat the CPU and database time real ones need.
+
+* POSTFINANCE_IPN_ALLOWED_IPS: the networks notifications may come from
+  (e.g. ['192.0.2.0/24'], see PostFinance's documentation for its current
+  ranges). Other addresses get a 403. Not checked unless set.
+* POSTFINANCE_IPN_RATE_LIMIT: a (requests per second, burst) pair, applied
+  per client address with a token bucket. Requests over the limit get a 429.
+  The buckets are kept in the process (POSTFINANCE_IPN_RATE_LIMIT_STORE =
+  'local', the default) or in Django's cache ('cache') to share them between
+  processes.
+* Replays: the SHASIGNs of the last POSTFINANCE_IPN_REPLAY_CACHE_SIZE (1000)
+  notifications we accepted are remembered, a notification carrying one of
+  them again is answered like the original without any work.
+
+POSTFINANCE_IPN_CLIENT_IP_HEADER names the META key holding the client
+address (REMOTE_ADDR by default; behind a proxy, e.g. HTTP_X_FORWARDED_FOR,
+of which the last address is used). Rejections are counted in
+get_counters(), sent as the ipn_rejected signal and to the metrics sink as
+ipn.rejected.<reason>.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from shop_postfinance import metrics, signals
+
+try:
+    import ipaddress
+except ImportError:  # Python 2 without the ipaddress backport
+    ipaddress = None
+
+IP_NOT_ALLOWED = 'ip_not_allowed'
+RATE_LIMITED = 'rate_limited'
+REPLAY = 'replay'
+
+_counters = {}
+_counters_lock = threading.Lock()
+_filter = None
+
+
+def get_counters():
+    """
+    The number of requests rejected for every reason since the process
+    started.
+    """
+    with _counters_lock:
+        return dict(_counters)
+
+
+def _count(reason):
+    with _counters_lock:
+        _counters[reason] = _counters.get(reason, 0) + 1
+    signals.ipn_rejected.send(sender=IPNFilter, reason=reason)
+    metrics.incr('ipn.rejected.%s' % reason)
+
+
+class LocalMemoryStore(object):
+    """
+    Token buckets in the process, the least recently seen addresses being
+    dropped beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+            return allowed
+
+
+class CacheStore(object):
+    """
+    Token buckets in Django's cache, shared by every process using it.
+    Concurrent requests of one address may race, which only makes the limit
+    slightly lenient.
+    """
+
+    def take(self, key, rate, burst, now):
+        cache_key = 'shop_postfinance:ipn_bucket:%s' % key
+        tokens, updated = cache.get(cache_key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Once full again, a bucket needn't be kept.
+        cache.set(cache_key, (tokens, now), int((burst - tokens) / rate) + 1)
+        return allowed
+
+
+STORES = {
+    'local': LocalMemoryStore,
+    'cache': CacheStore,
+}
+
+
+class IPNFilter(object):
+
+    def __init__(self, allowed_ips=None, rate_limit=None, store=None,
+                 replay_cache_size=1000, client_ip_header='REMOTE_ADDR'):
+        if allowed_ips:
+            if ipaddress is None:
+                raise ImproperlyConfigured(
+                    'POSTFINANCE_IPN_ALLOWED_IPS needs the ipaddress module.')
+            self.allowed_networks = [ipaddress.ip_network(u'%s' % network, strict=False)
+                                     for network in allowed_ips]
+        else:
+            self.allowed_networks = None
+        self.rate_limit = rate_limit
+        self.store = store or LocalMemoryStore()
+        self.replay_cache_size = replay_cache_size
+        self.seen = OrderedDict()
+        self.seen_lock = threading.Lock()
+        self.client_ip_header = client_ip_header
+
+    @classmethod
+    def from_settings(cls):
+        store = getattr(settings, 'POSTFINANCE_IPN_RATE_LIMIT_STORE', 'local')
+        if store not in STORES:
+            raise ImproperlyConfigured(
+                'POSTFINANCE_IPN_RATE_LIMIT_STORE must be one of %s.' % ', '.join(sorted(STORES)))
+        return cls(
+            allowed_ips=getattr(settings, 'POSTFINANCE_IPN_ALLOWED_IPS', None),
+            rate_limit=getattr(settings, 'POSTFINANCE_IPN_RATE_LIMIT', None),
+            store=STORES[store](),
+            replay_cache_size=getattr(settings, 'POSTFINANCE_IPN_REPLAY_CACHE_SIZE', 1000),
+            client_ip_header=getattr(settings, 'POSTFINANCE_IPN_CLIENT_IP_HEADER', 'REMOTE_ADDR'),
+        )
+
+    def get_client_ip(self, request):
+        value = request.META.get(self.client_ip_header, '')
+        return value.split(',')[-1].strip()
+
+    def is_allowed_ip(self, ip):
+        if self.allowed_networks is None:
+            return True
+        try:
+            address = ipaddress.ip_address(u'%s' % ip)
+        except ValueError:
+            return False
+        for network in self.allowed_networks:
+            if address in network:
+                return True
+        return False
+
+    def check_request(self, request):
+        """
+        Returns the reason to reject ``request`` without looking at its
+        parameters, or None.
+        """
+        ip = self.get_client_ip(request)
+        if not self.is_allowed_ip(ip):
+            return IP_NOT_ALLOWED
+        if self.rate_limit:
+            rate, burst = self.rate_limit
+            if not self.store.take(ip, rate, burst, time.time()):
+                return RATE_LIMITED
+        return None
+
+    def is_replay(self, data):
+        signature = data.get('SHASIGN')
+        if not signature or not self.replay_cache_size:
+            return False
+        with self.seen_lock:
+            return signature.upper() in self.seen
+
+    def remember(self, data):
+        """
+        Records the SHASIGN of a notification that was accepted.
+        """
+        signature = data.get('SHASIGN')
+        if not signature or not self.replay_cache_size:
+            return
+        with self.seen_lock:
+            self.seen.pop(signature.upper(), None)
+            self.seen[signature.upper()] = True
+            while len(self.seen) > self.replay_cache_size:
+                self.seen.popitem(last=False)
+
+    def count(self, reason):
+        _count(reason)
+
+
+def get_filter():
+    """
+    The filter of this process, built from the settings on first use.
+    """
+    global _filter
+    if _filter is None:
+        _filter = IPNFilter.from_settings()
+    return _filter
+
+
+def _settings_changed(sender, setting, **kwargs):
+    global _filter
+    if setting.startswith('POSTFINANCE_IPN_'):
+        _filter = None
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # Django < 1.8
+    from django.test.signals import setting_changed
+setting_changed.connect(_settings_changed)
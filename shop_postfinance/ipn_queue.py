@@ -0,0 +1,165 @@
+#-*- coding: utf-8 -*-
+"""
+Deferred IPN processing.
+
+With POSTFINANCE_IPN_QUEUE = True the IPN view only verifies the signature,
+stores the payload with enqueue() and answers PostFinance right away. The
+slow part (order lookup, ledger write and shop confirmation) is done by
+IPNQueueWorker, which the postfinance_process_ipn_queue management command
+runs in a pool of threads.
+
+Entries are claimed in batches with a single UPDATE carrying a unique claim
+token, so several workers (or several processes running the command) never
+pick up the same entry. Failing entries are retried with an exponential
+backoff and end up in the DEAD state after POSTFINANCE_IPN_QUEUE_MAX_ATTEMPTS
+attempts, where they stay visible in the admin.
+"""
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+from shop_postfinance.models import QueuedIPN
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(data):
+    """
+    Appends a (verified) notification to the queue. ``data`` may be a
+    QueryDict, only the last value of every key is kept.
+    """
+    payload = json.dumps(dict((key, data[key]) for key in data))
+    return QueuedIPN.objects.create(payload=payload)
+
+
+def reclaim_stale(older_than):
+    """
+    Puts entries that have been stuck in PROCESSING for longer than
+    ``older_than`` seconds (their worker died) back into the queue.
+    """
+    limit = now() - timedelta(seconds=older_than)
+    return QueuedIPN.objects.filter(
+        state=QueuedIPN.PROCESSING, updated_at__lt=limit
+    ).update(state=QueuedIPN.PENDING, claimed_by='')
+
+
+def claim_batch(batch_size):
+    """
+    Atomically marks up to ``batch_size`` due entries as PROCESSING and
+    returns them, or an empty list once no entry is due.
+    """
+    token = uuid.uuid4().hex
+    while True:
+        due = list(QueuedIPN.objects.filter(
+            state=QueuedIPN.PENDING, available_at__lte=now()
+        ).values_list('pk', flat=True)[:batch_size])
+        if not due:
+            return []
+        # update() doesn't touch auto_now fields; without the timestamp
+        # reclaim_stale() would take the entries back from this worker.
+        claimed = QueuedIPN.objects.filter(
+            pk__in=due, state=QueuedIPN.PENDING
+        ).update(state=QueuedIPN.PROCESSING, claimed_by=token,
+                 updated_at=now())
+        if claimed:
+            return list(QueuedIPN.objects.filter(claimed_by=token,
+                                                 state=QueuedIPN.PROCESSING))
+        # Another worker claimed them first, look for other due entries.
+
+
+class IPNQueueWorker(object):
+    """
+    Drains the IPN queue with ``threads`` worker threads, each one claiming
+    ``batch_size`` entries at a time and handing them to
+    ``backend.record_payment_data()``. With ``reclaim_after`` set, entries
+    stuck in PROCESSING for that many seconds are requeued before every
+    round.
+    """
+
+    def __init__(self, backend, threads=1, batch_size=50, max_attempts=None,
+                 retry_delay=None, reclaim_after=None):
+        self.backend = backend
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or getattr(
+            settings, 'POSTFINANCE_IPN_QUEUE_MAX_ATTEMPTS', 5)
+        self.retry_delay = retry_delay or getattr(
+            settings, 'POSTFINANCE_IPN_QUEUE_RETRY_DELAY', 60)
+        self.reclaim_after = reclaim_after
+        self.stats = {'done': 0, 'retried': 0, 'dead': 0, 'reclaimed': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def process_entry(self, entry):
+        try:
+            self.backend.record_payment_data(entry.get_data())
+        except Exception:
+            entry.attempts += 1
+            entry.last_error = traceback.format_exc()
+            entry.claimed_by = ''
+            if entry.attempts >= self.max_attempts:
+                entry.state = QueuedIPN.DEAD
+                logger.error('Giving up on queued IPN #%s after %s attempts',
+                             entry.pk, entry.attempts)
+                self._count('dead')
+            else:
+                entry.state = QueuedIPN.PENDING
+                delay = self.retry_delay * 2 ** (entry.attempts - 1)
+                entry.available_at = now() + timedelta(seconds=delay)
+                logger.warning('Queued IPN #%s failed, retrying in %ss',
+                               entry.pk, delay)
+                self._count('retried')
+        else:
+            entry.attempts += 1
+            entry.state = QueuedIPN.DONE
+            entry.claimed_by = ''
+            self._count('done')
+        entry.save()
+
+    def drain(self):
+        """
+        Processes batches until no due entry is left. Returns the number of
+        entries handled by this thread.
+        """
+        handled = 0
+        try:
+            while True:
+                batch = claim_batch(self.batch_size)
+                if not batch:
+                    return handled
+                for entry in batch:
+                    self.process_entry(entry)
+                handled += len(batch)
+        finally:
+            # Every thread has its own connection, don't leak them.
+            connection.close()
+
+    def run(self, loop=False, sleep=5):
+        """
+        Drains the queue with the configured number of threads. If ``loop`` is
+        set, keeps polling for new entries every ``sleep`` seconds.
+        """
+        while True:
+            # Also in the loop: a worker of another process may die any time.
+            if self.reclaim_after is not None:
+                self.stats['reclaimed'] += reclaim_stale(self.reclaim_after)
+            workers = [threading.Thread(target=self.drain)
+                       for _ in range(self.threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if not loop:
+                return self.stats
+            time.sleep(sleep)
@@ -0,0 +1,94 @@
+#-*- coding: utf-8 -*-
+"""
+Maintenance of the IPN ledger: conversion to the compact schema and archival
+of old notifications, so the table the IPN view writes to stays small.
+"""
+import gzip
+import json
+import os
+from contextlib import contextmanager
+
+from shop_postfinance.models import CompactPostfinanceIPN, IPN_FIELDS
+
+
+@contextmanager
+def _keep_timestamps(model):
+    """
+    Lets copied rows keep their original created_at.
+    """
+    field = model._meta.get_field('created_at')
+    auto_now_add = field.auto_now_add
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = auto_now_add
+
+
+def copy_to_compact(source, target, batch_size=1000):
+    """
+    Copies every notification of ``source`` (PostfinanceIPN) that ``target``
+    (CompactPostfinanceIPN) doesn't have yet. Both can be the historical
+    models of a migration. Returns the number of copied rows.
+    """
+    copied = 0
+    last_pk = 0
+    with _keep_timestamps(target):
+        while True:
+            rows = list(source.objects.filter(pk__gt=last_pk).order_by('pk').values(
+                *(('pk', 'created_at') + IPN_FIELDS))[:batch_size])
+            if not rows:
+                return copied
+            last_pk = rows[-1]['pk']
+            known = set(target.objects.filter(
+                orderID__in=set(row['orderID'] for row in rows)
+            ).values_list('orderID', 'PAYID', 'STATUS'))
+            batch = []
+            for row in rows:
+                fields = CompactPostfinanceIPN.compact_fields(row)
+                key = (fields['orderID'], fields['PAYID'], fields['STATUS'])
+                if key in known:
+                    continue
+                known.add(key)
+                batch.append(target(created_at=row['created_at'], **fields))
+            target.objects.bulk_create(batch)
+            copied += len(batch)
+
+
+def archive(model, before, directory, batch_size=5000, delete=True):
+    """
+    Moves the notifications of ``model`` created before ``before`` into one
+    gzipped JSON-lines file per year in ``directory``
+    (e.g. postfinanceipn-2012.jsonl.gz), then deletes them from the table
+    unless ``delete`` is false. Archiving the same year again appends to its
+    file. Returns the number of archived rows per year.
+    """
+    counts = {}
+    files = {}
+    last_pk = 0
+    try:
+        while True:
+            batch = list(model.objects.filter(
+                created_at__lt=before, pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                return counts
+            last_pk = batch[-1].pk
+            for ipn in batch:
+                year = ipn.created_at.year
+                if year not in files:
+                    path = os.path.join(directory, '%s-%s.jsonl.gz' % (
+                        model._meta.model_name, year))
+                    files[year] = gzip.open(path, 'ab')
+                row = ipn.to_data()
+                row['created_at'] = ipn.created_at.isoformat()
+                files[year].write((json.dumps(row, sort_keys=True) + '\n').encode('utf8'))
+                counts[year] = counts.get(year, 0) + 1
+            # Never delete anything that isn't safely on disk.
+            for archive_file in files.values():
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+            if delete:
+                model.objects.filter(pk__in=[ipn.pk for ipn in batch]).delete()
+    finally:
+        for archive_file in files.values():
+            archive_file.close()
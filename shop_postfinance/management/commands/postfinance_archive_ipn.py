@@ -0,0 +1,33 @@
+#-*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from shop_postfinance.ledger import archive
+from shop_postfinance.models import get_ledger_model
+
+
+class Command(BaseCommand):
+    help = ('Moves notifications older than --years years out of the IPN '
+            'ledger in use into yearly gzipped JSON-lines files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory',
+                            help='Directory the archive files are written to.')
+        parser.add_argument('--years', type=int, default=2,
+                            help='Keep notifications of that many years in the '
+                                 'database (default: 2).')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows archived per query (default: 5000).')
+        parser.add_argument('--keep', action='store_true', default=False,
+                            help='Write the archive files but keep the rows.')
+
+    def handle(self, *args, **options):
+        model = get_ledger_model()
+        before = now() - timedelta(days=365 * options['years'])
+        counts = archive(model, before, options['directory'],
+                         batch_size=options['batch_size'],
+                         delete=not options['keep'])
+        for year, count in sorted(counts.items()):
+            self.stdout.write('%s: %s notifications archived\n' % (year, count))
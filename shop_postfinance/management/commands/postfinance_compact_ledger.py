@@ -0,0 +1,20 @@
+#-*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from shop_postfinance.ledger import copy_to_compact
+from shop_postfinance.models import CompactPostfinanceIPN, PostfinanceIPN
+
+
+class Command(BaseCommand):
+    help = ('Copies the notifications of the PostfinanceIPN table into the '
+            'compact ledger (see POSTFINANCE_COMPACT_LEDGER).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows copied per query (default: 1000).')
+
+    def handle(self, *args, **options):
+        copied = copy_to_compact(PostfinanceIPN, CompactPostfinanceIPN,
+                                 batch_size=options['batch_size'])
+        self.stdout.write('Copied %s notifications.\n' % copied)
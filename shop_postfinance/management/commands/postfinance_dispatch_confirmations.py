@@ -0,0 +1,36 @@
+#-*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from shop_postfinance.models import PostfinanceConfirmation
+from shop_postfinance.offsite_postfinance import get_backend
+from shop_postfinance.outbox import ConfirmationDispatcher
+
+
+class Command(BaseCommand):
+    help = ('Delivers the payment confirmations stored while '
+            'POSTFINANCE_CONFIRMATION_OUTBOX is enabled to the shop.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Confirmations delivered per transaction '
+                                 '(default: 100).')
+        parser.add_argument('--max-attempts', type=int, default=None,
+                            help='Attempts before a confirmation is given up.')
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep polling for confirmations instead of exiting '
+                                 'once none is due.')
+        parser.add_argument('--sleep', type=int, default=5,
+                            help='Seconds between polls in --loop mode (default: 5).')
+
+    def handle(self, *args, **options):
+        dispatcher = ConfirmationDispatcher(get_backend(),
+                                            batch_size=options['batch_size'],
+                                            max_attempts=options['max_attempts'])
+        stats = dispatcher.run(loop=options['loop'], sleep=options['sleep'])
+        self.stdout.write('Delivered: %(done)s, retried: %(retried)s, '
+                          'dead: %(dead)s\n' % stats)
+        self.stdout.write('Pending: %s, dead: %s\n' % (
+            PostfinanceConfirmation.objects.filter(state=PostfinanceConfirmation.PENDING).count(),
+            PostfinanceConfirmation.objects.filter(state=PostfinanceConfirmation.DEAD).count(),
+        ))
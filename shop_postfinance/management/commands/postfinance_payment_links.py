@@ -0,0 +1,73 @@
+#-*- coding: utf-8 -*-
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from shop_postfinance.offsite_postfinance import get_backend
+from shop_postfinance.paymentlinks import PaymentLinkBuilder, generate_links
+
+
+class Command(BaseCommand):
+    help = ('Writes a signed PostFinance payment link for every order id '
+            'of the given file (one per line, "-" for stdin) as CSV or JSON '
+            'lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_ids', metavar='order_id_file',
+                            help='File of order ids, one per line ("-" for stdin).')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv',
+                            help='Output format (default: csv).')
+        parser.add_argument('--output', default=None,
+                            help='Write to this file instead of stdout.')
+        parser.add_argument('--base-url', default=None,
+                            help='Absolute URL of the shop, POSTFINANCE_BASE_URL '
+                                 'by default.')
+        parser.add_argument('--tenant', default=None,
+                            help='PostFinance account to use (see POSTFINANCE_TENANTS).')
+        parser.add_argument('--language', default=None,
+                            help='Language of the payment page, e.g. "fr".')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Sign the links in that many processes (default: 1).')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Links per chunk handed to a process (default: 1000).')
+
+    def handle(self, *args, **options):
+        shop = get_backend().shop
+        builder = PaymentLinkBuilder.from_settings(
+            base_url=options['base_url'], tenant=options['tenant'],
+            language=options['language'])
+
+        source = sys.stdin if options['order_ids'] == '-' else open(options['order_ids'])
+        output = open(options['output'], 'w') if options['output'] else self.stdout
+        try:
+            links = generate_links(self.iter_orders(shop, source), shop,
+                                   builder=builder,
+                                   processes=options['processes'],
+                                   chunk_size=options['chunk_size'])
+            if options['format'] == 'csv':
+                writer = csv.writer(output)
+                writer.writerow(('orderID', 'amount', 'url'))
+                for order_id, amount, url in links:
+                    writer.writerow((order_id, amount, url))
+            else:
+                for order_id, amount, url in links:
+                    output.write(json.dumps(
+                        {'orderID': order_id, 'amount': str(amount), 'url': url}) + '\n')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if options['output']:
+                output.close()
+
+    def iter_orders(self, shop, source):
+        for line in source:
+            order_id = line.strip()
+            if not order_id:
+                continue
+            try:
+                yield shop.get_order_for_id(order_id)
+            except models.ObjectDoesNotExist:
+                self.stderr.write('Unknown order: %s\n' % order_id)
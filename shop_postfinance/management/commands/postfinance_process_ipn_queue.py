@@ -0,0 +1,42 @@
+#-*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from shop_postfinance.ipn_queue import IPNQueueWorker
+from shop_postfinance.models import QueuedIPN
+from shop_postfinance.offsite_postfinance import get_backend
+
+
+class Command(BaseCommand):
+    help = ('Processes the PostFinance notifications queued while '
+            'POSTFINANCE_IPN_QUEUE is enabled.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Number of worker threads (default: 4).')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Entries claimed per batch (default: 50).')
+        parser.add_argument('--max-attempts', type=int, default=None,
+                            help='Attempts before an entry is dead-lettered.')
+        parser.add_argument('--reclaim-after', type=int, default=600,
+                            help='Requeue entries stuck in processing for that many '
+                                 'seconds, checked before every poll (default: 600).')
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep polling the queue instead of exiting once it '
+                                 'is empty.')
+        parser.add_argument('--sleep', type=int, default=5,
+                            help='Seconds between polls in --loop mode (default: 5).')
+
+    def handle(self, *args, **options):
+        worker = IPNQueueWorker(get_backend(),
+                                threads=options['threads'],
+                                batch_size=options['batch_size'],
+                                max_attempts=options['max_attempts'],
+                                reclaim_after=options['reclaim_after'])
+        stats = worker.run(loop=options['loop'], sleep=options['sleep'])
+        self.stdout.write('Processed: %(done)s, retried: %(retried)s, '
+                          'dead-lettered: %(dead)s, stale requeued: %(reclaimed)s\n' % stats)
+        self.stdout.write('Pending: %s, dead: %s\n' % (
+            QueuedIPN.objects.filter(state=QueuedIPN.PENDING).count(),
+            QueuedIPN.objects.filter(state=QueuedIPN.DEAD).count(),
+        ))
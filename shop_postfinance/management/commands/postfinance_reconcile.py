@@ -0,0 +1,60 @@
+#-*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from shop_postfinance import reconciliation
+from shop_postfinance.offsite_postfinance import get_backend
+
+
+class Command(BaseCommand):
+    help = ('Imports the notifications missing from the IPN ledger from a '
+            'PostFinance transaction export (CSV or XML).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', metavar='export_file',
+                            help='The transaction export to import.')
+        parser.add_argument('--format', choices=('csv', 'xml'), default=None,
+                            help='File format, guessed from the extension by default.')
+        parser.add_argument('--delimiter', default=';',
+                            help='CSV field delimiter (default: ";").')
+        parser.add_argument('--row-tag', default=None,
+                            help='Name of the XML element holding one transaction.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows inserted per query (default: 1000).')
+        parser.add_argument('--require-signature', action='store_true', default=False,
+                            help='Reject rows without a SHASIGN.')
+        parser.add_argument('--confirm', action='store_true', default=False,
+                            help='Record the missing notifications and confirm the '
+                                 'payment of recovered orders with the shop. Without '
+                                 'it, nothing is written.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'xml' if path.lower().endswith('.xml') else 'csv')
+        shop = get_backend().shop if options['confirm'] else None
+
+        counts = {}
+        with open(path, 'rb' if file_format == 'xml' else 'r') as export:
+            if file_format == 'xml':
+                rows = reconciliation.iter_xml(export, options['row_tag'])
+            else:
+                rows = reconciliation.iter_csv(export, options['delimiter'])
+            events = reconciliation.reconcile(
+                rows,
+                chunk_size=options['chunk_size'],
+                require_signature=options['require_signature'],
+                shop=shop,
+            )
+            for kind, row in events:
+                counts[kind] = counts.get(kind, 0) + 1
+                if kind != reconciliation.PRESENT:
+                    self.stdout.write('%s: orderID=%s PAYID=%s STATUS=%s\n' % (
+                        kind, row.get('orderID', '?'), row.get('PAYID', '?'),
+                        row.get('STATUS', '?')))
+
+        self.stdout.write('\n')
+        for kind in (reconciliation.PRESENT, reconciliation.MISSING,
+                     reconciliation.MISMATCHED, reconciliation.INVALID,
+                     reconciliation.UNKNOWN_ORDER):
+            self.stdout.write('%s: %s\n' % (kind, counts.get(kind, 0)))
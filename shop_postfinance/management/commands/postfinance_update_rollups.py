@@ -0,0 +1,32 @@
+#-*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop_postfinance import reporting
+
+
+class Command(BaseCommand):
+    help = ('Adds the notifications received since the last run to the '
+            'daily PostFinance totals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=int, default=5,
+                            help='Leave out the notifications of the last that many '
+                                 'minutes, their transactions may still be open '
+                                 '(default: 5).')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Notifications rolled up per transaction '
+                                 '(default: 10000).')
+        parser.add_argument('--reset', action='store_true', default=False,
+                            help='Delete the totals and roll the whole ledger up '
+                                 'again. Archived notifications are lost to them.')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reporting.reset()
+        count = reporting.update_rollups(
+            lag=timedelta(minutes=options['lag']),
+            batch_size=options['batch_size'])
+        self.stdout.write('%s notifications rolled up, up to %s\n' % (
+            count, reporting.get_watermark()))
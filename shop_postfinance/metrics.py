@@ -0,0 +1,155 @@
+#-*- coding: utf-8 -*-
+"""
+Timings and counters of the Postfinance backend.
+
+Every measurement is sent as a signal (see shop_postfinance.signals) and, if
+POSTFINANCE_METRICS_SINK names a sink class, handed to an instance of it.
+Three sinks are provided:
+
+* LoggingSink: logs every measurement to the 'shop_postfinance.metrics'
+  logger.
+* StatsdSink: sends the measurements to statsd over UDP
+  (POSTFINANCE_STATSD_HOST, POSTFINANCE_STATSD_PORT and
+  POSTFINANCE_STATSD_PREFIX).
+* PrometheusSink: aggregates the measurements in the process, render()
+  returns them in the Prometheus text format for your metrics view.
+
+Counter names: signature.accepted, signature.rejected, ipn.duplicate,
+ipn.response.<HTTP status>, ipn.payment_status.<PostFinance STATUS>,
+ipn.rejected.<reason>, outbox.delivered, outbox.retried and outbox.dead.
+"""
+import logging
+import socket
+import threading
+from contextlib import contextmanager
+from importlib import import_module
+from timeit import default_timer
+
+from django.conf import settings
+
+from shop_postfinance import signals
+
+
+class MetricsSink(object):
+    """
+    Base class of the sinks, which receive every timing (in seconds) and
+    counter increment.
+    """
+
+    def timing(self, name, seconds):
+        raise NotImplementedError
+
+    def incr(self, name, value=1):
+        raise NotImplementedError
+
+
+class LoggingSink(MetricsSink):
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def timing(self, name, seconds):
+        self.logger.info('%s took %.2fms', name, seconds * 1000)
+
+    def incr(self, name, value=1):
+        self.logger.info('%s +%s', name, value)
+
+
+class StatsdSink(MetricsSink):
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (
+            host or getattr(settings, 'POSTFINANCE_STATSD_HOST', 'localhost'),
+            port or getattr(settings, 'POSTFINANCE_STATSD_PORT', 8125),
+        )
+        self.prefix = prefix or getattr(settings, 'POSTFINANCE_STATSD_PREFIX', 'postfinance')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, line):
+        try:
+            self.socket.sendto(line.encode('ascii'), self.address)
+        except socket.error:
+            pass  # Metrics must never break payments.
+
+    def timing(self, name, seconds):
+        self._send('%s.%s:%d|ms' % (self.prefix, name, seconds * 1000))
+
+    def incr(self, name, value=1):
+        self._send('%s.%s:%d|c' % (self.prefix, name, value))
+
+
+class PrometheusSink(MetricsSink):
+
+    def __init__(self, prefix='postfinance'):
+        self.prefix = prefix
+        self.counters = {}
+        self.timings = {}  # name: [count, sum]
+        self.lock = threading.Lock()
+
+    def _metric_name(self, name):
+        return '%s_%s' % (self.prefix, name.replace('.', '_'))
+
+    def timing(self, name, seconds):
+        with self.lock:
+            summary = self.timings.setdefault(name, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = self._metric_name(name)
+                lines.append('# TYPE %s_total counter' % metric)
+                lines.append('%s_total %s' % (metric, value))
+            for name, (count, total) in sorted(self.timings.items()):
+                metric = self._metric_name(name) + '_seconds'
+                lines.append('# TYPE %s summary' % metric)
+                lines.append('%s_count %s' % (metric, count))
+                lines.append('%s_sum %r' % (metric, total))
+        return '\n'.join(lines) + '\n'
+
+
+_sink = None
+_sink_loaded = False
+
+
+def get_sink():
+    """
+    Returns the sink configured in POSTFINANCE_METRICS_SINK (a dotted path to
+    the class), or None. The sink is created once per process.
+    """
+    global _sink, _sink_loaded
+    if not _sink_loaded:
+        path = getattr(settings, 'POSTFINANCE_METRICS_SINK', None)
+        if path:
+            module_name, class_name = path.rsplit('.', 1)
+            _sink = getattr(import_module(module_name), class_name)()
+        _sink_loaded = True
+    return _sink
+
+
+def incr(name, value=1):
+    sink = get_sink()
+    if sink is not None:
+        sink.incr(name, value)
+
+
+@contextmanager
+def timed(sender, stage):
+    """
+    Measures the enclosed block, reporting it as ``stage``.
+    """
+    start = default_timer()
+    try:
+        yield
+    finally:
+        duration = default_timer() - start
+        signals.stage_timed.send(sender=sender, stage=stage, duration=duration)
+        sink = get_sink()
+        if sink is not None:
+            sink.timing(stage, duration)
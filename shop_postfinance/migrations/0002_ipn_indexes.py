@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Earlier releases recorded every delivery of a notification (PostFinance
+    retries, the success redirect), the unique key below only allows one:
+    the first row of each orderID, PAYID and STATUS is kept.
+    """
+    PostfinanceIPN = apps.get_model('shop_postfinance', 'PostfinanceIPN')
+    duplicated = (PostfinanceIPN.objects.values('orderID', 'PAYID', 'STATUS')
+                  .annotate(count=models.Count('pk'), first=models.Min('pk'))
+                  .filter(count__gt=1))
+    for row in duplicated.iterator():
+        PostfinanceIPN.objects.filter(
+            orderID=row['orderID'], PAYID=row['PAYID'], STATUS=row['STATUS'],
+        ).exclude(pk=row['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='postfinanceipn',
+            name='orderID',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Order ID'),
+        ),
+        migrations.AlterField(
+            model_name='postfinanceipn',
+            name='PAYID',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Payment ID'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='postfinanceipn',
+            unique_together={('orderID', 'PAYID', 'STATUS')},
+        ),
+    ]
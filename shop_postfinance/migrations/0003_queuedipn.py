@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0002_ipn_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedIPN',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('dead', 'Dead')], db_index=True, default='pending', max_length=16, verbose_name='state')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('claimed_by', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Available at')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Queued PostFinance IPN',
+                'verbose_name_plural': 'Queued PostFinance IPNs',
+                'ordering': ('available_at', 'id'),
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0003_queuedipn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactPostfinanceIPN',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orderID', models.CharField(db_index=True, max_length=255, verbose_name='Order ID')),
+                ('currency', models.CharField(max_length=3, verbose_name='currency')),
+                ('amount', models.BigIntegerField(null=True, verbose_name='Amount (in cents)')),
+                ('PM', models.CharField(max_length=64, verbose_name='Payment method')),
+                ('STATUS', models.SmallIntegerField(default=-1, verbose_name='status')),
+                ('TRXDATE', models.DateField(null=True, verbose_name='Transaction Date')),
+                ('PAYID', models.BigIntegerField(db_index=True, default=-1, verbose_name='Payment ID')),
+                ('BRAND', models.CharField(max_length=64, verbose_name='Card brand')),
+                ('extra', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'PostFinance IPN (compact)',
+                'verbose_name_plural': 'PostFinance IPNs (compact)',
+                'unique_together': {('orderID', 'PAYID', 'STATUS')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def copy_to_compact_ledger(apps, schema_editor):
+    """
+    Copies the existing notifications into the compact ledger, if it is the
+    one in use. Otherwise the postfinance_compact_ledger command does it
+    whenever POSTFINANCE_COMPACT_LEDGER gets switched on.
+    """
+    if not getattr(settings, 'POSTFINANCE_COMPACT_LEDGER', False):
+        return
+    from shop_postfinance.ledger import copy_to_compact
+    copy_to_compact(apps.get_model('shop_postfinance', 'PostfinanceIPN'),
+                    apps.get_model('shop_postfinance', 'CompactPostfinanceIPN'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0004_compactpostfinanceipn'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_to_compact_ledger, migrations.RunPython.noop),
+    ]
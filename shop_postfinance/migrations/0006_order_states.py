@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0005_copy_to_compact_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostfinanceOrderState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orderID', models.CharField(max_length=255, unique=True, verbose_name='Order ID')),
+                ('PAYID', models.CharField(max_length=255, verbose_name='Payment ID')),
+                ('STATUS', models.CharField(choices=[('5', 'Authorized'), ('9', 'Payment requested'), ('0', 'Invalid or incomplete'), ('2', 'Authorization refused'), ('51', 'Authorization waiting'), ('52', 'Authorisation not known'), ('91', 'Payment processing'), ('92', 'Payment uncertain'), ('93', 'Payment refused')], max_length=2, verbose_name='status')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'PostFinance order status',
+                'verbose_name_plural': 'PostFinance order statuses',
+            },
+        ),
+        migrations.CreateModel(
+            name='PostfinanceStatusTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orderID', models.CharField(db_index=True, max_length=255, verbose_name='Order ID')),
+                ('PAYID', models.CharField(max_length=255, verbose_name='Payment ID')),
+                ('from_status', models.CharField(blank=True, choices=[('5', 'Authorized'), ('9', 'Payment requested'), ('0', 'Invalid or incomplete'), ('2', 'Authorization refused'), ('51', 'Authorization waiting'), ('52', 'Authorisation not known'), ('91', 'Payment processing'), ('92', 'Payment uncertain'), ('93', 'Payment refused')], max_length=2, verbose_name='from status')),
+                ('to_status', models.CharField(choices=[('5', 'Authorized'), ('9', 'Payment requested'), ('0', 'Invalid or incomplete'), ('2', 'Authorization refused'), ('51', 'Authorization waiting'), ('52', 'Authorisation not known'), ('91', 'Payment processing'), ('92', 'Payment uncertain'), ('93', 'Payment refused')], max_length=2, verbose_name='to status')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'PostFinance status transition',
+                'verbose_name_plural': 'PostFinance status transitions',
+                'ordering': ('created_at', 'id'),
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def _text(value):
+    # The compact ledger stores numbers, -1 standing for none.
+    if value is None or value == -1:
+        return ''
+    return str(value)
+
+
+def seed_order_states(apps, schema_editor):
+    """
+    Gives every order already in the ledger the status its notifications
+    lead to, applied in the order they were recorded. Without it the next
+    notification of an order that was paid already would be taken for its
+    first one and confirmed once more.
+    """
+    from shop_postfinance.statemachine import is_allowed
+    if getattr(settings, 'POSTFINANCE_COMPACT_LEDGER', False):
+        ledger = apps.get_model('shop_postfinance', 'CompactPostfinanceIPN')
+    else:
+        ledger = apps.get_model('shop_postfinance', 'PostfinanceIPN')
+    PostfinanceOrderState = apps.get_model('shop_postfinance', 'PostfinanceOrderState')
+
+    def add(order_id, state):
+        if state is not None:
+            batch.append(PostfinanceOrderState(
+                orderID=order_id, PAYID=state[0], STATUS=state[1]))
+
+    rows = ledger.objects.order_by('orderID', 'pk').values_list(
+        'orderID', 'PAYID', 'STATUS').iterator()
+    batch = []
+    order_id = state = None
+    for row_order_id, pay_id, status in rows:
+        if row_order_id != order_id:
+            add(order_id, state)
+            if len(batch) >= 1000:
+                PostfinanceOrderState.objects.bulk_create(batch)
+                batch = []
+            order_id, state = row_order_id, None
+        pay_id, status = _text(pay_id), _text(status)
+        if is_allowed(state, pay_id, status):
+            state = (pay_id, status)
+    add(order_id, state)
+    PostfinanceOrderState.objects.bulk_create(batch)
+
+
+def delete_order_states(apps, schema_editor):
+    apps.get_model('shop_postfinance', 'PostfinanceOrderState').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0006_order_states'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_order_states, delete_order_states),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0007_initial_order_states'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='postfinanceipn',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='compactpostfinanceipn',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='PostfinanceDailyTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='date')),
+                ('currency', models.CharField(max_length=16, verbose_name='currency')),
+                ('PM', models.CharField(max_length=64, verbose_name='Payment method')),
+                ('BRAND', models.CharField(max_length=64, verbose_name='Card brand')),
+                ('STATUS', models.CharField(choices=[('5', 'Authorized'), ('9', 'Payment requested'), ('0', 'Invalid or incomplete'), ('2', 'Authorization refused'), ('51', 'Authorization waiting'), ('52', 'Authorisation not known'), ('91', 'Payment processing'), ('92', 'Payment uncertain'), ('93', 'Payment refused')], max_length=2, verbose_name='status')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='notifications')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='Amount (in cents)')),
+            ],
+            options={
+                'verbose_name': 'PostFinance daily total',
+                'verbose_name_plural': 'PostFinance daily totals',
+                'ordering': ('-date', 'currency', 'PM', 'BRAND', 'STATUS'),
+                'unique_together': {('date', 'currency', 'PM', 'BRAND', 'STATUS')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PostfinanceRollupWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+    ]
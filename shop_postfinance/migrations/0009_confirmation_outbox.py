@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_postfinance', '0008_daily_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostfinanceConfirmation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orderID', models.CharField(db_index=True, max_length=255, verbose_name='Order ID')),
+                ('PAYID', models.CharField(max_length=255, verbose_name='Payment ID')),
+                ('amount', models.CharField(max_length=255, verbose_name='Amount')),
+                ('STATUS', models.CharField(choices=[('5', 'Authorized'), ('9', 'Payment requested'), ('0', 'Invalid or incomplete'), ('2', 'Authorization refused'), ('51', 'Authorization waiting'), ('52', 'Authorisation not known'), ('91', 'Payment processing'), ('92', 'Payment uncertain'), ('93', 'Payment refused')], max_length=2, verbose_name='status')),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('dead', 'Dead')], db_index=True, default='pending', max_length=16, verbose_name='state')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Available at')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'PostFinance payment confirmation',
+                'verbose_name_plural': 'PostFinance payment confirmations',
+                'ordering': ('available_at', 'id'),
+            },
+        ),
+    ]
@@ -1,4 +1,10 @@
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
 from django.db import models
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -14,6 +20,14 @@ PAYMENT_STATUS = (
     ('93', _('Payment refused')),
 )
 
+# The parameters PostFinance sends with every notification, all of them are
+# stored in PostfinanceIPN.
+IPN_FIELDS = (
+    'orderID', 'currency', 'amount', 'PM', 'ACCEPTANCE', 'STATUS', 'CARDNO',
+    'CN', 'TRXDATE', 'PAYID', 'NCERROR', 'BRAND', 'IPCTY', 'CCCTY', 'ECI',
+    'CVCCheck', 'AAVCheck', 'VC', 'IP', 'SHASIGN',
+)
+
 
 class PostfinanceIPN(models.Model):
     """
@@ -26,7 +40,7 @@ class PostfinanceIPN(models.Model):
     
     I am not a lawyer :)
     """
-    orderID = models.CharField(_('Order ID'), max_length=255)  #=Test27&
+    orderID = models.CharField(_('Order ID'), max_length=255, db_index=True)  #=Test27&
     currency = models.CharField(_('currency'), max_length=255)  #=CHF&
     amount = models.CharField(_('Amount'), max_length=255)   #=54&
     PM = models.CharField(_('Payment method'), max_length=255)  #=CreditCard&
@@ -35,7 +49,7 @@ class PostfinanceIPN(models.Model):
     CARDNO = models.CharField(_('Credit Card Number'), max_length=255)  #=XXXXXXXXXXXX3333&ED=0317&
     CN = models.CharField(_('Customer Name'), max_length=255)  #Testauzore+Testos&
     TRXDATE = models.CharField(_('Transaction Date'), max_length=255)  #=11/08/10&
-    PAYID = models.CharField(_('Payment ID'), max_length=255)  #=8628366&
+    PAYID = models.CharField(_('Payment ID'), max_length=255, db_index=True)  #=8628366&
     NCERROR = models.CharField(_('Error code'), max_length=255)  #=0&
     BRAND = models.CharField(_('Card brand'), max_length=255)  #=VISA&
     IPCTY = models.CharField(max_length=255)  #=CH&
@@ -49,11 +63,329 @@ class PostfinanceIPN(models.Model):
     
     # Timestamping
     updated_at = models.DateTimeField(auto_now=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __unicode__(self):
         return u'%s (%s %s, %s)' % (self.orderID, self.amount, self.currency, self.PM)
 
+    @classmethod
+    def from_data(cls, data):
+        """
+        Builds an (unsaved) instance from IPN parameters, missing parameters
+        are stored as empty strings.
+        """
+        return cls(**dict((name, data.get(name, '')) for name in IPN_FIELDS))
+
     class Meta:
+        # One row per notification: retries of the same notification collide
+        # on this key instead of creating duplicates.
+        unique_together = ('orderID', 'PAYID', 'STATUS')
         verbose_name = _('PostFinance IPN')
-        verbose_name_plural = _('PostFinance IPNs')
\ No newline at end of file
+        verbose_name_plural = _('PostFinance IPNs')
+
+    def to_data(self):
+        """
+        The IPN parameters of this notification, as PostFinance sent them.
+        """
+        return dict((name, getattr(self, name)) for name in IPN_FIELDS)
+
+
+# The parameters CompactPostfinanceIPN keeps together in its "extra" column.
+COMPACT_EXTRA_FIELDS = (
+    'ACCEPTANCE', 'CARDNO', 'CN', 'NCERROR', 'IPCTY', 'CCCTY', 'ECI',
+    'CVCCheck', 'AAVCheck', 'VC', 'IP',
+)
+
+
+# Stored in CompactPostfinanceIPN's PAYID and STATUS when PostFinance sent
+# no number: a NULL would never collide in the unique key, letting the same
+# notification be recorded twice.
+NO_VALUE = -1
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CompactPostfinanceIPN(models.Model):
+    """
+    A smaller version of PostfinanceIPN, used instead of it when the
+    POSTFINANCE_COMPACT_LEDGER setting is True: the values that are queried
+    are stored with their real types, the amount in cents, the parameters
+    nobody looks at outside of audits are packed into one JSON column and
+    the SHASIGN is not kept at all (it was checked before saving).
+    """
+    orderID = models.CharField(_('Order ID'), max_length=255, db_index=True)
+    currency = models.CharField(_('currency'), max_length=3)
+    amount = models.BigIntegerField(_('Amount (in cents)'), null=True)
+    PM = models.CharField(_('Payment method'), max_length=64)
+    STATUS = models.SmallIntegerField(_('status'), default=NO_VALUE)
+    TRXDATE = models.DateField(_('Transaction Date'), null=True)
+    PAYID = models.BigIntegerField(_('Payment ID'), default=NO_VALUE, db_index=True)
+    BRAND = models.CharField(_('Card brand'), max_length=64)
+    extra = models.TextField(blank=True)  # JSON, see COMPACT_EXTRA_FIELDS
+
+    # Timestamping
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __unicode__(self):
+        return u'%s (%s %s, %s)' % (self.orderID, self.get_amount(), self.currency, self.PM)
+
+    @staticmethod
+    def compact_fields(data):
+        """
+        Converts IPN parameters into the field values of this model.
+        """
+        try:
+            amount = int(Decimal(data.get('amount', '')) * 100)
+        except (InvalidOperation, ValueError, OverflowError):  # "NaN", "Infinity"
+            amount = None
+        try:
+            # PostFinance sends MM/DD/YY
+            trxdate = datetime.strptime(data.get('TRXDATE', ''), '%m/%d/%y').date()
+        except ValueError:
+            trxdate = None
+        extra = dict((name, data[name]) for name in COMPACT_EXTRA_FIELDS
+                     if data.get(name))
+        numbers = {}
+        for name in ('STATUS', 'PAYID'):
+            numbers[name] = _to_int(data.get(name))
+            if numbers[name] is None:
+                numbers[name] = NO_VALUE
+                if data.get(name):
+                    # Not a number after all, kept as sent.
+                    extra[name] = data[name]
+        return {
+            'orderID': data.get('orderID', ''),
+            'currency': data.get('currency', '')[:3],
+            'amount': amount,
+            'PM': data.get('PM', '')[:64],
+            'STATUS': numbers['STATUS'],
+            'TRXDATE': trxdate,
+            'PAYID': numbers['PAYID'],
+            'BRAND': data.get('BRAND', '')[:64],
+            'extra': json.dumps(extra, sort_keys=True) if extra else '',
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(**cls.compact_fields(data))
+
+    def get_amount(self):
+        """
+        The amount formatted the way PostFinance sends it ("54", "54.5").
+        """
+        if self.amount is None:
+            return ''
+        amount = Decimal(self.amount) / 100
+        if amount == amount.to_integral_value():
+            return str(amount.to_integral_value())
+        return str(amount.normalize())
+
+    def to_data(self):
+        data = dict((name, '') for name in IPN_FIELDS)
+        extra = json.loads(self.extra) if self.extra else {}
+        data.update(extra)
+        data.update(
+            orderID=self.orderID,
+            currency=self.currency,
+            amount=self.get_amount(),
+            PM=self.PM,
+            TRXDATE=self.TRXDATE.strftime('%m/%d/%y') if self.TRXDATE else '',
+            BRAND=self.BRAND,
+        )
+        for name in ('STATUS', 'PAYID'):
+            value = getattr(self, name)
+            if value is not None and value != NO_VALUE:
+                data[name] = str(value)
+            else:
+                data[name] = extra.get(name, '')
+        return data
+
+    class Meta:
+        unique_together = ('orderID', 'PAYID', 'STATUS')
+        verbose_name = _('PostFinance IPN (compact)')
+        verbose_name_plural = _('PostFinance IPNs (compact)')
+
+
+class PostfinanceOrderState(models.Model):
+    """
+    The current PostFinance status of every order, as maintained by
+    shop_postfinance.statemachine.
+    """
+    orderID = models.CharField(_('Order ID'), max_length=255, unique=True)
+    PAYID = models.CharField(_('Payment ID'), max_length=255)
+    STATUS = models.CharField(_('status'), max_length=2, choices=PAYMENT_STATUS)
+
+    # Timestamping
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.orderID, self.get_STATUS_display())
+
+    class Meta:
+        verbose_name = _('PostFinance order status')
+        verbose_name_plural = _('PostFinance order statuses')
+
+
+class PostfinanceStatusTransition(models.Model):
+    """
+    Log of every status change applied to an order, from_status being empty
+    for the first one.
+    """
+    orderID = models.CharField(_('Order ID'), max_length=255, db_index=True)
+    PAYID = models.CharField(_('Payment ID'), max_length=255)
+    from_status = models.CharField(_('from status'), max_length=2, blank=True,
+                                   choices=PAYMENT_STATUS)
+    to_status = models.CharField(_('to status'), max_length=2,
+                                 choices=PAYMENT_STATUS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'%s: %s -> %s' % (self.orderID, self.from_status or '-', self.to_status)
+
+    class Meta:
+        ordering = ('created_at', 'id')
+        verbose_name = _('PostFinance status transition')
+        verbose_name_plural = _('PostFinance status transitions')
+
+
+class PostfinanceDailyTotal(models.Model):
+    """
+    Number and sum of the notifications of one day, by currency, payment
+    method, card brand and status. Maintained by the
+    postfinance_update_rollups management command, see
+    shop_postfinance.reporting.
+    """
+    date = models.DateField(_('date'), db_index=True)
+    currency = models.CharField(_('currency'), max_length=16)
+    PM = models.CharField(_('Payment method'), max_length=64)
+    BRAND = models.CharField(_('Card brand'), max_length=64)
+    STATUS = models.CharField(_('status'), max_length=2, choices=PAYMENT_STATUS)
+    count = models.PositiveIntegerField(_('notifications'), default=0)
+    amount = models.BigIntegerField(_('Amount (in cents)'), default=0)
+
+    def __unicode__(self):
+        return u'%s %s %s/%s %s: %s' % (self.date, self.currency, self.PM,
+                                        self.BRAND, self.STATUS, self.count)
+
+    def get_amount(self):
+        return Decimal(self.amount) / 100
+
+    class Meta:
+        ordering = ('-date', 'currency', 'PM', 'BRAND', 'STATUS')
+        unique_together = ('date', 'currency', 'PM', 'BRAND', 'STATUS')
+        verbose_name = _('PostFinance daily total')
+        verbose_name_plural = _('PostFinance daily totals')
+
+
+class PostfinanceRollupWatermark(models.Model):
+    """
+    How far the ledger has been rolled up into PostfinanceDailyTotal: every
+    notification created before ``created_at`` is counted.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField()
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.name, self.created_at)
+
+
+def get_ledger_model():
+    """
+    The model notifications are recorded in: CompactPostfinanceIPN if
+    POSTFINANCE_COMPACT_LEDGER is set, PostfinanceIPN otherwise.
+    """
+    if getattr(settings, 'POSTFINANCE_COMPACT_LEDGER', False):
+        return CompactPostfinanceIPN
+    return PostfinanceIPN
+
+
+class QueuedIPN(models.Model):
+    """
+    Staging area for notifications received while POSTFINANCE_IPN_QUEUE is
+    enabled. The IPN view only checks the signature and appends the raw
+    payload here; the postfinance_process_ipn_queue management command does
+    the actual order lookup and confirmation later on.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATES = (
+        (PENDING, _('Pending')),
+        (PROCESSING, _('Processing')),
+        (DONE, _('Done')),
+        (DEAD, _('Dead')),
+    )
+
+    payload = models.TextField(_('Payload'))  # JSON encoded IPN parameters
+    state = models.CharField(_('state'), max_length=16, choices=STATES,
+                             default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last error'), blank=True)
+    claimed_by = models.CharField(max_length=64, blank=True, db_index=True)
+    available_at = models.DateTimeField(_('Available at'), default=now,
+                                        db_index=True)
+
+    # Timestamping
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'#%s (%s, %s attempts)' % (self.pk, self.state, self.attempts)
+
+    def get_data(self):
+        return json.loads(self.payload)
+
+    class Meta:
+        ordering = ('available_at', 'id')
+        verbose_name = _('Queued PostFinance IPN')
+        verbose_name_plural = _('Queued PostFinance IPNs')
+
+
+class PostfinanceConfirmation(models.Model):
+    """
+    A payment confirmation waiting to be delivered to the shop, written in
+    the same transaction as the notification it comes from while
+    POSTFINANCE_CONFIRMATION_OUTBOX is enabled. The
+    postfinance_dispatch_confirmations management command delivers them,
+    see shop_postfinance.outbox.
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATES = (
+        (PENDING, _('Pending')),
+        (DONE, _('Done')),
+        (DEAD, _('Dead')),
+    )
+
+    orderID = models.CharField(_('Order ID'), max_length=255, db_index=True)
+    PAYID = models.CharField(_('Payment ID'), max_length=255)
+    amount = models.CharField(_('Amount'), max_length=255)
+    STATUS = models.CharField(_('status'), max_length=2, choices=PAYMENT_STATUS)
+    state = models.CharField(_('state'), max_length=16, choices=STATES,
+                             default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last error'), blank=True)
+    available_at = models.DateTimeField(_('Available at'), default=now,
+                                        db_index=True)
+
+    # Timestamping
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'%s/%s (%s, %s attempts)' % (self.orderID, self.PAYID,
+                                             self.state, self.attempts)
+
+    class Meta:
+        ordering = ('available_at', 'id')
+        verbose_name = _('PostFinance payment confirmation')
+        verbose_name_plural = _('PostFinance payment confirmations')
@@ -1,19 +1,24 @@
-from django import forms
 from django.conf import settings
-from django.conf.urls import patterns, url
-from django.db import models
-from django.core.urlresolvers import reverse
-from django.forms.forms import DeclarativeFieldsMetaclass
+from django.db import models, transaction, IntegrityError
 from django.http import (HttpResponseBadRequest, HttpResponse, 
-    HttpResponseRedirect, Http404)
-from django.shortcuts import render_to_response
-from django.template.context import RequestContext
+    HttpResponseForbidden, HttpResponseRedirect, Http404)
 from django.utils.translation import get_language
 from django.utils.http import urlencode
-from django.views.decorators.csrf import csrf_exempt
-from shop_postfinance.forms import ValueHiddenInput
-from shop_postfinance.models import PostfinanceIPN
-from shop_postfinance.utils import security_check, compute_security_checksum
+from importlib import import_module
+from shop_postfinance import (dedup, ipn_filter, metrics, signals,
+    statemachine, tenants)
+from shop_postfinance.models import get_ledger_model
+from shop_postfinance.utils import get_signer, security_check
+
+try:
+    from django.urls import re_path as url, reverse
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url
+    from django.core.urlresolvers import reverse
+
+# Forms and templates are imported where they are used, so that management
+# commands and queue workers, which never render a payment form, don't pay
+# for them.
 
 
 def absolute_url(request, path):
@@ -21,6 +26,29 @@ def absolute_url(request, path):
                           request.get_host(), path)
 
 
+def get_request_data(request):
+    """
+    The GET and POST parameters of the request, POST winning (what
+    request.REQUEST used to be).
+    """
+    data = request.GET.copy()
+    data.update(request.POST)
+    return data
+
+
+def get_backend():
+    """
+    Builds a backend outside of the request/response cycle (management
+    commands, workers), using the shop interface configured in the
+    POSTFINANCE_SHOP_INTERFACE setting (django-SHOP's PaymentAPI by default).
+    """
+    path = getattr(settings, 'POSTFINANCE_SHOP_INTERFACE',
+                   'shop.payment.api.PaymentAPI')
+    module_name, class_name = path.rsplit('.', 1)
+    shop_class = getattr(import_module(module_name), class_name)
+    return OffsitePostfinanceBackend(shop=shop_class())
+
+
 class OffsitePostfinanceBackend(object):
     backend_name = "Postfinance"
     url_namespace = "postfinance"
@@ -31,30 +59,21 @@ class OffsitePostfinanceBackend(object):
     
     def __init__(self, shop):
         self.shop = shop
-        assert getattr(settings, 'POSTFINANCE_SECRET_KEY', None), 'You need to define a POSTFINANCE_SECRET_KEY="..." setting in your settings file.'
-        assert getattr(settings, 'POSTFINANCE_PSP_ID', None), 'Please define a POSTFINANCE_PSP_ID="..." setting in your settings file.'
-        assert getattr(settings, 'POSTFINANCE_CURRENCY', None), 'Please define a POSTFINANCE_CURRENCY="..." setting in your settings file.'
-        self.extra_data = getattr(settings, 'POSTFINANCE_EXTRA_CONFIGS', {})
-        self.language_conversion_table = getattr(settings, 'POSTFINANCE_RFC5646_CONVERSION_TABLE', {})
-        self.fallback_language = getattr(settings, 'POSTFINANCE_FALLBACK_LANGUAGE', None)
-        if self.fallback_language:
-            # validate
-            errmsg = ('POSTFINANCE_FALLBACK_LANGUAGE setting must be in '
-                'format "xx_YY" where "xx" is a ISO-639-1 code and "YY" a '
-                'ISO-3166 code.')
-            assert self.fallback_language.count('_') == 1, errmsg
-            assert len(self.fallback_language) == 5, errmsg
-            assert self.fallback_language[0].islower(), errmsg
-            assert self.fallback_language[1].islower(), errmsg
-            assert self.fallback_language[2] == '_'
-            assert self.fallback_language[3].isupper(), errmsg
-            assert self.fallback_language[4].isupper(), errmsg
-        else:
-            self.fallback_language = 'de_DE'
-        self.entry_url = getattr(settings, 'POSTFINANCE_ENTRY_URL', 'https://e-payment.postfinance.ch/ncol/test/orderstandard_utf8.asp')
+        # The default tenant; see shop_postfinance.tenants for the others.
+        self.config = tenants.get_config()
+        self.extra_data = self.config.extra_data
+        self.language_conversion_table = self.config.language_conversion_table
+        self.fallback_language = self.config.fallback_language
+        self.entry_url = self.config.entry_url
         self.skip_confirmation = getattr(settings, 'POSTFINANCE_SKIP_CONFIRMATION_VIEW', False)
+        self.queue_ipns = getattr(settings, 'POSTFINANCE_IPN_QUEUE', False)
+        self.fast_form_rendering = getattr(settings, 'POSTFINANCE_FAST_FORM_RENDERING', False)
+        self.async_views = getattr(settings, 'POSTFINANCE_ASYNC_VIEWS', False)
+        self.success_view_records = getattr(settings, 'POSTFINANCE_SUCCESS_VIEW_RECORDS', True)
+        self.deprecated_ipn_url = getattr(settings, 'POSTFINANCE_DEPRECATED_IPN_URL', True)
+        self.confirmation_outbox = getattr(settings, 'POSTFINANCE_CONFIRMATION_OUTBOX', False)
     
-    def _convert_language(self, rfc5646_language_code):
+    def _convert_language(self, rfc5646_language_code, config=None):
         """
         Turn a RFC5646 (http://tools.ietf.org/html/rfc5646) language code into
         ISO-639-1+ISO-3166 language codes using the
@@ -62,30 +81,51 @@ class OffsitePostfinanceBackend(object):
         as defined in POSTFINANCE_FALLBACK_LANGUAGE (or 'de_DE' if None is
         defined).
         """
-        found = self.language_conversion_table.get(rfc5646_language_code)
-        if found:
-            return found
-        return self.fallback_language
+        return (config or self.config).convert_language(rfc5646_language_code)
+
+    def get_config(self, request=None, currency=None):
+        """
+        The tenant configuration (see shop_postfinance.tenants) to use for a
+        checkout.
+        """
+        return tenants.for_checkout(request, currency)
 
     def get_urls(self):
-        urlpatterns = patterns('',
+        if self.async_views:
+            return self.get_async_urls()
+        from django.views.decorators.csrf import csrf_exempt
+        urlpatterns = [
             url(r'^$', self.view_that_asks_for_money, name='postfinance' ),
             url(r'^success/$', self.postfinance_return_successful_view, name='postfinance_success'),
             url(r'^instantpaymentnotification/$', csrf_exempt(self.postfinance_ipn), name='postfinance_ipn'),
-            url(r'^somethinghardtoguess/instantpaymentnotification/$', csrf_exempt(self.postfinance_ipn), kwargs={'deprecated': True}),
-        )
+        ]
+        if self.deprecated_ipn_url:
+            urlpatterns.append(url(r'^somethinghardtoguess/instantpaymentnotification/$', csrf_exempt(self.postfinance_ipn), kwargs={'deprecated': True}))
         return urlpatterns
 
+    def get_async_urls(self):
+        """
+        The same views as get_urls(), as coroutines for ASGI deployments
+        (Django >= 3.1).
+        """
+        from shop_postfinance.async_views import get_async_urls
+        return get_async_urls(self)
+
     def get_form_initial(self, request, order, **fields):
+        with metrics.timed(self.__class__, 'checkout.get_form_initial'):
+            return self._get_form_initial(request, order, **fields)
+
+    def _get_form_initial(self, request, order, **fields):
+        config = self.get_config(request, fields.get('currency'))
         order_id = self.shop.get_order_unique_id(order)
         amount = self.shop.get_order_total(order)
-        currency = settings.POSTFINANCE_CURRENCY.upper()
-        language = self._convert_language(get_language())
+        currency = config.currency
+        language = self._convert_language(get_language(), config)
 
         amount = str(int(amount * 100))
 
         initial = {
-            'PSPID': settings.POSTFINANCE_PSP_ID,
+            'PSPID': config.psp_id,
             'orderID': order_id,
             'amount': amount,
             'currency': currency,
@@ -93,20 +133,39 @@ class OffsitePostfinanceBackend(object):
             'ACCEPTURL': absolute_url(request, reverse('postfinance_success')),
             'CANCELURL': absolute_url(request, reverse('cart_delete')),
         }
-        initial.update(self.extra_data)
+        initial.update(config.extra_data)
         initial.update(**fields)
-        initial['SHASign'] = compute_security_checksum(**initial)
+        initial['SHASign'] = get_signer(config.secret_key).sign(initial)
         return initial
 
     def get_form(self, request, order, prefix=None, **fields):
+        from shop_postfinance.forms import get_form_class
         initial = self.get_form_initial(request, order, **fields)
+        with metrics.timed(self.__class__, 'checkout.get_form'):
+            form_class = get_form_class(initial)
+            return form_class(initial=initial, prefix=prefix)
 
-        fields = {}
-        for key in initial:
-            fields[key] = forms.CharField(widget=ValueHiddenInput())
+    def get_directlink_client(self, tenant=None, **kwargs):
+        """
+        Returns a DirectLink client (status queries, captures and refunds)
+        using the same configuration as this backend, or as tenant
+        ``tenant``.
+        """
+        from shop_postfinance.directlink import DirectLinkClient
+        config = tenants.get_config(tenant)
+        kwargs.setdefault('psp_id', config.psp_id)
+        kwargs.setdefault('secret_key', config.secret_key)
+        kwargs.setdefault('base_url', getattr(settings, 'POSTFINANCE_DIRECTLINK_URL', None)
+                          or config.entry_url.rsplit('/', 1)[0])
+        return DirectLinkClient(**kwargs)
 
-        form_class = DeclarativeFieldsMetaclass('PostfinanceForm', (forms.Form,), fields)
-        return form_class(initial=initial, prefix=prefix)
+    def get_form_html(self, request, order, prefix=None, **fields):
+        """
+        Same hidden inputs as get_form() renders, written out directly.
+        """
+        from shop_postfinance.forms import render_hidden_inputs
+        initial = self.get_form_initial(request, order, **fields)
+        return render_hidden_inputs(initial, prefix=prefix)
 
     #===========================================================================
     # Views
@@ -117,17 +176,26 @@ class OffsitePostfinanceBackend(object):
         We need this to be a method and not a function, since we need to have
         a reference to the shop interface
         """
+        from django.shortcuts import render
         order = self.shop.get_order(request)
+        entry_url = self.get_config(request).entry_url
         if self.skip_confirmation:
             data = self.get_form_initial(request, order)
-            url = '%s?%s' % (self.entry_url, urlencode(data))
+            url = '%s?%s' % (entry_url, urlencode(data))
             return HttpResponseRedirect(url)
-        context = RequestContext(request, {'form': self.get_form(request, order), 'url': self.entry_url})
-        return render_to_response("shop_postfinance/payment.html", context)
+        if self.fast_form_rendering:
+            context = {'form_html': self.get_form_html(request, order), 'url': entry_url}
+        else:
+            context = {'form': self.get_form(request, order), 'url': entry_url}
+        return render(request, "shop_postfinance/payment.html", context)
     
     def postfinance_return_successful_view(self, request):
         if request.GET:
-            self.postfinance_ipn(request)
+            if self.success_view_records:
+                self.handle_ipn_request(request)
+            else:
+                # The server-to-server notification records the payment.
+                self.verify_payment_data(get_request_data(request))
         return HttpResponseRedirect(self.shop.get_finished_url())
     
     def postfinance_ipn(self, request, deprecated=False):
@@ -167,56 +235,151 @@ class OffsitePostfinanceBackend(object):
         if deprecated:
             import warnings
             warnings.warn('usage of this URL is deprecated. Please use the URL without the "somethinghardtoguess" part.', DeprecationWarning)
-        data = request.REQUEST
+        data = get_request_data(request)
+        response = self.filter_ipn(request, data)
+        if response is not None:
+            return response
+        response = self.handle_ipn_request(request, data)
+        if response.status_code == 200:
+            ipn_filter.get_filter().remember(data)
+        return response
+
+    def handle_ipn_request(self, request, data=None):
+        if data is None:
+            data = get_request_data(request)
+        try:
+            response = self.handle_ipn_data(data)
+        except Http404:
+            self._count_response(404)
+            raise
+        self._count_response(response.status_code)
+        return response
+
+    def filter_ipn(self, request, data):
+        """
+        Runs the checks of shop_postfinance.ipn_filter on a request to the
+        notification URL. Returns the response to send instead of handling
+        it, or None.
+        """
+        check = ipn_filter.get_filter()
+        reason = check.check_request(request)
+        if reason is None and check.is_replay(data):
+            reason = ipn_filter.REPLAY
+        if reason is None:
+            return None
+        check.count(reason)
+        if reason == ipn_filter.IP_NOT_ALLOWED:
+            return HttpResponseForbidden()
+        if reason == ipn_filter.RATE_LIMITED:
+            return HttpResponse(status=429)
+        # Already handled, answered the same way again.
+        return HttpResponse('OKAY')
+
+    def _count_response(self, status_code):
+        signals.ipn_response.send(sender=self.__class__, status_code=status_code)
+        metrics.incr('ipn.response.%s' % status_code)
+
+    def handle_ipn_data(self, data):
         # Verify that the info is valid (with the SHA sum)
-        if self.confirm_payment_data(data):
-            return HttpResponse('OKAY')
+        if self.verify_payment_data(data):
+            return self.handle_verified_ipn_data(data)
         else:  # Checksum failed
             return HttpResponseBadRequest()
 
+    def handle_verified_ipn_data(self, data):
+        if dedup.is_recorded(data):
+            self._count_duplicate(data)
+        elif self.queue_ipns:
+            # A postfinance_process_ipn_queue worker does the rest.
+            from shop_postfinance.ipn_queue import enqueue
+            enqueue(data)
+        else:
+            self.record_payment_data(data)
+        return HttpResponse('OKAY')
+
+    def verify_payment_data(self, data):
+        with metrics.timed(self.__class__, 'ipn.verify'):
+            try:
+                config = tenants.for_notification(data)
+                valid = security_check(data, config.shaout_key)
+            except KeyError:
+                valid = False
+        signals.signature_checked.send(sender=self.__class__, valid=valid)
+        metrics.incr('signature.accepted' if valid else 'signature.rejected')
+        return valid
+
     def confirm_payment_data(self, data):
-        try:
-            valid = security_check(data, settings.POSTFINANCE_SHAOUT_KEY)
-        except KeyError:
-            valid = False
-        if valid:
-            order_id = data['orderID']
+        if self.verify_payment_data(data):
+            self.record_payment_data(data)
+            return True
+        else:  # Checksum failed
+            return False
+
+    def record_payment_data(self, data):
+        """
+        Stores an already verified notification in the IPN ledger, applies
+        the status it carries to the order (see shop_postfinance.statemachine)
+        and confirms the payment with the shop once the order becomes paid.
+        All of it happens in one transaction: if the shop fails, nothing is
+        recorded and PostFinance's next attempt starts over. With
+        POSTFINANCE_CONFIRMATION_OUTBOX the confirmation is stored in that
+        transaction instead, to be delivered later (see
+        shop_postfinance.outbox).
+
+        The ledger row is inserted straight away: a notification that was
+        already recorded (PostFinance retries, or the success redirect racing
+        the server-to-server IPN) bounces off the unique
+        (orderID, PAYID, STATUS) key, so only one of them ever reaches
+        shop.confirm_payment(). Duplicates of the latest notification of an
+        order, and notifications recorded in the last few minutes (see
+        shop_postfinance.dedup), are recognised from the cache before any
+        query is made.
+
+        Returns the IPN instance (None for such duplicates) and whether it
+        was newly created.
+        """
+        order_id = data['orderID']
+        if statemachine.is_current(data) or dedup.is_recorded(data):
+            self._count_duplicate(data)
+            return None, False
+        with metrics.timed(self.__class__, 'ipn.get_order'):
             try:
                 order = self.shop.get_order_for_id(order_id)
             except models.ObjectDoesNotExist:
                 raise Http404('Order does not exist on this machine')
-            transaction_id = data['PAYID']
-            amount = data['amount']
-            # Create an IPN transaction trace in the database
-            ipn, created = PostfinanceIPN.objects.get_or_create(
-                orderID=order_id,
-                defaults=dict(
-                    currency=data.get('currency', ''),
-                    amount=data.get('amount', ''),
-                    PM=data.get('PM', ''),
-                    ACCEPTANCE=data.get('ACCEPTANCE', ''),
-                    STATUS=data.get('STATUS', ''),
-                    CARDNO=data.get('CARDNO', ''),
-                    CN=data.get('CN', ''),
-                    TRXDATE=data.get('TRXDATE', ''),
-                    PAYID=data.get('PAYID', ''),
-                    NCERROR=data.get('NCERROR', ''),
-                    BRAND=data.get('BRAND', ''),
-                    IPCTY=data.get('IPCTY', ''),
-                    CCCTY=data.get('CCCTY', ''),
-                    ECI=data.get('ECI', ''),
-                    CVCCheck=data.get('CVCCheck', ''),
-                    AAVCheck=data.get('AAVCheck', ''),
-                    VC=data.get('VC', ''),
-                    IP=data.get('IP', ''),
-                    SHASIGN=data.get('SHASIGN', ''),
-                )
-            )
+        transaction_id = data['PAYID']
+        amount = data['amount']
+        metrics.incr('ipn.payment_status.%s' % data.get('STATUS', ''))
+        # Create an IPN transaction trace in the database
+        ipn = get_ledger_model().from_data(data)
+        with transaction.atomic():
+            with metrics.timed(self.__class__, 'ipn.ledger_write'):
+                try:
+                    with transaction.atomic():
+                        ipn.save(force_insert=True)
+                except IntegrityError:
+                    created = False
+                else:
+                    created = True
             if created:
-                # This actually records the payment in the shop's database
-                self.shop.confirm_payment(order, amount, transaction_id, self.backend_name)
+                with metrics.timed(self.__class__, 'ipn.apply_status'):
+                    transition = statemachine.apply_notification(data)
+                if statemachine.confirms_payment(transition):
+                    if self.confirmation_outbox:
+                        from shop_postfinance import outbox
+                        outbox.add(data)
+                    else:
+                        # This actually records the payment in the shop's database
+                        with metrics.timed(self.__class__, 'ipn.confirm_payment'):
+                            self.shop.confirm_payment(order, amount, transaction_id, self.backend_name)
+        if not created:
+            # Somebody else already recorded this very notification.
+            dedup.mark_recorded(data)
+            self._count_duplicate(data)
+            return ipn, False
+        dedup.mark_recorded(data)
+        return ipn, True
 
-            return True
-
-        else:  # Checksum failed
-            return False
\ No newline at end of file
+    def _count_duplicate(self, data):
+        signals.ipn_duplicate.send(sender=self.__class__, data=data)
+        metrics.incr('ipn.duplicate')
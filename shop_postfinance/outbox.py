@@ -0,0 +1,138 @@
+#-*- coding: utf-8 -*-
+"""
+Transactional outbox of payment confirmations.
+
+With POSTFINANCE_CONFIRMATION_OUTBOX = True, recording a notification that
+makes an order paid doesn't call shop.confirm_payment() itself: the ledger
+row, the order state and a PostfinanceConfirmation are committed in a single
+transaction, so either the notification and its confirmation are both
+stored or neither is (and PostFinance retries it).
+
+ConfirmationDispatcher, run by the postfinance_dispatch_confirmations
+management command, then delivers the pending confirmations to the shop in
+batches. A batch is one transaction: the shop's writes and the entries
+marked as done are committed together, once per batch instead of once per
+confirmation. A confirmation that fails is rolled back on its own (in a
+savepoint) and retried with an exponential backoff, until it is marked as
+dead after POSTFINANCE_OUTBOX_MAX_ATTEMPTS attempts.
+
+Delivery is at least once: anything confirm_payment() does outside the
+database (e.g. sending an email) may happen again if its batch fails to
+commit.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from shop_postfinance import metrics
+from shop_postfinance.models import PostfinanceConfirmation
+
+logger = logging.getLogger(__name__)
+
+
+def add(data):
+    """
+    Stores the confirmation of the (verified) notification ``data``, meant
+    to be called in the transaction recording it.
+    """
+    return PostfinanceConfirmation.objects.create(
+        orderID=data['orderID'], PAYID=data['PAYID'], amount=data['amount'],
+        STATUS=data.get('STATUS', ''))
+
+
+def _due(batch_size):
+    queryset = PostfinanceConfirmation.objects.filter(
+        state=PostfinanceConfirmation.PENDING, available_at__lte=now())
+    # Several dispatchers each take other rows where the database allows it
+    # (Django >= 1.11), instead of waiting for each other's batch.
+    if getattr(connection.features, 'has_select_for_update_skip_locked', False):
+        queryset = queryset.select_for_update(skip_locked=True)
+    else:
+        queryset = queryset.select_for_update()
+    return list(queryset[:batch_size])
+
+
+class ConfirmationDispatcher(object):
+    """
+    Delivers pending confirmations to ``backend.shop``, ``batch_size`` per
+    transaction.
+    """
+
+    def __init__(self, backend, batch_size=100, max_attempts=None,
+                 retry_delay=None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or getattr(
+            settings, 'POSTFINANCE_OUTBOX_MAX_ATTEMPTS', 10)
+        self.retry_delay = retry_delay or getattr(
+            settings, 'POSTFINANCE_OUTBOX_RETRY_DELAY', 60)
+        self.stats = {'done': 0, 'retried': 0, 'dead': 0}
+
+    def deliver(self, entry):
+        shop = self.backend.shop
+        with metrics.timed(self.backend.__class__, 'outbox.confirm_payment'):
+            order = shop.get_order_for_id(entry.orderID)
+            shop.confirm_payment(order, entry.amount, entry.PAYID,
+                                 self.backend.backend_name)
+
+    def fail(self, entry):
+        entry.attempts += 1
+        entry.last_error = traceback.format_exc()
+        if entry.attempts >= self.max_attempts:
+            entry.state = PostfinanceConfirmation.DEAD
+            logger.error('Giving up on the confirmation of order %s after %s '
+                         'attempts', entry.orderID, entry.attempts)
+            self.stats['dead'] += 1
+            metrics.incr('outbox.dead')
+        else:
+            delay = self.retry_delay * 2 ** (entry.attempts - 1)
+            entry.available_at = now() + timedelta(seconds=delay)
+            logger.warning('The confirmation of order %s failed, retrying in '
+                           '%ss', entry.orderID, delay)
+            self.stats['retried'] += 1
+            metrics.incr('outbox.retried')
+        entry.save()
+
+    def dispatch_batch(self):
+        """
+        Delivers one batch of due confirmations. Returns the number of
+        entries handled.
+        """
+        with transaction.atomic():
+            batch = _due(self.batch_size)
+            done = []
+            for entry in batch:
+                try:
+                    with transaction.atomic():
+                        self.deliver(entry)
+                except Exception:
+                    self.fail(entry)
+                else:
+                    done.append(entry.pk)
+            if done:
+                PostfinanceConfirmation.objects.filter(pk__in=done).update(
+                    state=PostfinanceConfirmation.DONE,
+                    attempts=F('attempts') + 1, last_error='',
+                    updated_at=now())
+        self.stats['done'] += len(done)
+        if done:
+            metrics.incr('outbox.delivered', len(done))
+        return len(batch)
+
+    def run(self, loop=False, sleep=5):
+        """
+        Dispatches batches until no confirmation is due. If ``loop`` is set,
+        keeps polling for new ones every ``sleep`` seconds.
+        """
+        while True:
+            while self.dispatch_batch():
+                pass
+            if not loop:
+                return self.stats
+            time.sleep(sleep)
@@ -0,0 +1,134 @@
+#-*- coding: utf-8 -*-
+"""
+Signed payment links for orders the customer isn't currently checking out,
+e.g. for invoice emails: the same redirect to PostFinance that
+POSTFINANCE_SKIP_CONFIRMATION_VIEW sends customers to, built without a
+request.
+
+The return URLs are resolved once against a base URL (base_url, or the
+POSTFINANCE_BASE_URL setting, e.g. "https://shop.example.com"), and one
+signer is used for every link. generate_links() streams its results, so any
+number of orders can be processed in constant memory, optionally signing in
+a pool of processes.
+"""
+import itertools
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.http import urlencode
+from django.utils.translation import get_language
+
+from shop_postfinance import tenants
+from shop_postfinance.utils import get_signer
+
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 2.0
+    from django.core.urlresolvers import reverse
+
+
+class PaymentLinkBuilder(object):
+    """
+    Builds the signed PostFinance URL of an order id and amount. Only holds
+    plain data, so it can be sent to worker processes.
+    """
+
+    def __init__(self, parameters, entry_url, secret_key, algorithm):
+        self.parameters = parameters
+        self.entry_url = entry_url
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        # Only orderID, amount and SHASign differ from one link to the next.
+        self.url_prefix = '%s?%s&' % (entry_url, urlencode(parameters))
+
+    @classmethod
+    def from_settings(cls, base_url=None, tenant=None, language=None, **fields):
+        """
+        A builder for tenant ``tenant`` (the default one unless given).
+        ``fields`` are added to (or override) the parameters of every link.
+        """
+        base_url = base_url or getattr(settings, 'POSTFINANCE_BASE_URL', None)
+        if not base_url:
+            raise ImproperlyConfigured(
+                'Please define a POSTFINANCE_BASE_URL="https://..." setting, '
+                'payment links need absolute return URLs.')
+        base_url = base_url.rstrip('/')
+        config = tenants.get_config(tenant)
+        parameters = {
+            'PSPID': config.psp_id,
+            'currency': config.currency,
+            'language': config.convert_language(
+                language or get_language() or settings.LANGUAGE_CODE),
+            'ACCEPTURL': base_url + reverse('postfinance_success'),
+            'CANCELURL': base_url + reverse('cart_delete'),
+        }
+        parameters.update(config.extra_data)
+        parameters.update(fields)
+        return cls(parameters, config.entry_url, config.secret_key,
+                   getattr(settings, 'POSTFINANCE_HASH_ALGORITHM', 'sha1'))
+
+    def get_parameters(self, order_id, amount):
+        """
+        The signed parameters of the link for ``order_id``; ``amount`` is
+        the total of the order (a Decimal, in the currency's main unit).
+        """
+        data = dict(self.parameters)
+        data['orderID'] = order_id
+        data['amount'] = str(int(amount * 100))
+        data['SHASign'] = get_signer(self.secret_key, self.algorithm).sign(data)
+        return data
+
+    def get_url(self, order_id, amount):
+        data = self.get_parameters(order_id, amount)
+        return self.url_prefix + urlencode((
+            ('orderID', data['orderID']),
+            ('amount', data['amount']),
+            ('SHASign', data['SHASign']),
+        ))
+
+    def __call__(self, items):
+        get_url = self.get_url
+        return [(order_id, amount, get_url(order_id, amount))
+                for order_id, amount in items]
+
+
+def _order_items(orders, shop):
+    for order in orders:
+        yield shop.get_order_unique_id(order), shop.get_order_total(order)
+
+
+def generate_links(orders, shop, builder=None, processes=None, chunk_size=1000):
+    """
+    Yields an (order id, amount, url) tuple for every order of ``orders``
+    (any iterable, e.g. a queryset's iterator()), in the same order. The
+    totals are asked to ``shop``, the signing is done by ``builder``
+    (PaymentLinkBuilder.from_settings() unless given), in ``processes``
+    worker processes if that is more than 1.
+    """
+    if builder is None:
+        builder = PaymentLinkBuilder.from_settings()
+    items = _order_items(orders, shop)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    if not processes or processes < 2:
+        for chunk in chunks:
+            for result in builder(chunk):
+                yield result
+        return
+
+    from collections import deque
+    from multiprocessing import Pool
+    pool = Pool(processes)
+    pending = deque()
+    try:
+        # A few chunks per process in flight: enough to keep every process
+        # busy, without reading all the orders ahead of them.
+        for chunk in chunks:
+            pending.append(pool.apply_async(builder, (chunk,)))
+            if len(pending) >= processes * 2:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
@@ -0,0 +1,273 @@
+#-*- coding: utf-8 -*-
+"""
+Reconciliation of the IPN ledger against PostFinance transaction exports.
+
+When notifications got lost, the transaction list downloaded from the
+PostFinance back office (CSV or XML) can be fed to reconcile(), which streams
+through it row by row and compares it with the ledger in chunks, so files of
+any size are handled in constant memory. Given a shop interface, it also
+records whatever is missing and confirms the payments, like the IPN view;
+without one it only reports:
+
+    from shop_postfinance.reconciliation import iter_csv, reconcile
+
+    with open('export.csv') as export:
+        for kind, row in reconcile(iter_csv(export)):
+            ...
+
+reconcile() is a generator of (kind, row) events, ``kind`` being one of:
+
+* MISSING: the notification is not in the ledger (and has been recorded,
+  when confirming payments).
+* PRESENT: the notification is already in the ledger.
+* MISMATCHED: the ledger has this notification, but with another amount or
+  currency.
+* INVALID: the row lacks orderID, PAYID or STATUS, or its SHASIGN is wrong.
+* UNKNOWN_ORDER: a recovered order could not be found in the shop (only when
+  confirming payments).
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:  # Python >= 3.9
+    from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+
+from shop_postfinance import statemachine, tenants
+from shop_postfinance.models import IPN_FIELDS, get_ledger_model
+from shop_postfinance.utils import security_check
+
+MISSING = 'missing'
+PRESENT = 'present'
+MISMATCHED = 'mismatched'
+INVALID = 'invalid'
+UNKNOWN_ORDER = 'unknown order'
+
+_CANONICAL_NAMES = dict((name.upper(), name) for name in IPN_FIELDS)
+
+
+def iter_csv(fileobj, delimiter=';'):
+    """
+    Yields the rows of a CSV export as dictionaries.
+    """
+    for row in csv.DictReader(fileobj, delimiter=delimiter):
+        yield row
+
+
+def iter_xml(fileobj, row_tag=None):
+    """
+    Yields the rows of an XML export as dictionaries. A row is an element
+    called ``row_tag`` or, if no tag is given, any element with an orderID
+    attribute or child. Both attributes and child elements are read.
+
+    Rows are thrown away as soon as they have been read, so the tree never
+    grows beyond a single row.
+    """
+    root = None
+    for event, elem in iterparse(fileobj, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end':
+            continue
+        row = dict(elem.attrib)
+        for child in elem:
+            row[child.tag] = child.text or ''
+        if row_tag is not None:
+            is_row = elem.tag == row_tag
+        else:
+            is_row = any(key.upper() == 'ORDERID' for key in row)
+        if is_row:
+            yield row
+            root.clear()
+
+
+def normalise_amount(amount):
+    """
+    Formats an amount the way PostFinance notifications do: "54", "54.5".
+    """
+    try:
+        value = Decimal(amount.strip().replace(',', '.'))
+    except (InvalidOperation, AttributeError):
+        return amount
+    if value == value.to_integral_value():
+        return str(value.to_integral_value())
+    return str(value.normalize())
+
+
+def normalise(row):
+    """
+    Turns an export row into IPN parameters: known columns are renamed to
+    the names PostFinance uses in notifications (whatever their case in the
+    export), values are stripped and the amount is normalised. Returns None
+    if the row doesn't identify a notification.
+    """
+    data = {}
+    for key, value in row.items():
+        name = _CANONICAL_NAMES.get((key or '').strip().upper())
+        if name is not None:
+            data[name] = (value or '').strip()
+    if not (data.get('orderID') and data.get('PAYID') and data.get('STATUS')):
+        return None
+    if 'amount' in data:
+        data['amount'] = normalise_amount(data['amount'])
+    return data
+
+
+def row_signature(row):
+    for key, value in row.items():
+        if (key or '').strip().upper() == 'SHASIGN' and value:
+            return value.strip()
+    return None
+
+
+def signed_fields(row):
+    """
+    The parameters of an export row as they were signed, with the signature
+    under the SHASIGN key security_check() expects.
+    """
+    data = {}
+    for key, value in row.items():
+        key = (key or '').strip()
+        if key.upper() == 'SHASIGN':
+            key = 'SHASIGN'
+        data[key] = (value or '').strip()
+    return data
+
+
+def _key(data):
+    return data['orderID'], data['PAYID'], data['STATUS']
+
+
+def _ledger_key(ledger, data):
+    """
+    The key of ``data`` as ``ledger`` stores it: the compact ledger turns
+    PAYID and STATUS into numbers, e.g. "0123" is read back as "123".
+    """
+    return _key(ledger.from_data(data).to_data())
+
+
+def _insert(ledger, instances):
+    """
+    Bulk inserts the chunk. Should a notification have been recorded in the
+    meantime (the IPN view is still running), falls back to row by row
+    inserts and skips the duplicates. Returns the inserted instances.
+    """
+    try:
+        with transaction.atomic():
+            ledger.objects.bulk_create(instances)
+        return instances
+    except IntegrityError:
+        inserted = []
+        for instance in instances:
+            try:
+                with transaction.atomic():
+                    instance.save(force_insert=True)
+            except IntegrityError:
+                continue
+            inserted.append(instance)
+        return inserted
+
+
+def _process_chunk(chunk, shop, backend_name):
+    ledger = get_ledger_model()
+    order_ids = set(data['orderID'] for data in chunk.values())
+    known = {}
+    for ipn in ledger.objects.filter(orderID__in=order_ids):
+        row = ipn.to_data()
+        known[_key(row)] = row
+
+    missing = []
+    for data in chunk.values():
+        row = known.get(_ledger_key(ledger, data))
+        if row is None:
+            missing.append(data)
+        elif (normalise_amount(row['amount']) != data.get('amount', row['amount'])
+                or row['currency'] != data.get('currency', row['currency'])):
+            yield MISMATCHED, data
+        else:
+            yield PRESENT, data
+
+    if shop is None:
+        # Nothing is written: rows recorded without their confirmation would
+        # keep a later run, and PostFinance's own retries, from confirming
+        # them.
+        for data in missing:
+            yield MISSING, data
+        return
+
+    # Like the IPN view, the rows, the order states and the confirmations
+    # are committed together: if the shop fails, the chunk is rolled back
+    # and the next run imports it again.
+    use_outbox = getattr(settings, 'POSTFINANCE_CONFIRMATION_OUTBOX', False)
+    events = []
+    with transaction.atomic():
+        pending = [(ledger.from_data(data), data) for data in missing]
+        inserted = set(id(ipn) for ipn in _insert(ledger, [ipn for ipn, data in pending]))
+        for ipn, data in pending:
+            if id(ipn) not in inserted:
+                # Recorded in the meantime.
+                events.append((PRESENT, data))
+                continue
+            events.append((MISSING, data))
+            transition = statemachine.apply_notification(data)
+            if not statemachine.confirms_payment(transition):
+                continue
+            if use_outbox:
+                from shop_postfinance import outbox
+                outbox.add(dict(data, amount=data.get('amount', '')))
+                continue
+            try:
+                order = shop.get_order_for_id(data['orderID'])
+            except models.ObjectDoesNotExist:
+                events.append((UNKNOWN_ORDER, data))
+                continue
+            shop.confirm_payment(order, data.get('amount', ''), data['PAYID'],
+                                 backend_name)
+    for event in events:
+        yield event
+
+
+def reconcile(rows, chunk_size=1000, require_signature=False, shop=None,
+              backend_name='Postfinance', secret_key=None):
+    """
+    Verifies and normalises ``rows`` (an iterable of dictionaries, see
+    iter_csv() and iter_xml()) and compares them with the IPN ledger
+    ``chunk_size`` rows at a time, yielding a (kind, row) event for every
+    row.
+
+    Rows carrying a SHASIGN are checked against the SHA-OUT key of their
+    tenant (see shop_postfinance.tenants) unless ``secret_key`` is given;
+    rows without one are only accepted if ``require_signature`` is false.
+
+    Only if a shop interface is passed as ``shop`` are the missing rows
+    recorded, their status applied to the order and the payment of every
+    recovered order confirmed with it (through the outbox if
+    POSTFINANCE_CONFIRMATION_OUTBOX is set, see shop_postfinance.outbox).
+    Without a shop, nothing is written.
+    """
+    chunk = {}
+    for row in rows:
+        data = normalise(row)
+        if data is None:
+            yield INVALID, row
+            continue
+        if row_signature(row) is not None:
+            signed = signed_fields(row)
+            key = secret_key or tenants.for_notification(dict(signed, **data)).shaout_key
+            if not security_check(signed, key):
+                yield INVALID, data
+                continue
+        elif require_signature:
+            yield INVALID, data
+            continue
+        chunk[_key(data)] = data
+        if len(chunk) >= chunk_size:
+            for event in _process_chunk(chunk, shop, backend_name):
+                yield event
+            chunk = {}
+    if chunk:
+        for event in _process_chunk(chunk, shop, backend_name):
+            yield event
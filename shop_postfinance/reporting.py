@@ -0,0 +1,165 @@
+#-*- coding: utf-8 -*-
+"""
+Daily payment totals for accounting.
+
+update_rollups() adds the notifications received since its last run to
+PostfinanceDailyTotal (one row per day, currency, payment method, card brand
+and status), so reports never read the IPN ledger itself::
+
+    from shop_postfinance.reporting import totals
+    totals(date(2013, 1, 1), date(2013, 1, 31), STATUS='9')
+
+Progress is kept as a created_at watermark. Every run handles the half-open
+range [watermark, now - lag): the lag leaves time for transactions that were
+still open to commit, so that no notification is counted late or twice.
+The postfinance_update_rollups management command runs it, e.g. from cron.
+"""
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from numbers import Integral
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from shop_postfinance.models import (NO_VALUE, PostfinanceDailyTotal,
+    PostfinanceRollupWatermark, get_ledger_model)
+
+WATERMARK = 'daily'
+
+GROUP_FIELDS = ('currency', 'PM', 'BRAND', 'STATUS')
+
+
+def _cents(amount):
+    """
+    The amount of a ledger row in cents: CompactPostfinanceIPN stores
+    cents already, PostfinanceIPN the string PostFinance sent.
+    """
+    if amount is None or isinstance(amount, Integral):
+        return amount or 0
+    try:
+        return int(Decimal(amount) * 100)
+    except (InvalidOperation, ValueError, OverflowError):  # "NaN", "Infinity"
+        return 0
+
+
+def _date(created_at):
+    if settings.USE_TZ:
+        created_at = timezone.localtime(created_at)
+    return created_at.date()
+
+
+def get_watermark():
+    try:
+        return PostfinanceRollupWatermark.objects.get(name=WATERMARK).created_at
+    except PostfinanceRollupWatermark.DoesNotExist:
+        return None
+
+
+def _add(totals):
+    """
+    Adds the ``totals`` of a batch ({(date, currency, PM, BRAND, STATUS):
+    [count, amount]}) to the rollup table.
+    """
+    dates = set(key[0] for key in totals)
+    existing = dict(
+        ((row.date, row.currency, row.PM, row.BRAND, row.STATUS), row)
+        for row in PostfinanceDailyTotal.objects.filter(date__in=dates))
+    new = []
+    for key, (count, amount) in totals.items():
+        row = existing.get(key)
+        if row is None:
+            new.append(PostfinanceDailyTotal(
+                date=key[0], currency=key[1], PM=key[2], BRAND=key[3],
+                STATUS=key[4], count=count, amount=amount))
+        else:
+            row.count += count
+            row.amount += amount
+            row.save()
+    PostfinanceDailyTotal.objects.bulk_create(new)
+
+
+def update_rollups(until=None, lag=timedelta(minutes=5), batch_size=10000):
+    """
+    Rolls up the notifications created since the watermark and before
+    ``until`` (``lag`` ago by default), ``batch_size`` rows per transaction.
+    Returns the number of notifications added.
+    """
+    ledger = get_ledger_model()
+    if until is None:
+        until = timezone.now() - lag
+    start = get_watermark()
+    if start is None:
+        first = ledger.objects.order_by('created_at').values_list('created_at', flat=True)[:1]
+        if not first:
+            return 0
+        start = first[0]
+        PostfinanceRollupWatermark.objects.get_or_create(
+            name=WATERMARK, defaults={'created_at': start})
+    processed = 0
+    while start < until:
+        rows = list(ledger.objects.filter(created_at__gte=start, created_at__lt=until)
+                    .order_by('created_at')
+                    .values_list('created_at', 'amount', *GROUP_FIELDS)[:batch_size])
+        if len(rows) == batch_size:
+            # Stop before the last timestamp of the batch, its other rows
+            # may not be in it; they start the next batch.
+            end = rows[-1][0]
+            rows = [row for row in rows if row[0] < end]
+            if not rows:
+                raise ValueError('More than %s notifications created at %s, '
+                                 'increase batch_size.' % (batch_size, end))
+        else:
+            end = until
+        totals = {}
+        for created_at, amount, currency, pm, brand, status in rows:
+            key = (_date(created_at), currency, pm, brand,
+                   '' if status is None or status == NO_VALUE else str(status))
+            total = totals.setdefault(key, [0, 0])
+            total[0] += 1
+            total[1] += _cents(amount)
+        with transaction.atomic():
+            # The lock keeps concurrent runs from counting a batch twice.
+            watermark = PostfinanceRollupWatermark.objects.select_for_update().get(name=WATERMARK)
+            if watermark.created_at != start:
+                break
+            _add(totals)
+            watermark.created_at = end
+            watermark.save()
+        processed += len(rows)
+        start = end
+    return processed
+
+
+def reset():
+    """
+    Deletes the rollups, the next update_rollups() starts over from the
+    first notification of the ledger.
+    """
+    with transaction.atomic():
+        PostfinanceDailyTotal.objects.all().delete()
+        PostfinanceRollupWatermark.objects.filter(name=WATERMARK).delete()
+
+
+def totals(start, end, group_by=('currency',), **filters):
+    """
+    The number of notifications (``count``) and their total in cents
+    (``amount``) between the dates ``start`` and ``end`` (both included),
+    grouped by ``group_by`` (any of date, currency, PM, BRAND and STATUS)
+    and filtered by ``filters`` (e.g. STATUS='9', currency='CHF'). Returns a
+    list of dictionaries.
+    """
+    queryset = PostfinanceDailyTotal.objects.filter(date__gte=start, date__lte=end, **filters)
+    return sum_totals(queryset, group_by)
+
+
+def sum_totals(queryset, group_by=('currency',)):
+    """
+    Like totals(), for any queryset of PostfinanceDailyTotal (e.g. the rows
+    selected in the admin).
+    """
+    if not group_by:
+        return [queryset.aggregate(count=Sum('count'), amount=Sum('amount'))]
+    return list(queryset.order_by(*group_by).values(*group_by)
+                .annotate(count=Sum('count'), amount=Sum('amount')))
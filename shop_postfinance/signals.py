@@ -0,0 +1,32 @@
+#-*- coding: utf-8 -*-
+"""
+Signals sent by the Postfinance backend. Unless noted otherwise, the sender
+is the backend's class and the signal is meant for monitoring: connect
+receivers to feed your own metrics, or set POSTFINANCE_METRICS_SINK (see
+shop_postfinance.metrics).
+"""
+from django.dispatch import Signal
+
+# A stage of the checkout or notification handling finished.
+# Arguments: stage (e.g. 'ipn.get_order'), duration (in seconds).
+stage_timed = Signal()
+
+# A notification's signature was checked. Arguments: valid.
+signature_checked = Signal()
+
+# A notification had already been recorded. Arguments: data.
+ipn_duplicate = Signal()
+
+# The notification view answered. Arguments: status_code.
+ipn_response = Signal()
+
+# A request to the notification view was turned away before any work (see
+# shop_postfinance.ipn_filter), sent with IPNFilter as sender. Arguments:
+# reason ('ip_not_allowed', 'rate_limited' or 'replay').
+ipn_rejected = Signal()
+
+# An order's PostFinance status changed (see shop_postfinance.statemachine),
+# sent with PostfinanceOrderState as sender once the change is committed. Arguments: order_id, pay_id,
+# old_status (None for the first notification of the order), new_status,
+# data (the notification's parameters).
+payment_status_changed = Signal()
@@ -0,0 +1,161 @@
+#-*- coding: utf-8 -*-
+"""
+PostFinance sends a notification for every status change of a payment
+(authorised, then payment requested, maybe refused later on...), and does so
+with retries and in no guaranteed order. apply_notification() keeps the
+current status of every order in PostfinanceOrderState, applying only the
+transitions in TRANSITIONS: a late "authorised" after "payment requested" is
+ignored rather than moving the order backwards.
+
+Every applied transition is logged in PostfinanceStatusTransition and
+announced with the payment_status_changed signal (see
+shop_postfinance.signals). The current status of each order is also kept in
+Django's cache, so that repeated deliveries of its latest notification are
+recognised without a database query (see is_current()). Whether a
+notification is applied is only ever decided on the order's locked
+database row: the cache may be stale (e.g. with a per-process cache).
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+
+from shop_postfinance.models import (PAYMENT_STATUS, PostfinanceOrderState,
+    PostfinanceStatusTransition)
+from shop_postfinance.signals import payment_status_changed
+
+# The statuses an order can go to from a given status.
+TRANSITIONS = {
+    '51': ('5', '9', '0', '2', '52', '91', '92', '93'),  # Authorization waiting
+    '52': ('5', '9', '0', '2', '91', '92', '93'),  # Authorisation not known
+    '5': ('9', '91', '92', '93'),  # Authorized
+    '91': ('9', '92', '93'),  # Payment processing
+    '92': ('9', '91', '93'),  # Payment uncertain
+    '9': ('93',),  # Payment requested
+    '0': (),  # Invalid or incomplete
+    '2': (),  # Authorization refused
+    '93': (),  # Payment refused
+}
+
+KNOWN_STATUSES = frozenset(code for code, name in PAYMENT_STATUS)
+
+# After these, the customer may try again: a new PAYID starts over.
+FAILED_STATUSES = ('0', '2', '93')
+
+# The statuses in which the shop considers an order paid.
+CONFIRMED_STATUSES = ('5', '9', '91')
+
+Transition = namedtuple('Transition', 'order_id pay_id old_status new_status')
+
+
+def is_allowed(current, pay_id, status):
+    """
+    Whether an order whose state is ``current`` (a (PAYID, STATUS) pair, or
+    None for a new order) may move to ``status`` for payment ``pay_id``.
+    """
+    if status not in KNOWN_STATUSES:
+        return False
+    if current is None:
+        return True
+    current_pay_id, current_status = current
+    if pay_id != current_pay_id:
+        return current_status in FAILED_STATUSES
+    return status in TRANSITIONS.get(current_status, ())
+
+
+# Runs the function at once outside of transactions, and before Django 1.9.
+_on_commit = getattr(transaction, 'on_commit', lambda func: func())
+
+
+def _cache_key(order_id):
+    return 'shop_postfinance:order_state:%s' % order_id
+
+
+def _remember(order_id, pay_id, status):
+    cache.set(_cache_key(order_id), (pay_id, status),
+              getattr(settings, 'POSTFINANCE_STATE_CACHE_TIMEOUT', 3600))
+
+
+def get_state(order_id):
+    """
+    The (PAYID, STATUS) pair of an order, or None if we never heard of it.
+    """
+    state = cache.get(_cache_key(order_id))
+    if state is None:
+        try:
+            order_state = PostfinanceOrderState.objects.get(orderID=order_id)
+        except PostfinanceOrderState.DoesNotExist:
+            return None
+        state = (order_state.PAYID, order_state.STATUS)
+        _remember(order_id, *state)
+    return tuple(state)
+
+
+def is_current(data):
+    """
+    Whether the cache says the order is already in the state this
+    notification brings it to, i.e. the notification is a duplicate.
+    """
+    cached = cache.get(_cache_key(data['orderID']))
+    return cached is not None and tuple(cached) == (
+        data.get('PAYID', ''), data.get('STATUS', ''))
+
+
+def apply_notification(data):
+    """
+    Moves the order of the notification ``data`` to its status if that is
+    a valid transition. Returns the applied Transition, or None if the
+    notification was a duplicate, stale or invalid.
+
+    Meant to be called once the notification is recorded, so the cache is
+    not trusted here: the order's row is read (and locked) in any case.
+    """
+    order_id = data['orderID']
+    pay_id = data.get('PAYID', '')
+    status = data.get('STATUS', '')
+    if status not in KNOWN_STATUSES:
+        return None
+
+    with transaction.atomic():
+        # Like the ledger, insert first: that's all a new order needs, and it
+        # takes the write lock straight away on databases without row locks.
+        try:
+            with transaction.atomic():
+                PostfinanceOrderState.objects.create(
+                    orderID=order_id, PAYID=pay_id, STATUS=status)
+            state = None
+        except IntegrityError:
+            state = PostfinanceOrderState.objects.select_for_update().get(orderID=order_id)
+        if state is None:
+            old_status = None
+        else:
+            if not is_allowed((state.PAYID, state.STATUS), pay_id, status):
+                # Puts right a stale cache.
+                _remember(order_id, state.PAYID, state.STATUS)
+                return None
+            old_status = state.STATUS
+            state.PAYID = pay_id
+            state.STATUS = status
+            state.save()
+        PostfinanceStatusTransition.objects.create(
+            orderID=order_id, PAYID=pay_id, from_status=old_status or '',
+            to_status=status)
+        # Not before the state is committed: when called in a larger
+        # transaction that rolls back, the notification must not look
+        # handled to its next delivery, nor receivers act on a transition
+        # that never happened.
+        _on_commit(lambda: _remember(order_id, pay_id, status))
+        _on_commit(lambda: payment_status_changed.send(
+            sender=PostfinanceOrderState, order_id=order_id, pay_id=pay_id,
+            old_status=old_status, new_status=status, data=data))
+    return Transition(order_id, pay_id, old_status, status)
+
+
+def confirms_payment(transition):
+    """
+    Whether the order became paid with this transition.
+    """
+    return (transition is not None
+            and transition.new_status in CONFIRMED_STATUSES
+            and transition.old_status not in CONFIRMED_STATUSES)
@@ -0,0 +1,301 @@
+#-*- coding: utf-8 -*-
+"""
+Per-tenant PostFinance configuration, for shops that run several storefronts
+or currencies, each with its own PSPID, from one deployment::
+
+    POSTFINANCE_TENANTS = {
+        'ch': {'PSP_ID': 'shopch', 'SECRET_KEY': '...', 'SHAOUT_KEY': '...',
+               'CURRENCY': 'CHF', 'HOSTS': ['shop.ch'], 'ORDER_ID_PREFIX': 'CH-'},
+        'eu': {'PSP_ID': 'shopeu', 'SECRET_KEY': '...', 'SHAOUT_KEY': '...',
+               'CURRENCY': 'EUR', 'SITES': [2], 'ORDER_ID_PREFIX': 'EU-'},
+    }
+
+Every key is the name of a POSTFINANCE_* setting without its prefix (PSP_ID,
+SECRET_KEY, SHAOUT_KEY, CURRENCY, ENTRY_URL, RFC5646_CONVERSION_TABLE,
+FALLBACK_LANGUAGE, EXTRA_CONFIGS), the global setting being used for those a
+tenant leaves out. HOSTS, SITES and CURRENCIES select the tenant of a
+checkout, PSP_ID and ORDER_ID_PREFIX the tenant of a notification; anything
+else goes to the tenant named "default" (or the first one by name). Without
+POSTFINANCE_TENANTS there is a single tenant, "default", built from the
+global settings.
+
+The configurations are built once per process and are immutable; call
+invalidate() after changing the settings at runtime (the test runner's
+override_settings does so automatically). Invalid settings are reported by
+Django's system checks at startup.
+"""
+try:
+    from types import MappingProxyType
+except ImportError:  # Python 2
+    MappingProxyType = None
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+DEFAULT_TENANT = 'default'
+DEFAULT_ENTRY_URL = 'https://e-payment.postfinance.ch/ncol/test/orderstandard_utf8.asp'
+
+_registry = None
+
+
+class PostfinanceConfig(object):
+    """
+    The settings of one PostFinance account. Immutable: it is shared by
+    every backend and request of the process.
+    """
+
+    def __init__(self, name, psp_id, secret_key, shaout_key, currency,
+                 entry_url=DEFAULT_ENTRY_URL, language_conversion_table=None,
+                 fallback_language=None, extra_data=None, order_id_prefix='',
+                 hosts=(), sites=(), currencies=()):
+        currency = currency.upper()
+        attributes = dict(
+            name=name,
+            psp_id=psp_id,
+            secret_key=secret_key,
+            shaout_key=shaout_key,
+            currency=currency,
+            entry_url=entry_url,
+            language_conversion_table=_frozen(language_conversion_table),
+            fallback_language=fallback_language or 'de_DE',
+            extra_data=_frozen(extra_data),
+            order_id_prefix=order_id_prefix,
+            hosts=tuple(host.lower() for host in hosts),
+            sites=tuple(sites),
+            currencies=tuple(code.upper() for code in currencies) or (currency,),
+        )
+        for key, value in attributes.items():
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PostfinanceConfig is immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('PostfinanceConfig is immutable.')
+
+    @classmethod
+    def from_settings(cls, name, overrides=None):
+        """
+        Builds the configuration of tenant ``name`` from ``overrides`` (its
+        entry in POSTFINANCE_TENANTS), falling back to the global settings.
+        Raises ImproperlyConfigured if they are invalid (see also
+        get_errors(), which the system checks report at startup).
+        """
+        errors = get_tenant_errors(name, overrides)
+        if errors:
+            raise ImproperlyConfigured(' '.join(message for id, message in errors))
+        get = _getter(overrides)
+        overrides = overrides or {}
+        return cls(
+            name,
+            psp_id=get('PSP_ID'),
+            secret_key=get('SECRET_KEY'),
+            shaout_key=get('SHAOUT_KEY'),
+            currency=get('CURRENCY'),
+            entry_url=get('ENTRY_URL', DEFAULT_ENTRY_URL),
+            language_conversion_table=get('RFC5646_CONVERSION_TABLE', {}),
+            fallback_language=get('FALLBACK_LANGUAGE'),
+            extra_data=get('EXTRA_CONFIGS', {}),
+            order_id_prefix=overrides.get('ORDER_ID_PREFIX', ''),
+            hosts=overrides.get('HOSTS', ()),
+            sites=overrides.get('SITES', ()),
+            currencies=overrides.get('CURRENCIES', ()),
+        )
+
+    def convert_language(self, rfc5646_language_code):
+        """
+        Turn a RFC5646 (http://tools.ietf.org/html/rfc5646) language code into
+        ISO-639-1+ISO-3166 language codes using the conversion table, or
+        returns the fallback language.
+        """
+        found = self.language_conversion_table.get(rfc5646_language_code)
+        if found:
+            return found
+        return self.fallback_language
+
+    def __repr__(self):
+        return '<PostfinanceConfig %s (%s)>' % (self.name, self.psp_id)
+
+
+def _frozen(mapping):
+    mapping = dict(mapping or {})
+    if MappingProxyType is None:  # Python 2
+        return mapping
+    return MappingProxyType(mapping)
+
+
+def _getter(overrides):
+    overrides = overrides or {}
+
+    def get(key, default=None):
+        if key in overrides:
+            return overrides[key]
+        return getattr(settings, 'POSTFINANCE_%s' % key, default)
+    return get
+
+
+def is_valid_language(language):
+    """
+    Whether ``language`` is in the "xx_YY" format PostFinance expects.
+    """
+    return (len(language) == 5 and language[2] == '_'
+            and language[:2].isalpha() and language[:2].islower()
+            and language[3:].isalpha() and language[3:].isupper())
+
+
+def get_tenant_errors(name, overrides=None):
+    """
+    The (id, message) pairs of the problems of tenant ``name``'s settings.
+    """
+    get = _getter(overrides)
+    prefix = '' if name == DEFAULT_TENANT else 'Tenant %r: ' % name
+    errors = []
+    if not get('SECRET_KEY'):
+        errors.append(('shop_postfinance.E001', prefix + 'You need to define a POSTFINANCE_SECRET_KEY="..." setting in your settings file.'))
+    if not get('SHAOUT_KEY'):
+        errors.append(('shop_postfinance.E006', prefix + 'You need to define a POSTFINANCE_SHAOUT_KEY="..." setting in your settings file, notifications can\'t be verified without it.'))
+    if not get('PSP_ID'):
+        errors.append(('shop_postfinance.E002', prefix + 'Please define a POSTFINANCE_PSP_ID="..." setting in your settings file.'))
+    if not get('CURRENCY'):
+        errors.append(('shop_postfinance.E003', prefix + 'Please define a POSTFINANCE_CURRENCY="..." setting in your settings file.'))
+    fallback_language = get('FALLBACK_LANGUAGE')
+    if fallback_language and not is_valid_language(fallback_language):
+        errors.append(('shop_postfinance.E004', prefix + 'POSTFINANCE_FALLBACK_LANGUAGE setting must be in '
+            'format "xx_YY" where "xx" is a ISO-639-1 code and "YY" a '
+            'ISO-3166 code.'))
+    return errors
+
+
+def get_errors():
+    """
+    The (id, message) pairs of the problems of every tenant's settings.
+    """
+    tenants = getattr(settings, 'POSTFINANCE_TENANTS', None)
+    if not tenants:
+        return get_tenant_errors(DEFAULT_TENANT)
+    errors = []
+    for name in sorted(tenants):
+        errors.extend(get_tenant_errors(name, tenants[name]))
+    return errors
+
+
+class TenantRegistry(object):
+    """
+    Resolves the configuration for a checkout or a notification.
+    """
+
+    def __init__(self, configs):
+        self.configs = configs
+        self.default = configs.get(DEFAULT_TENANT) or configs[sorted(configs)[0]]
+        self.by_psp_id = {}
+        self.by_host = {}
+        self.by_site = {}
+        self.by_currency = {}
+        for name in sorted(configs):
+            config = configs[name]
+            self.by_psp_id.setdefault(config.psp_id, config)
+            for host in config.hosts:
+                self.by_host.setdefault(host, config)
+            for site in config.sites:
+                self.by_site.setdefault(site, config)
+            for currency in config.currencies:
+                self.by_currency.setdefault(currency, config)
+        # Longest first, so "EU-B2B-" wins over "EU-".
+        self.prefixes = sorted(
+            ((config.order_id_prefix, config) for config in configs.values()
+             if config.order_id_prefix),
+            key=lambda item: -len(item[0]))
+
+    @classmethod
+    def from_settings(cls):
+        tenants = getattr(settings, 'POSTFINANCE_TENANTS', None)
+        if not tenants:
+            return cls({DEFAULT_TENANT: PostfinanceConfig.from_settings(DEFAULT_TENANT)})
+        return cls(dict((name, PostfinanceConfig.from_settings(name, overrides))
+                        for name, overrides in tenants.items()))
+
+    def get(self, name):
+        return self.configs[name]
+
+    def for_checkout(self, request=None, currency=None, site_id=None):
+        """
+        The tenant of a checkout: by currency if one is given, then by the
+        host of ``request``, then by site (``site_id`` or the SITE_ID
+        setting). Falls back to the default tenant.
+        """
+        if currency:
+            config = self.by_currency.get(currency.upper())
+            if config is not None:
+                return config
+        if request is not None and self.by_host:
+            config = self.by_host.get(request.get_host().split(':')[0].lower())
+            if config is not None:
+                return config
+        if self.by_site:
+            if site_id is None:
+                site_id = getattr(settings, 'SITE_ID', None)
+            config = self.by_site.get(site_id)
+            if config is not None:
+                return config
+        return self.default
+
+    def for_notification(self, data):
+        """
+        The tenant a notification (or a DirectLink answer) belongs to: by its
+        PSPID if PostFinance sends one, else by the prefix of its orderID.
+        """
+        psp_id = data.get('PSPID')
+        if psp_id:
+            config = self.by_psp_id.get(psp_id)
+            if config is not None:
+                return config
+        order_id = data.get('orderID') or ''
+        for prefix, config in self.prefixes:
+            if order_id.startswith(prefix):
+                return config
+        return self.default
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = TenantRegistry.from_settings()
+    return _registry
+
+
+def invalidate():
+    """
+    Forgets the cached configurations, they are rebuilt from the settings
+    on next use.
+    """
+    global _registry
+    _registry = None
+
+
+def get_config(name=None):
+    """
+    The configuration of tenant ``name``, or of the default tenant.
+    """
+    registry = get_registry()
+    if name is None:
+        return registry.default
+    return registry.get(name)
+
+
+def for_checkout(request=None, currency=None, site_id=None):
+    return get_registry().for_checkout(request, currency, site_id)
+
+
+def for_notification(data):
+    return get_registry().for_notification(data)
+
+
+def _settings_changed(sender, setting, **kwargs):
+    if setting.startswith('POSTFINANCE_') or setting == 'SITE_ID':
+        invalidate()
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # Django < 1.8
+    from django.test.signals import setting_changed
+setting_changed.connect(_settings_changed)
@@ -0,0 +1,64 @@
+#-*- coding: utf-8 -*-
+"""
+An in-memory shop interface for the tests.
+"""
+import threading
+from decimal import Decimal
+
+from django.core.exceptions import ObjectDoesNotExist
+
+from shop_postfinance.utils import get_signer
+
+
+def notification(order_id='1', pay_id='100', status='9', amount='54.00', **fields):
+    """
+    The parameters of a notification PostFinance would send, signed with the
+    test settings' SHA-OUT key.
+    """
+    data = dict(orderID=order_id, PAYID=pay_id, STATUS=status, amount=amount,
+                currency='CHF', PM='CreditCard', **fields)
+    data['SHASIGN'] = get_signer('sha-out-secret-key').sign(data)
+    return data
+
+
+class TestOrder(object):
+
+    def __init__(self, order_id, total=Decimal('54.00')):
+        self.id = order_id
+        self.total = total
+
+
+class TestShop(object):
+    """
+    Knows every order except those whose id starts with "unknown", records
+    the confirmations it gets in ``confirmations`` and raises ``fail`` (an
+    exception) from confirm_payment() if it is set.
+    """
+
+    def __init__(self):
+        self.confirmations = []
+        self.fail = None
+        self.lock = threading.Lock()
+
+    def get_order(self, request):
+        return TestOrder('checkout')
+
+    def get_order_for_id(self, order_id):
+        if order_id.startswith('unknown'):
+            raise ObjectDoesNotExist(order_id)
+        return TestOrder(order_id)
+
+    def get_order_unique_id(self, order):
+        return order.id
+
+    def get_order_total(self, order):
+        return order.total
+
+    def confirm_payment(self, order, amount, transaction_id, backend_name):
+        if self.fail is not None:
+            raise self.fail
+        with self.lock:
+            self.confirmations.append((order.id, amount, transaction_id))
+
+    def get_finished_url(self):
+        return '/finished/'
@@ -0,0 +1,48 @@
+#-*- coding: utf-8 -*-
+import re
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from shop_postfinance.models import PostfinanceDailyTotal
+
+URL = '/admin/shop_postfinance/postfinancedailytotal/'
+
+
+class DailyTotalAdminTestCase(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        for day, currency, status, count, amount in [
+                (date(2013, 1, 5), 'CHF', '9', 2, 1000),
+                (date(2013, 1, 20), 'CHF', '93', 5, 7000),
+                (date(2013, 2, 1), 'CHF', '9', 4, 4000),
+                (date(2013, 1, 6), 'EUR', '9', 1, 99)]:
+            PostfinanceDailyTotal.objects.create(
+                date=day, currency=currency, PM='CreditCard', BRAND='VISA',
+                STATUS=status, count=count, amount=amount)
+
+    def totals(self, query=''):
+        response = self.client.get(URL + query)
+        self.assertEqual(response.status_code, 200)
+        return [(row['currency'], row['count'], str(row['amount']))
+                for row in response.context['totals']]
+
+    def test_all_rows(self):
+        self.assertEqual(self.totals(), [('CHF', 11, '120'), ('EUR', 1, '0.99')])
+
+    def test_date_hierarchy(self):
+        self.assertEqual(self.totals('?date__year=2013&date__month=1'),
+                         [('CHF', 7, '80'), ('EUR', 1, '0.99')])
+
+    def test_filters(self):
+        query = '?date__year=2013&date__month=1&STATUS__exact=9&currency=CHF'
+        self.assertEqual(self.totals(query), [('CHF', 2, '10')])
+
+    def test_shown(self):
+        response = self.client.get(URL + '?STATUS__exact=93')
+        table = re.search(r'<table id="postfinance-totals">.*?</table>',
+                          response.content.decode('utf8'), re.S).group(0)
+        self.assertIn('<td>CHF</td><td>5</td><td>70</td>', table)
@@ -0,0 +1,64 @@
+#-*- coding: utf-8 -*-
+import asyncio
+from unittest import skipIf
+
+import django
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from shop_postfinance import ipn_filter
+from shop_postfinance.signals import signature_checked
+from shop_postfinance.tests.shop import notification
+from shop_postfinance.tests.urls import backend
+
+
+def on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+@skipIf(django.VERSION < (3, 1), 'async views need Django 3.1')
+@override_settings(POSTFINANCE_IPN_RATE_LIMIT_STORE='cache')
+class EventLoopTestCase(TransactionTestCase):
+    """
+    Nothing synchronous (signal receivers, cache lookups) runs on the loop.
+    """
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+        self.loop_calls = []
+        signature_checked.connect(self.receiver)
+
+    def tearDown(self):
+        signature_checked.disconnect(self.receiver)
+
+    def receiver(self, **kwargs):
+        self.loop_calls.append(on_event_loop())
+
+    def test_ipn(self):
+        check = ipn_filter.get_filter()
+        check_request, remember = check.check_request, check.remember
+
+        def spy(func):
+            def wrapper(*args):
+                self.loop_calls.append(on_event_loop())
+                return func(*args)
+            return wrapper
+        check.check_request, check.remember = spy(check_request), spy(remember)
+        try:
+            response = self.client.post('/async/instantpaymentnotification/',
+                                        notification())
+        finally:
+            check.check_request, check.remember = check_request, remember
+        self.assertEqual(response.content, b'OKAY')
+        self.assertEqual(len(backend.shop.confirmations), 1)
+        self.assertEqual(self.loop_calls, [False, False, False])
+
+    def test_success_redirect(self):
+        response = self.client.get('/async/success/', notification())
+        self.assertEqual(response['Location'], '/finished/')
+        self.assertEqual(self.loop_calls, [False])
@@ -0,0 +1,30 @@
+#-*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from shop_postfinance import dedup
+
+
+class DedupTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recorded_on_commit(self):
+        data = {'orderID': '1', 'PAYID': '100', 'STATUS': '9'}
+        with transaction.atomic():
+            dedup.mark_recorded(data)
+            self.assertFalse(dedup.is_recorded(data))
+        self.assertTrue(dedup.is_recorded(data))
+        self.assertFalse(dedup.is_recorded(dict(data, STATUS='5')))
+
+    def test_not_recorded_on_rollback(self):
+        data = {'orderID': '1', 'PAYID': '100', 'STATUS': '9'}
+        try:
+            with transaction.atomic():
+                dedup.mark_recorded(data)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(dedup.is_recorded(data))
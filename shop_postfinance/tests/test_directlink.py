@@ -0,0 +1,203 @@
+#-*- coding: utf-8 -*-
+import logging
+import socket
+import threading
+import time
+from unittest import skipIf
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+    from unittest import mock
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+    import mock
+
+try:
+    DISCONNECTED = (BrokenPipeError, ConnectionResetError)
+except NameError:  # Python 2
+    DISCONNECTED = (socket.error,)
+
+from django.test import SimpleTestCase
+
+from shop_postfinance.directlink import (DirectLinkClient, DirectLinkError,
+    requests)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Plays PostFinance's DirectLink pages. ``answers`` is the list of what to
+    do with the next requests: an HTTP status, 'drop' (close the connection
+    without answering) or ('sleep', seconds); once it is empty, requests are
+    answered normally.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.answers = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def next_answer(self):
+        with self.lock:
+            return self.answers.pop(0) if self.answers else 200
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(parse_qsl(self.rfile.read(length).decode('utf8')))
+        with self.server.lock:
+            self.server.requests.append((self.path, params))
+        answer = self.server.next_answer()
+        if answer == 'drop':
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if isinstance(answer, tuple):
+            time.sleep(answer[1])
+            answer = 200
+        body = ('<?xml version="1.0"?><ncresponse orderID="%s" PAYID="%s" '
+                'NCERROR="0" STATUS="5"/>' % (params.get('ORDERID', ''),
+                                              params.get('PAYID', '42')))
+        try:
+            self.send_response(answer)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode('ascii'))
+        except DISCONNECTED:
+            # The client timed out while we slept, as the test wanted.
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@skipIf(requests is None, 'the requests library is not installed')
+class DirectLinkClientTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = self.make_client('http://127.0.0.1:%s/ncol' % self.server.server_port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_client(self, base_url, **kwargs):
+        options = dict(psp_id='testPSPID', user_id='api', password='secret',
+                       secret_key='sha-in', base_url=base_url, retries=3,
+                       backoff=0.01, timeout=2)
+        options.update(kwargs)
+        return DirectLinkClient(**options)
+
+    def test_query_status(self):
+        response = self.client.query_status(order_id='1234')
+        self.assertTrue(response.ok)
+        self.assertEqual(response.orderID, '1234')
+        path, params = self.server.requests[0]
+        self.assertEqual(path, '/ncol/querydirect.asp')
+        self.assertEqual(params['PSPID'], 'testPSPID')
+        self.assertEqual(params['USERID'], 'api')
+        self.assertTrue(self.client.signer.verify(params))
+
+    def test_query_is_retried_with_backoff(self):
+        self.server.answers = [500, 503]
+        with mock.patch('shop_postfinance.directlink.time') as clock:
+            response = self.client.query_status(order_id='1234')
+        self.assertTrue(response.ok)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual([call[0][0] for call in clock.sleep.call_args_list], [0.01, 0.02])
+
+    def test_query_gives_up(self):
+        self.server.answers = [500] * 4
+        with mock.patch('shop_postfinance.directlink.time'):
+            self.assertRaises(DirectLinkError, self.client.query_status, order_id='1234')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_query_is_retried_after_dropped_connection(self):
+        self.server.answers = ['drop']
+        with mock.patch('shop_postfinance.directlink.time'):
+            self.assertTrue(self.client.query_status(order_id='1234').ok)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_maintenance_is_not_repeated_once_sent(self):
+        self.server.answers = ['drop']
+        with mock.patch('shop_postfinance.directlink.time') as clock:
+            self.assertRaises(DirectLinkError, self.client.refund, '42', '10.00')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(clock.sleep.called)
+        path, params = self.server.requests[0]
+        self.assertEqual(path, '/ncol/maintenancedirect.asp')
+        self.assertEqual((params['OPERATION'], params['AMOUNT']), ('RFD', '1000'))
+
+    def test_maintenance_is_not_repeated_on_server_error(self):
+        self.server.answers = [500]
+        self.assertRaises(DirectLinkError, self.client.capture, '42')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_maintenance_is_retried_when_not_connected(self):
+        # Nothing listens on the port of a closed server.
+        closed = StandInServer()
+        port = closed.server_port
+        closed.server_close()
+        client = self.make_client('http://127.0.0.1:%s/ncol' % port)
+        try:
+            with mock.patch('shop_postfinance.directlink.time') as clock:
+                self.assertRaises(DirectLinkError, client.capture, '42')
+        finally:
+            client.close()
+        self.assertEqual(clock.sleep.call_count, 3)
+
+    def test_timeout(self):
+        client = self.make_client(self.client.base_url, timeout=0.2, retries=1)
+        self.server.answers = [('sleep', 0.5), ('sleep', 0.5)]
+        try:
+            with mock.patch('shop_postfinance.directlink.time'):
+                self.assertRaises(DirectLinkError, client.query_status, order_id='1234')
+            self.assertEqual(len(self.server.requests), 2)
+            self.server.answers = [('sleep', 0.5)]
+            self.assertRaises(DirectLinkError, client.capture, '42')
+            self.assertEqual(len(self.server.requests), 3)
+        finally:
+            client.close()
+
+    def test_query_many(self):
+        order_ids = ['order-%s' % i for i in range(50)]
+        self.server.answers = [500]
+        warnings = []
+        handler = logging.Handler()
+        handler.emit = warnings.append
+        logger = logging.getLogger('urllib3.connectionpool')
+        logger.addHandler(handler)
+        try:
+            with mock.patch('shop_postfinance.directlink.time'):
+                results = dict(self.client.query_many(order_ids))
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(sorted(results), sorted(order_ids))
+        for order_id, response in results.items():
+            self.assertEqual(response.orderID, order_id)
+        # One thread per pooled connection: none is opened and thrown away.
+        self.assertEqual([record for record in warnings
+                          if 'pool is full' in record.getMessage()], [])
+
+    def test_query_many_reports_failures(self):
+        client = self.make_client(self.client.base_url, retries=0)
+        self.server.answers = [500]
+        try:
+            results = list(client.query_many(['a']))
+        finally:
+            client.close()
+        self.assertEqual(results[0][0], 'a')
+        self.assertTrue(isinstance(results[0][1], DirectLinkError))
@@ -0,0 +1,58 @@
+#-*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from shop_postfinance import ipn_filter
+from shop_postfinance.models import PostfinanceIPN
+from shop_postfinance.tests.shop import notification
+from shop_postfinance.tests.urls import backend
+
+IPN_URL = '/pay/instantpaymentnotification/'
+
+
+class IPNFilterTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+        ipn_filter.get_filter().seen.clear()
+
+    def post(self, data, ip='192.0.2.1'):
+        return self.client.post(IPN_URL, data, REMOTE_ADDR=ip)
+
+    def test_replay(self):
+        self.post(notification())
+        before = ipn_filter.get_counters().get(ipn_filter.REPLAY, 0)
+        response = self.post(notification())
+        # Answered like the original, without looking at it again.
+        self.assertEqual((response.status_code, response.content), (200, b'OKAY'))
+        self.assertEqual(ipn_filter.get_counters()[ipn_filter.REPLAY], before + 1)
+        self.assertEqual(len(backend.shop.confirmations), 1)
+
+    def test_rejected_notifications_are_not_remembered(self):
+        data = notification()
+        data['amount'] = '0.01'
+        self.assertEqual(self.post(data).status_code, 400)
+        self.assertEqual(self.post(data).status_code, 400)
+
+    @override_settings(POSTFINANCE_IPN_RATE_LIMIT=(0.001, 2))
+    def test_rate_limit(self):
+        self.assertEqual(self.post(notification(status='5')).status_code, 200)
+        self.assertEqual(self.post(notification(status='9')).status_code, 200)
+        self.assertEqual(self.post(notification(order_id='2')).status_code, 429)
+        # Per client address.
+        self.assertEqual(self.post(notification(order_id='2'), ip='192.0.2.2').status_code, 200)
+        self.assertEqual(len(backend.shop.confirmations), 2)
+
+    @override_settings(POSTFINANCE_IPN_RATE_LIMIT=(0.001, 1),
+                       POSTFINANCE_IPN_RATE_LIMIT_STORE='cache')
+    def test_rate_limit_in_cache(self):
+        self.assertEqual(self.post(notification()).status_code, 200)
+        self.assertEqual(self.post(notification(order_id='2')).status_code, 429)
+
+    @override_settings(POSTFINANCE_IPN_ALLOWED_IPS=['192.0.2.0/24'])
+    def test_allowed_ips(self):
+        self.assertEqual(self.post(notification(), ip='198.51.100.1').status_code, 403)
+        self.assertFalse(PostfinanceIPN.objects.exists())
+        self.assertEqual(self.post(notification(), ip='192.0.2.7').status_code, 200)
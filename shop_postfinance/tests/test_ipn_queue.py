@@ -0,0 +1,108 @@
+#-*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from django.test import TransactionTestCase
+from django.utils.timezone import now
+
+from shop_postfinance.ipn_queue import IPNQueueWorker, enqueue
+from shop_postfinance.models import QueuedIPN
+
+
+class RecordingBackend(object):
+
+    def __init__(self):
+        self.recorded = []
+
+    def record_payment_data(self, data):
+        self.recorded.append(data['orderID'])
+
+
+class StopLoop(Exception):
+    pass
+
+
+class WorkerTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+
+    def test_reclaims_stale_entries_in_loop(self):
+        entry = enqueue({'orderID': '1'})
+        worker = IPNQueueWorker(self.backend, reclaim_after=600)
+
+        def sleep(seconds):
+            if sleep.calls:
+                raise StopLoop
+            sleep.calls += 1
+            # A worker of another process died on an entry after the first poll.
+            QueuedIPN.objects.filter(pk=entry.pk).update(
+                state=QueuedIPN.PROCESSING, claimed_by='dead',
+                updated_at=now() - timedelta(seconds=601))
+        sleep.calls = 0
+
+        with mock.patch('shop_postfinance.ipn_queue.time') as clock:
+            clock.sleep.side_effect = sleep
+            self.assertRaises(StopLoop, worker.run, loop=True)
+        self.assertEqual(self.backend.recorded, ['1', '1'])
+        self.assertEqual(worker.stats['reclaimed'], 1)
+        self.assertEqual(QueuedIPN.objects.get().state, QueuedIPN.DONE)
+
+    def test_recent_claims_are_left_alone(self):
+        entry = enqueue({'orderID': '1'})
+        QueuedIPN.objects.filter(pk=entry.pk).update(
+            state=QueuedIPN.PROCESSING, claimed_by='alive', updated_at=now())
+        worker = IPNQueueWorker(self.backend, reclaim_after=600)
+        self.assertEqual(worker.run()['reclaimed'], 0)
+        self.assertEqual(self.backend.recorded, [])
+
+
+class FailingBackend(object):
+
+    def record_payment_data(self, data):
+        raise ValueError('shop down')
+
+
+class RetryTestCase(TransactionTestCase):
+
+    def setUp(self):
+        # The retries and dead letters are logged on purpose.
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def make_due(self):
+        QueuedIPN.objects.update(available_at=now())
+
+    def test_retry_then_dead_letter(self):
+        enqueue({'orderID': '1'})
+        worker = IPNQueueWorker(FailingBackend(), max_attempts=2, retry_delay=60)
+        worker.run()
+        entry = QueuedIPN.objects.get()
+        self.assertEqual((entry.state, entry.attempts), (QueuedIPN.PENDING, 1))
+        self.assertTrue(entry.available_at > now() + timedelta(seconds=50))
+        self.assertIn('shop down', entry.last_error)
+        # Not due yet.
+        worker.run()
+        self.assertEqual(QueuedIPN.objects.get().attempts, 1)
+        self.make_due()
+        worker.run()
+        entry = QueuedIPN.objects.get()
+        self.assertEqual((entry.state, entry.attempts), (QueuedIPN.DEAD, 2))
+        self.assertEqual(worker.stats, {'done': 0, 'retried': 1, 'dead': 1, 'reclaimed': 0})
+
+    def test_retry_then_success(self):
+        enqueue({'orderID': '1'})
+        IPNQueueWorker(FailingBackend(), retry_delay=60).run()
+        self.make_due()
+        backend = RecordingBackend()
+        IPNQueueWorker(backend).run()
+        entry = QueuedIPN.objects.get()
+        self.assertEqual((entry.state, entry.attempts), (QueuedIPN.DONE, 2))
+        self.assertEqual(backend.recorded, ['1'])
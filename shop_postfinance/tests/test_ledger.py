@@ -0,0 +1,38 @@
+#-*- coding: utf-8 -*-
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from shop_postfinance.models import NO_VALUE, CompactPostfinanceIPN
+
+
+class CompactLedgerTestCase(TestCase):
+
+    def record(self, **data):
+        return CompactPostfinanceIPN.objects.create(
+            **CompactPostfinanceIPN.compact_fields(data))
+
+    def test_round_trip(self):
+        data = {'orderID': '1234', 'PAYID': '3012345', 'STATUS': '9',
+                'amount': '12.5', 'currency': 'CHF', 'TRXDATE': '11/08/10',
+                'CN': 'Joe'}
+        entry = CompactPostfinanceIPN.objects.get(pk=self.record(**data).pk)
+        self.assertEqual((entry.PAYID, entry.STATUS, entry.amount), (3012345, 9, 1250))
+        result = entry.to_data()
+        for name, value in data.items():
+            self.assertEqual(result[name], value)
+
+    def test_missing_numbers_are_unique(self):
+        self.record(orderID='1234', STATUS='9')
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, self.record, orderID='1234', STATUS='9')
+        self.assertEqual(CompactPostfinanceIPN.objects.get().PAYID, NO_VALUE)
+
+    def test_unparsable_numbers_are_kept(self):
+        entry = self.record(orderID='1234', PAYID='n/a', STATUS='9')
+        self.assertEqual(entry.PAYID, NO_VALUE)
+        self.assertEqual(CompactPostfinanceIPN.objects.get().to_data()['PAYID'], 'n/a')
+
+    def test_unparsable_amounts(self):
+        for amount in ('', 'abc', 'NaN', 'Infinity'):
+            fields = CompactPostfinanceIPN.compact_fields({'orderID': '1', 'amount': amount})
+            self.assertEqual(fields['amount'], None)
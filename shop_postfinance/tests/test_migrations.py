@@ -0,0 +1,68 @@
+#-*- coding: utf-8 -*-
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Runs the migrations from ``migrate_from`` to ``migrate_to``, with the
+    rows made by setUpBefore() in between.
+    """
+    migrate_from = None
+    migrate_to = None
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('shop_postfinance', target)])
+        return executor.loader.project_state([('shop_postfinance', target)]).apps
+
+    def setUp(self):
+        self.apps = self.migrate(self.migrate_from)
+        self.setUpBefore()
+        self.apps = self.migrate(self.migrate_to)
+
+    def tearDown(self):
+        self.migrate('0009_confirmation_outbox')
+
+    def setUpBefore(self):
+        pass
+
+    def record(self, *notifications):
+        PostfinanceIPN = self.apps.get_model('shop_postfinance', 'PostfinanceIPN')
+        for order_id, pay_id, status in notifications:
+            PostfinanceIPN.objects.create(orderID=order_id, PAYID=pay_id, STATUS=status)
+
+
+class DuplicatesTestCase(MigrationTestCase):
+    migrate_from = '0001_initial'
+    migrate_to = '0002_ipn_indexes'
+
+    def setUpBefore(self):
+        self.record(('1', '10', '9'), ('1', '10', '9'), ('1', '10', '5'), ('2', '20', '9'))
+
+    def test_first_copy_is_kept(self):
+        PostfinanceIPN = self.apps.get_model('shop_postfinance', 'PostfinanceIPN')
+        self.assertEqual(
+            list(PostfinanceIPN.objects.order_by('pk').values_list('orderID', 'PAYID', 'STATUS')),
+            [('1', '10', '9'), ('1', '10', '5'), ('2', '20', '9')])
+
+
+class OrderStatesTestCase(MigrationTestCase):
+    migrate_from = '0006_order_states'
+    migrate_to = '0007_initial_order_states'
+
+    def setUpBefore(self):
+        self.record(
+            ('paid', '1', '5'), ('paid', '1', '9'),
+            ('late', '2', '9'), ('late', '2', '5'),  # "authorised" came late
+            ('retried', '3', '2'), ('retried', '4', '5'),
+            ('unknown', '5', ''),
+        )
+
+    def test_states(self):
+        PostfinanceOrderState = self.apps.get_model('shop_postfinance', 'PostfinanceOrderState')
+        self.assertEqual(
+            sorted(PostfinanceOrderState.objects.values_list('orderID', 'PAYID', 'STATUS')),
+            [('late', '2', '9'), ('paid', '1', '9'), ('retried', '4', '5')])
@@ -0,0 +1,66 @@
+#-*- coding: utf-8 -*-
+import logging
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from shop_postfinance.models import PostfinanceConfirmation
+from shop_postfinance.offsite_postfinance import OffsitePostfinanceBackend
+from shop_postfinance.outbox import ConfirmationDispatcher
+from shop_postfinance.tests.shop import TestShop, notification
+
+
+@override_settings(POSTFINANCE_CONFIRMATION_OUTBOX=True)
+class OutboxTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.backend = OffsitePostfinanceBackend(shop=TestShop())
+        self.dispatcher = ConfirmationDispatcher(self.backend, retry_delay=60)
+        # The retries and dead letters are logged on purpose.
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def entry(self):
+        return PostfinanceConfirmation.objects.get()
+
+    def test_confirmed_by_the_dispatcher(self):
+        self.backend.record_payment_data(notification(status='5'))
+        self.backend.record_payment_data(notification(status='9'))
+        # Stored with the notification, not delivered yet.
+        self.assertEqual(self.entry().state, PostfinanceConfirmation.PENDING)
+        self.assertEqual(self.backend.shop.confirmations, [])
+        self.assertEqual(self.dispatcher.run()['done'], 1)
+        self.assertEqual(self.backend.shop.confirmations, [('1', '54.00', '100')])
+        self.assertEqual(self.entry().state, PostfinanceConfirmation.DONE)
+        # Nothing left to deliver.
+        self.assertEqual(self.dispatcher.run()['done'], 1)
+
+    def test_retry(self):
+        self.backend.record_payment_data(notification())
+        self.backend.shop.fail = ValueError('shop down')
+        self.dispatcher.run()
+        entry = self.entry()
+        self.assertEqual((entry.state, entry.attempts), (PostfinanceConfirmation.PENDING, 1))
+        self.assertIn('shop down', entry.last_error)
+        self.assertTrue(entry.available_at > now())
+        # Not due yet.
+        self.backend.shop.fail = None
+        self.dispatcher.run()
+        self.assertEqual(self.backend.shop.confirmations, [])
+        PostfinanceConfirmation.objects.update(available_at=now())
+        self.dispatcher.run()
+        entry = self.entry()
+        self.assertEqual((entry.state, entry.attempts), (PostfinanceConfirmation.DONE, 2))
+        self.assertEqual(len(self.backend.shop.confirmations), 1)
+        self.assertEqual(self.dispatcher.stats, {'done': 1, 'retried': 1, 'dead': 0})
+
+    def test_dead_letter(self):
+        self.backend.record_payment_data(notification())
+        self.backend.shop.fail = ValueError('shop down')
+        self.dispatcher.max_attempts = 1
+        self.dispatcher.run()
+        self.assertEqual(self.entry().state, PostfinanceConfirmation.DEAD)
@@ -0,0 +1,52 @@
+#-*- coding: utf-8 -*-
+from decimal import Decimal
+
+try:
+    from urllib.parse import parse_qsl, urlsplit
+except ImportError:  # Python 2
+    from urlparse import parse_qsl, urlsplit
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from shop_postfinance.paymentlinks import PaymentLinkBuilder, generate_links
+from shop_postfinance.tests.shop import TestOrder, TestShop
+from shop_postfinance.utils import get_signer
+
+
+@override_settings(POSTFINANCE_BASE_URL='https://shop.example.com/')
+class PaymentLinksTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.builder = PaymentLinkBuilder.from_settings(language='en')
+        self.orders = [TestOrder('1'), TestOrder('2', total=Decimal('10.05'))]
+
+    def parameters(self, url):
+        return dict(parse_qsl(urlsplit(url).query))
+
+    def test_signed_links(self):
+        links = list(generate_links(self.orders, TestShop(), builder=self.builder))
+        self.assertEqual([(order_id, amount) for order_id, amount, url in links],
+                         [('1', Decimal('54.00')), ('2', Decimal('10.05'))])
+        data = self.parameters(links[1][2])
+        self.assertEqual((data['orderID'], data['amount'], data['PSPID']),
+                         ('2', '1005', 'testPSPID'))
+        self.assertEqual(data['ACCEPTURL'], 'https://shop.example.com/pay/success/')
+        signature = data.pop('SHASign')
+        self.assertEqual(signature, get_signer('sha-in-secret-key').sign(data))
+
+    def test_same_links_as_the_checkout(self):
+        url = self.builder.get_url('1', Decimal('54.00'))
+        self.assertEqual(self.parameters(url),
+                         self.builder.get_parameters('1', Decimal('54.00')))
+
+    def test_processes(self):
+        orders = [TestOrder(str(i)) for i in range(25)]
+        self.assertEqual(
+            list(generate_links(orders, TestShop(), builder=self.builder, processes=2, chunk_size=4)),
+            list(generate_links(orders, TestShop(), builder=self.builder)))
+
+    @override_settings(POSTFINANCE_BASE_URL=None)
+    def test_base_url_required(self):
+        self.assertRaises(ImproperlyConfigured, PaymentLinkBuilder.from_settings)
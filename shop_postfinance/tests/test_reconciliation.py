@@ -0,0 +1,85 @@
+#-*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from shop_postfinance import reconciliation
+from shop_postfinance.models import (CompactPostfinanceIPN, PostfinanceIPN,
+    PostfinanceOrderState)
+from shop_postfinance.tests.shop import TestShop
+
+
+def export_row(order_id, pay_id, status, amount='54'):
+    return {'ORDERID': order_id, 'PAYID': pay_id, 'STATUS': status,
+            'AMOUNT': amount, 'CURRENCY': 'CHF'}
+
+
+class ReconcileTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.shop = TestShop()
+
+    def reconcile(self, rows, **kwargs):
+        events = {}
+        for kind, row in reconciliation.reconcile(rows, **kwargs):
+            events.setdefault(kind, []).append(row.get('orderID', row.get('ORDERID')))
+        return events
+
+    def test_report_then_confirm(self):
+        rows = [export_row('1', '10', '9'), export_row('2', '20', '5')]
+        self.assertEqual(self.reconcile(rows), {reconciliation.MISSING: ['1', '2']})
+        # The report wrote nothing...
+        self.assertEqual(PostfinanceIPN.objects.count(), 0)
+        self.assertEqual(PostfinanceOrderState.objects.count(), 0)
+        # ...so confirming afterwards still works.
+        events = self.reconcile(rows, shop=self.shop)
+        self.assertEqual(sorted(events[reconciliation.MISSING]), ['1', '2'])
+        self.assertEqual(sorted(self.shop.confirmations),
+                         [('1', '54', '10'), ('2', '54', '20')])
+        self.assertEqual(PostfinanceIPN.objects.count(), 2)
+        # Once recorded, the rows are there.
+        events = self.reconcile(rows, shop=self.shop)
+        self.assertEqual(sorted(events[reconciliation.PRESENT]), ['1', '2'])
+        self.assertEqual(len(self.shop.confirmations), 2)
+
+    def test_recorded_notifications_are_not_confirmed_again(self):
+        PostfinanceIPN.from_data(reconciliation.normalise(export_row('1', '10', '5'))).save()
+        PostfinanceOrderState.objects.create(orderID='1', PAYID='10', STATUS='5')
+        events = self.reconcile([export_row('1', '10', '5'), export_row('1', '10', '9')],
+                                shop=self.shop)
+        self.assertEqual(events, {reconciliation.PRESENT: ['1'],
+                                  reconciliation.MISSING: ['1']})
+        self.assertEqual(self.shop.confirmations, [])
+
+    def test_mismatched_amount(self):
+        row = reconciliation.normalise(export_row('1', '10', '9', amount='54'))
+        PostfinanceIPN.from_data(row).save()
+        events = self.reconcile([export_row('1', '10', '9', amount='55.00')], shop=self.shop)
+        self.assertEqual(events, {reconciliation.MISMATCHED: ['1']})
+
+    def test_unknown_order(self):
+        events = self.reconcile([export_row('unknown-1', '10', '9')], shop=self.shop)
+        self.assertEqual(events, {reconciliation.MISSING: ['unknown-1'],
+                                  reconciliation.UNKNOWN_ORDER: ['unknown-1']})
+
+    def test_invalid_rows(self):
+        events = self.reconcile([{'ORDERID': '1', 'STATUS': '9'}])
+        self.assertEqual(list(events), [reconciliation.INVALID])
+
+    @override_settings(POSTFINANCE_COMPACT_LEDGER=True)
+    def test_compact_ledger_keys(self):
+        # The compact ledger reads PAYID 0123 back as 123.
+        rows = [export_row('1', '0123', '9')]
+        self.assertEqual(self.reconcile(rows, shop=self.shop),
+                         {reconciliation.MISSING: ['1']})
+        self.assertEqual(self.shop.confirmations, [('1', '54', '0123')])
+        self.assertEqual(CompactPostfinanceIPN.objects.get().PAYID, 123)
+        self.assertEqual(self.reconcile(rows, shop=self.shop),
+                         {reconciliation.PRESENT: ['1']})
+
+    def test_csv(self):
+        export = ['ORDERID;PAYID;STATUS;AMOUNT;CURRENCY', '1;10;9;54,50;CHF']
+        rows = list(reconciliation.iter_csv(export))
+        self.reconcile(rows, shop=self.shop)
+        self.assertEqual(PostfinanceIPN.objects.get().amount, '54.5')
@@ -0,0 +1,53 @@
+#-*- coding: utf-8 -*-
+from datetime import date, datetime
+
+from django.test import TestCase
+
+from shop_postfinance import reporting
+from shop_postfinance.models import PostfinanceIPN
+
+
+class RollupsTestCase(TestCase):
+
+    def record(self, created_at, order_id, status='9', amount='54.00', currency='CHF'):
+        ipn = PostfinanceIPN.objects.create(
+            orderID=order_id, PAYID='1%s' % order_id, STATUS=status, amount=amount,
+            currency=currency, PM='CreditCard', BRAND='VISA')
+        PostfinanceIPN.objects.filter(pk=ipn.pk).update(created_at=created_at)
+
+    def totals(self, **filters):
+        return [(row['currency'], row['count'], row['amount'])
+                for row in reporting.totals(date(2013, 1, 1), date(2013, 1, 31), **filters)]
+
+    def test_update(self):
+        self.record(datetime(2013, 1, 5, 10), '1')
+        self.record(datetime(2013, 1, 5, 11), '2', amount='10.50')
+        self.record(datetime(2013, 1, 6, 9), '3', status='93')
+        self.record(datetime(2013, 1, 6, 9), '4', currency='EUR', amount='1')
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 2, 1)), 4)
+        self.assertEqual(self.totals(), [('CHF', 3, 11850), ('EUR', 1, 100)])
+        self.assertEqual(self.totals(STATUS='9', currency='CHF'), [('CHF', 2, 6450)])
+        self.assertEqual(reporting.get_watermark(), datetime(2013, 2, 1))
+
+    def test_counted_once(self):
+        self.record(datetime(2013, 1, 5, 10), '1')
+        self.record(datetime(2013, 1, 7, 10), '2')
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 1, 6)), 1)
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 1, 6)), 0)
+        self.record(datetime(2013, 1, 8, 10), '3')
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 2, 1)), 2)
+        self.assertEqual(self.totals(), [('CHF', 3, 16200)])
+
+    def test_batches(self):
+        for i in range(5):
+            self.record(datetime(2013, 1, 5 + i % 2, 10, i), str(i))
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 2, 1), batch_size=2), 5)
+        self.assertEqual(self.totals(), [('CHF', 5, 27000)])
+
+    def test_reset(self):
+        self.record(datetime(2013, 1, 5, 10), '1')
+        reporting.update_rollups(until=datetime(2013, 2, 1))
+        reporting.reset()
+        self.assertEqual(self.totals(), [])
+        self.assertEqual(reporting.update_rollups(until=datetime(2013, 2, 1)), 1)
+        self.assertEqual(self.totals(), [('CHF', 1, 5400)])
@@ -0,0 +1,87 @@
+#-*- coding: utf-8 -*-
+from django.core.exceptions import ImproperlyConfigured
+from django.http import QueryDict
+from django.test import SimpleTestCase
+
+from shop_postfinance.utils import ShaSigner
+
+# The example of PostFinance's e-Commerce integration guide.
+SECRET_KEY = 'Mysecretsig1875!?'
+DATA = {
+    'AMOUNT': '1500',
+    'CURRENCY': 'EUR',
+    'LANGUAGE': 'en_US',
+    'ORDERID': '1234',
+    'PSPID': 'MyPSPID',
+}
+SIGNATURES = {
+    'sha1': 'F4CC376CD7A834D997B91598FA747825A238BE0A',
+    'sha256': 'E019359BAA3456AE5A986B6AABD22CF1B3E09438739E97F17A7F61DF5A11B30F',
+    'sha512': ('D1CFE8833A297D0922E908B2B44934B09EE966EF1584DC0D696304E07BB58BA7'
+               '1973C2383C831D878D8A243BB7D7DFFFBE53CEE21955CDFEF44FE82E551F859D'),
+}
+
+
+class ShaSignerTestCase(SimpleTestCase):
+
+    def test_known_vectors(self):
+        for algorithm, signature in SIGNATURES.items():
+            self.assertEqual(ShaSigner(SECRET_KEY, algorithm).sign(DATA), signature)
+
+    def test_algorithm_is_case_insensitive(self):
+        self.assertEqual(ShaSigner(SECRET_KEY, 'SHA256').sign(DATA), SIGNATURES['sha256'])
+
+    def test_unknown_algorithm(self):
+        self.assertRaises(ImproperlyConfigured, ShaSigner, SECRET_KEY, 'md5')
+
+    def test_missing_key(self):
+        self.assertRaises(ImproperlyConfigured, ShaSigner, None)
+        self.assertRaises(ImproperlyConfigured, ShaSigner, '')
+
+    def test_empty_values_are_skipped(self):
+        data = dict(DATA, CN='', COMPLUS=None)
+        self.assertEqual(ShaSigner(SECRET_KEY).sign(data), SIGNATURES['sha1'])
+
+    def test_keys_are_ordered_case_insensitively(self):
+        # The way PostFinance sends them back: mixed case, in any order.
+        data = {'pspid': 'MyPSPID', 'orderID': '1234', 'Language': 'en_US',
+                'currency': 'EUR', 'amount': '1500'}
+        self.assertEqual(ShaSigner(SECRET_KEY).sign(data), SIGNATURES['sha1'])
+
+    def test_shasign_is_excluded(self):
+        for key in ('SHASIGN', 'SHASign', 'shasign'):
+            data = dict(DATA, **{key: 'whatever'})
+            self.assertEqual(ShaSigner(SECRET_KEY).sign(data), SIGNATURES['sha1'])
+
+    def test_query_dict(self):
+        data = QueryDict('', mutable=True)
+        data.update(DATA)
+        self.assertEqual(ShaSigner(SECRET_KEY).sign(data), SIGNATURES['sha1'])
+
+    def test_verify(self):
+        signer = ShaSigner(SECRET_KEY, 'sha256')
+        self.assertTrue(signer.verify(dict(DATA, SHASIGN=SIGNATURES['sha256'])))
+        self.assertTrue(signer.verify(dict(DATA, SHASIGN=SIGNATURES['sha256'].lower())))
+
+    def test_verify_rejects_tampered_value(self):
+        data = dict(DATA, AMOUNT='1', SHASIGN=SIGNATURES['sha1'])
+        self.assertFalse(ShaSigner(SECRET_KEY).verify(data))
+
+    def test_verify_rejects_other_key(self):
+        data = dict(DATA, SHASIGN=SIGNATURES['sha1'])
+        self.assertFalse(ShaSigner('another key').verify(data))
+
+    def test_verify_rejects_missing_signature(self):
+        signer = ShaSigner(SECRET_KEY)
+        self.assertFalse(signer.verify(DATA))
+        self.assertFalse(signer.verify(dict(DATA, SHASIGN='')))
+
+    def test_verify_many(self):
+        payloads = [
+            dict(DATA, SHASIGN=SIGNATURES['sha1']),
+            dict(DATA, AMOUNT='1', SHASIGN=SIGNATURES['sha1']),
+            DATA,
+            dict(DATA, ORDERID='1234', SHASIGN=SIGNATURES['sha1']),
+        ]
+        self.assertEqual(list(ShaSigner(SECRET_KEY).verify_many(payloads)),
+                         [True, False, False, True])
@@ -0,0 +1,110 @@
+#-*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+
+from shop_postfinance import statemachine
+from shop_postfinance.models import PostfinanceOrderState, PostfinanceStatusTransition
+from shop_postfinance.signals import payment_status_changed
+
+
+def notification(status, pay_id='100', order_id='1'):
+    return {'orderID': order_id, 'PAYID': pay_id, 'STATUS': status}
+
+
+class ApplyNotificationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def apply(self, *args, **kwargs):
+        return statemachine.apply_notification(notification(*args, **kwargs))
+
+    def state(self, order_id='1'):
+        state = PostfinanceOrderState.objects.get(orderID=order_id)
+        return state.PAYID, state.STATUS
+
+    def test_new_order(self):
+        transition = self.apply('9')
+        self.assertEqual(transition, statemachine.Transition('1', '100', None, '9'))
+        self.assertTrue(statemachine.confirms_payment(transition))
+        self.assertEqual(self.state(), ('100', '9'))
+
+    def test_authorised_then_paid_confirms_once(self):
+        self.assertTrue(statemachine.confirms_payment(self.apply('5')))
+        transition = self.apply('9')
+        self.assertEqual(transition.old_status, '5')
+        self.assertFalse(statemachine.confirms_payment(transition))
+        self.assertEqual(self.state(), ('100', '9'))
+
+    def test_no_way_back(self):
+        self.apply('9')
+        self.assertEqual(self.apply('5'), None)
+        self.assertEqual(self.apply('9'), None)
+        self.assertEqual(self.state(), ('100', '9'))
+        self.assertEqual(PostfinanceStatusTransition.objects.count(), 1)
+
+    def test_refused_after_payment(self):
+        self.apply('9')
+        self.assertEqual(self.apply('93').old_status, '9')
+
+    def test_new_payment_after_failure(self):
+        self.apply('9')
+        # A paid order doesn't start over...
+        self.assertEqual(self.apply('5', pay_id='101'), None)
+        self.apply('93')
+        # ...a refused one does.
+        transition = self.apply('5', pay_id='200')
+        self.assertTrue(statemachine.confirms_payment(transition))
+        self.assertEqual(self.state(), ('200', '5'))
+
+    def test_unknown_status(self):
+        self.assertEqual(self.apply('7'), None)
+        self.assertFalse(PostfinanceOrderState.objects.exists())
+
+    def test_stale_cache_is_not_trusted(self):
+        # The cache still holds (100, 5) while the payment was refused since.
+        PostfinanceOrderState.objects.create(orderID='1', PAYID='100', STATUS='93')
+        statemachine._remember('1', '100', '5')
+        transition = self.apply('5', pay_id='200')
+        self.assertEqual(transition, statemachine.Transition('1', '200', '93', '5'))
+        # Nor does it allow what the database doesn't.
+        statemachine._remember('1', '200', '51')
+        self.assertEqual(self.apply('51', pay_id='200'), None)
+        self.assertEqual(self.state(), ('200', '5'))
+
+    def test_is_current(self):
+        statemachine._remember('1', '100', '9')
+        self.assertTrue(statemachine.is_current(notification('9')))
+        self.assertFalse(statemachine.is_current(notification('93')))
+        self.assertFalse(statemachine.is_current(notification('9', order_id='2')))
+
+
+class CommitTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.received = []
+        payment_status_changed.connect(self.receiver)
+
+    def tearDown(self):
+        payment_status_changed.disconnect(self.receiver)
+
+    def receiver(self, **kwargs):
+        self.received.append((kwargs['old_status'], kwargs['new_status']))
+
+    def test_signal_and_cache_after_commit(self):
+        statemachine.apply_notification(notification('5'))
+        self.assertEqual(self.received, [(None, '5')])
+        self.assertTrue(statemachine.is_current(notification('5')))
+
+    def test_nothing_on_rollback(self):
+        from django.db import transaction
+        try:
+            with transaction.atomic():
+                statemachine.apply_notification(notification('5'))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.received, [])
+        self.assertFalse(statemachine.is_current(notification('5')))
+        self.assertFalse(PostfinanceOrderState.objects.exists())
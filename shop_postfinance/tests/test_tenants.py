@@ -0,0 +1,63 @@
+#-*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+from shop_postfinance import tenants
+from shop_postfinance.models import PostfinanceIPN
+from shop_postfinance.tests.urls import backend
+from shop_postfinance.utils import get_signer
+
+TENANTS = {
+    'ch': {'PSP_ID': 'shopch', 'SECRET_KEY': 'in-ch', 'SHAOUT_KEY': 'out-ch',
+           'CURRENCY': 'CHF', 'ORDER_ID_PREFIX': 'CH-'},
+    'eu': {'PSP_ID': 'shopeu', 'SECRET_KEY': 'in-eu', 'SHAOUT_KEY': 'out-eu',
+           'CURRENCY': 'EUR', 'ORDER_ID_PREFIX': 'EU-', 'HOSTS': ['shop.eu']},
+}
+
+
+def signed(shaout_key, **data):
+    data.setdefault('PAYID', '100')
+    data.setdefault('STATUS', '9')
+    data.setdefault('amount', '54.00')
+    data['SHASIGN'] = get_signer(shaout_key).sign(data)
+    return data
+
+
+@override_settings(POSTFINANCE_TENANTS=TENANTS)
+class TenantRoutingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+
+    def test_by_psp_id(self):
+        # The PSPID wins over the orderID prefix.
+        config = tenants.for_notification({'PSPID': 'shopeu', 'orderID': 'CH-1'})
+        self.assertEqual(config.name, 'eu')
+
+    def test_by_prefix(self):
+        self.assertEqual(tenants.for_notification({'orderID': 'EU-1'}).name, 'eu')
+        self.assertEqual(tenants.for_notification({'PSPID': 'other', 'orderID': 'CH-1'}).name, 'ch')
+
+    def test_signature_key_of_the_tenant(self):
+        data = signed('out-eu', PSPID='shopeu', orderID='1')
+        self.assertTrue(backend.verify_payment_data(data))
+        data = signed('out-ch', PSPID='shopeu', orderID='1')
+        self.assertFalse(backend.verify_payment_data(data))
+
+    def test_ipn_routed_by_psp_id(self):
+        response = self.client.post('/pay/instantpaymentnotification/',
+                                    signed('out-ch', PSPID='shopch', orderID='1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PostfinanceIPN.objects.get().orderID, '1')
+        self.assertEqual(len(backend.shop.confirmations), 1)
+
+    @override_settings(ALLOWED_HOSTS=['shop.eu', 'shop.ch'])
+    def test_checkout(self):
+        self.assertEqual(tenants.for_checkout(currency='eur').name, 'eu')
+        request = RequestFactory().get('/', HTTP_HOST='shop.eu')
+        self.assertEqual(tenants.for_checkout(request).name, 'eu')
+        # Neither "ch" nor "default": the first one by name.
+        request = RequestFactory().get('/', HTTP_HOST='shop.ch')
+        self.assertEqual(tenants.for_checkout(request).name, 'ch')
@@ -0,0 +1,136 @@
+#-*- coding: utf-8 -*-
+import threading
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from shop_postfinance import ipn_filter
+from shop_postfinance.models import PostfinanceIPN, PostfinanceOrderState
+from shop_postfinance.tests.shop import notification
+from shop_postfinance.tests.urls import backend
+
+IPN_URL = '/pay/instantpaymentnotification/'
+SUCCESS_URL = '/pay/success/'
+
+
+class IPNViewTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+
+    def post(self, data):
+        # Every delivery is new to the filter's replay cache.
+        ipn_filter.get_filter().seen.clear()
+        return self.client.post(IPN_URL, data)
+
+    def state(self, order_id='1'):
+        state = PostfinanceOrderState.objects.get(orderID=order_id)
+        return state.PAYID, state.STATUS
+
+    def test_paid(self):
+        response = self.post(notification())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'OKAY')
+        self.assertEqual(backend.shop.confirmations, [('1', '54.00', '100')])
+        self.assertEqual(self.state(), ('100', '9'))
+
+    def test_bad_signature(self):
+        data = notification()
+        data['amount'] = '0.01'
+        self.assertEqual(self.post(data).status_code, 400)
+        self.assertFalse(PostfinanceIPN.objects.exists())
+        self.assertEqual(backend.shop.confirmations, [])
+
+    def test_unknown_order(self):
+        self.assertEqual(self.post(notification(order_id='unknown-1')).status_code, 404)
+        self.assertFalse(PostfinanceIPN.objects.exists())
+
+    def test_duplicates_confirm_once(self):
+        self.post(notification())
+        # Caught by the cache...
+        self.assertEqual(self.post(notification()).content, b'OKAY')
+        # ...and by the ledger once the cache forgot about it.
+        cache.clear()
+        self.assertEqual(self.post(notification()).content, b'OKAY')
+        self.assertEqual(len(backend.shop.confirmations), 1)
+        self.assertEqual(PostfinanceIPN.objects.count(), 1)
+
+    def test_success_page_then_ipn(self):
+        response = self.client.get(SUCCESS_URL, notification())
+        self.assertEqual(response['Location'], '/finished/')
+        self.post(notification())
+        self.assertEqual(len(backend.shop.confirmations), 1)
+
+    def test_authorised_then_paid_confirms_once(self):
+        self.post(notification(status='5'))
+        self.post(notification(status='9'))
+        self.assertEqual(backend.shop.confirmations, [('1', '54.00', '100')])
+        self.assertEqual(self.state(), ('100', '9'))
+        self.assertEqual(PostfinanceIPN.objects.count(), 2)
+
+    def test_paid_then_late_authorised(self):
+        self.post(notification(status='9'))
+        self.post(notification(status='5'))
+        self.assertEqual(len(backend.shop.confirmations), 1)
+        # Recorded, but the order doesn't go back.
+        self.assertEqual(PostfinanceIPN.objects.count(), 2)
+        self.assertEqual(self.state(), ('100', '9'))
+
+    def test_shop_failure_records_nothing(self):
+        backend.shop.fail = ValueError('shop down')
+        try:
+            self.assertRaises(ValueError, self.post, notification())
+        finally:
+            backend.shop.fail = None
+        self.assertFalse(PostfinanceIPN.objects.exists())
+        self.assertFalse(PostfinanceOrderState.objects.exists())
+        # PostFinance's next attempt goes through.
+        self.post(notification())
+        self.assertEqual(len(backend.shop.confirmations), 1)
+
+
+class RecordPaymentDataTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+
+    def test_idempotent(self):
+        ipn, created = backend.record_payment_data(notification())
+        self.assertTrue(created)
+        for _ in range(2):
+            ipn, created = backend.record_payment_data(notification())
+            self.assertFalse(created)
+        self.assertEqual(len(backend.shop.confirmations), 1)
+        self.assertEqual(PostfinanceIPN.objects.count(), 1)
+
+
+class ConcurrentIPNTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        backend.shop.confirmations = []
+
+    def test_concurrent_deliveries_confirm_once(self):
+        start = threading.Event()
+        errors = []
+
+        def deliver():
+            try:
+                start.wait()
+                backend.record_payment_data(notification())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=deliver) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(backend.shop.confirmations), 1)
+        self.assertEqual(PostfinanceIPN.objects.count(), 1)
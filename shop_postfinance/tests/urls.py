@@ -0,0 +1,28 @@
+#-*- coding: utf-8 -*-
+import django
+from django.contrib import admin
+from django.http import HttpResponse
+
+try:
+    from django.urls import include, re_path as url
+except ImportError:  # Django < 2.0
+    from django.conf.urls import include, url
+
+from shop_postfinance.offsite_postfinance import get_backend
+
+# Its shop is the TestShop of shop_postfinance.tests.shop.
+backend = get_backend()
+
+
+def cart_delete(request):
+    return HttpResponse('')
+
+
+urlpatterns = [
+    url(r'^admin/', admin.site.urls),
+    url(r'^pay/', include(backend.get_urls())),
+    url(r'^cart/delete/$', cart_delete, name='cart_delete'),
+]
+if django.VERSION >= (3, 1):
+    urlpatterns.append(
+        url(r'^async/', include((backend.get_async_urls(), 'async'), namespace='async')))
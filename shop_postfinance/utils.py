@@ -1,49 +1,116 @@
 #-*- coding: utf-8 -*-
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import constant_time_compare
 import hashlib
 
-def security_check(data, secret_key):
+HASH_ALGORITHMS = {
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'sha512': hashlib.sha512,
+}
+
+
+class ShaSigner(object):
     '''
-    Performs a postfinance security check. That is, it compares the SHA1 provided by the request to
-    a SHA1 sum of the parameters (passed via GET or POST), ordered alphabetically, and separated by the
-    secret key.
+    Computes and checks postfinance SHA-IN/SHA-OUT signatures: the non-empty
+    parameters, ordered alphabetically by their upper-cased name, each
+    followed by the secret key.
 
-    Data should be a dictionnary, as provided by a request's POST or GET
+    The sorted order of a given set of parameter names (the "plan") is
+    computed once and reused, postfinance always sends the same parameters.
     '''
-    cap_data = {}
-    string_list = []
+    max_plans = 128
 
-    for key, val in data.iteritems():
-        cap_data[key.upper()] = val # make all keys capital letters
+    def __init__(self, secret_key, algorithm='sha1'):
+        try:
+            self.hash = HASH_ALGORITHMS[algorithm.lower()]
+        except KeyError:
+            raise ImproperlyConfigured(
+                'Unsupported postfinance hash algorithm %r, use one of %s.' % (
+                    algorithm, ', '.join(sorted(HASH_ALGORITHMS))))
+        if not secret_key:
+            # A missing key would be signed as "None" (or nothing), making
+            # every signature computable by anybody.
+            raise ImproperlyConfigured('A postfinance signer needs a secret key.')
+        self.secret_key = secret_key
+        self.algorithm = algorithm.lower()
+        self._plans = {}
 
-    for key in sorted(cap_data.keys()):
-        if key != 'SHASIGN':
-#            if key == 'AMOUNT': # Must be: cap_data['AMOUNT'] = "%.0f" % (cap_data['AMOUNT']*100)
-#                entry = "%s=%.0f" % (key,float(cap_data[key])*100)
-#            else:
-            entry = "%s=%s" % (key,cap_data[key])
-            string_list.append(entry)
+    def _plan(self, data):
+        keys = frozenset(data)
+        plan = self._plans.get(keys)
+        if plan is None:
+            plan = tuple(sorted(
+                ((key.upper(), key) for key in keys if key.upper() != 'SHASIGN'),
+            ))
+            if len(self._plans) >= self.max_plans:
+                self._plans.clear()
+            self._plans[keys] = plan
+        return plan
 
-    # Now we have a sorted list of parameters that have capital keys (like the doc says)
+    def sign(self, data):
+        '''
+        Returns the signature of the parameters in ``data`` (a dictionary or
+        a QueryDict), ignoring any SHASIGN it may contain.
+        '''
+        secret_key = self.secret_key
+        parts = []
+        for name, key in self._plan(data):
+            value = data[key]
+            if value is not None and value != '':
+                parts.append(u'%s=%s%s' % (name, value, secret_key))
+        hash_string = u''.join(parts)
+        return self.hash(hash_string.encode('utf8')).hexdigest().upper()
 
-    hash_string = secret_key.join(string_list)
-    hash_string = "%s%s" % (hash_string, secret_key)
+    def verify(self, data):
+        '''
+        Compares the SHASIGN in ``data`` to the signature of its other
+        parameters, in constant time.
+        '''
+        signature = data.get('SHASIGN')
+        if not signature:
+            return False
+        return constant_time_compare(self.sign(data), signature.upper())
 
-    #hash_string =  "AMOUNT=%s%sCURRENCY=%s%sLANGUAGE=%s%sORDERID=%s%sPSPID=%s%s" #% (amount, key, currency, key, language, key, order_id, key, pspid, key)
-    s = hashlib.sha1()
-    s.update(hash_string.encode('utf8'))
-    hex = s.hexdigest().upper()
-    original = data['SHASIGN']
-    return hex == original
+    def verify_many(self, payloads):
+        '''
+        Checks a batch of payloads (reconciliation jobs and the like), yields
+        one boolean per payload.
+        '''
+        verify = self.verify
+        for data in payloads:
+            yield verify(data)
+
+
+_signers = {}
+
+
+def get_signer(secret_key, algorithm=None):
+    '''
+    Returns the (shared) signer for ``secret_key``, using the algorithm set in
+    POSTFINANCE_HASH_ALGORITHM (SHA-1 by default) unless another one is given.
+    '''
+    if algorithm is None:
+        algorithm = getattr(settings, 'POSTFINANCE_HASH_ALGORITHM', 'sha1')
+    signer = _signers.get((secret_key, algorithm))
+    if signer is None:
+        signer = _signers[(secret_key, algorithm)] = ShaSigner(secret_key, algorithm)
+    return signer
+
+
+def security_check(data, secret_key):
+    '''
+    Performs a postfinance security check. That is, it compares the SHA provided by the request to
+    a SHA sum of the parameters (passed via GET or POST), ordered alphabetically, and separated by the
+    secret key.
+
+    Data should be a dictionnary, as provided by a request's POST or GET
+    '''
+    return get_signer(secret_key).verify(data)
 
 
 def compute_security_checksum(**data):
     ''' Used to send a security checksum of parameters to postfinance '''
-    secret_key = settings.POSTFINANCE_SECRET_KEY
-    contents = dict([(key.upper(), value) for key, value in data.items()])
-    hash_string = ""
-    for key, value in sorted(contents.items()):
-        hash_string += "%s=%s%s" % (key, value, secret_key)
-    output = hashlib.sha1(hash_string.encode('utf8')).hexdigest().upper()
-    return output
+    return get_signer(settings.POSTFINANCE_SECRET_KEY).sign(data)